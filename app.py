@@ -1,58 +1,336 @@
+import asyncio
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import date
 from typing import List
-import pandas as pd
-from app_files.image_upload import upload_image_to_imgur
-from app_files.airtable_utils import (
-    get_species_image,
-    get_airtable_data,
-    get_url,
-    get_headers,
+from app_files.catalog_artifact import load_catalog
+from app_files.upload_pipeline import UploadError, UploadPipeline
+from app_files.image_store import ImageStore
+from app_files.image_cache import SpeciesImageCache
+from app_files.card_cache import SpecimenCardCache
+from app_files.search_index import SpeciesSearchIndex
+from app_files.identification_key import DichotomousKey
+from app_files.prefetch import DEFAULT_SIDECAR_PATH, load_sidecar
+from app_files.sync import sync_records
+from app_files.sinks import AirtableSink, open_sink
+from app_files.telemetry import Metric, telemetry
+from app_files.http_client import http_client
+from app_files.observation_queue import UPLOAD_LEASE, ObservationQueue
+from app_files.observation_buffer import ObservationBuffer
+from app_files.validation import ObservationValidator
+from app_files.observation_grid import MESSAGE_TYPE, GridState
+from app_files.reactive_utils import debounce, session_trace
+from app_files.observation_io import (
+    MEDIA_TYPES,
+    available_formats,
+    export_rows,
+    stream_observations,
+)
+from app_files.survey_rollup import SurveyRollup
+from app_files.airtable_mirror import (
+    OBSERVATION_ID_FIELD,
+    OBSERVATION_KEY_FIELDS,
+    AirtableMirror,
+    MirrorError,
 )
 from app_files.navbar_utils import (
     record_observation,
     verify_observation,
     dichotomous_key,
+    key_node_ui,
+    possible_candidates_ui,
+    performance_panel,
+    performance_ui,
+    survey_summary,
+    summary_frame,
+    summary_figure,
+    summary_table_ui,
+    SUMMARY_MESSAGE_TYPE,
+    PLOTLY_JS_PATH,
     release_notes,
+    device_cookie,
+    DEVICE_COOKIE,
+    SPECIMEN_SELECTIZE_CONFIG,
 )
-import requests
 from shiny import App, Inputs, Outputs, Session, reactive, render, ui, req
 from shiny.types import ImgData
+from starlette.responses import (
+    FileResponse,
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+)
+from starlette.routing import Route
 
 from shiny.types import NavSetArg
 
 
-# read data from csv file
-df = pd.read_csv("data.csv", keep_default_na=False)
+# data files live next to app.py, whatever directory the app is started from
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# the SQLite caches and queue too, unless ARTHROPOD_STATE_DIR points elsewhere
+STATE_DIR = os.environ.get("ARTHROPOD_STATE_DIR", APP_DIR)
+
+# map the species catalog from its prebuilt artifact, rebuilt when data.csv changes;
+# every worker process maps the same file, so the OS keeps one copy for all of them
+catalog = load_catalog(
+    os.path.join(APP_DIR, "data.csv"),
+    os.path.join(APP_DIR, "data.catalog"),
+    mapped=True,
+)
+search_index = SpeciesSearchIndex(catalog)
+# the dichotomous key, compiled once into a decision tree over the catalog
+identification_key = DichotomousKey.from_json(
+    os.path.join(APP_DIR, "dichotomous_key.json"), catalog
+)
 
+# iNaturalist photo URLs, shared by all sessions and kept across restarts
+image_cache = SpeciesImageCache(os.path.join(STATE_DIR, "species_images.sqlite3"))
+# seed it with the photos prefetched by `python -m app_files.prefetch`, if any
+# (as fetched now, so that they do not expire a TTL after the file was built)
+prefetched, _ = load_sidecar(os.path.join(APP_DIR, DEFAULT_SIDECAR_PATH))
+image_cache.preload(prefetched)
 
-def nav_controls() -> List[NavSetArg]:
+# specimen cards, built once per worker and reused by every session
+card_cache = SpecimenCardCache(catalog, image_cache)
+
+# recorded observations that have not been synced yet, kept across restarts
+observation_queue = ObservationQueue(os.path.join(STATE_DIR, "observations.sqlite3"))
+
+# counts of the observations by day, survey spot and species, updated as they are
+# recorded, cleared and synced, for the Survey summary tab
+survey_rollup = SurveyRollup(os.path.join(STATE_DIR, "survey_rollup.sqlite3"), catalog)
+
+# photos picked for upload, by SHA-256: where they were uploaded, and thumbnails
+image_store = ImageStore(os.path.join(STATE_DIR, "image_store"))
+
+# image uploads run in the background so that recording never waits on Imgur;
+# the photos wait in the spool directory, as they may outlive their session
+upload_pipeline = UploadPipeline(
+    store=image_store, spool_dir=os.path.join(STATE_DIR, "upload_spool")
+)
+
+# checks observations against the catalog and survey.json, one sync batch at a time
+validator = ObservationValidator(
+    os.path.join(APP_DIR, "data.csv"), os.path.join(APP_DIR, "survey.json"), catalog
+)
+
+# "Image status" of an observation whose image is still being uploaded
+UPLOADING = "uploading"
+# most species a search of the specimen picker returns, as many as it shows
+SPECIMEN_SEARCH_LIMIT = SPECIMEN_SELECTIZE_CONFIG["maxOptions"]
+# fields kept in the app only, never synced
+LOCAL_FIELDS = ("Thumbnail", "Image status", "Problems")
+# seconds between the worker's syncs of the observations of no device
+UNOWNED_SYNC_SECONDS = 300
+# seconds between the checks of images another session is uploading
+UPLOAD_CHECK_SECONDS = 5
+
+# where synced observations go: Airtable unless ARTHROPOD_SINK says otherwise,
+# e.g. "sqlite:/data/observations.sqlite3" or "jsonl:https://example.org/ingest"
+observation_sink = open_sink(os.environ.get("ARTHROPOD_SINK", "airtable"))
+
+# set ARTHROPOD_AIRTABLE_MIRROR=1 to pull the Airtable observation table into a
+# local mirror before each sync, and skip observations that are already there
+airtable_mirror = None
+if os.environ.get("ARTHROPOD_AIRTABLE_MIRROR") == "1" and isinstance(
+    observation_sink, AirtableSink
+):
+    airtable_mirror = AirtableMirror(
+        os.path.join(STATE_DIR, "airtable_mirror.sqlite3"),
+        key_fields={observation_sink.table: OBSERVATION_KEY_FIELDS},
+    )
+# every observation gets an ID when it is recorded, and keeps it when a sync is
+# retried, so that the mirror can tell a retry from a new observation. The
+# Airtable table needs an "Observation ID" text field for it, so without the
+# mirror the ID is not sent to Airtable.
+SEND_OBSERVATION_IDS = airtable_mirror is not None or not isinstance(
+    observation_sink, AirtableSink
+)
+
+# set ARTHROPOD_ADMIN_TAB=1 to show the Performance tab
+ADMIN_TAB = os.environ.get("ARTHROPOD_ADMIN_TAB") == "1"
+active_sessions = {"count": 0}
+
+
+def _image_cache_metrics():
+    stats = image_cache.stats()
     return [
+        Metric(
+            "image_cache_lookups_total",
+            "counter",
+            "Species photo lookups by the cache level that answered them.",
+            [
+                ({"result": "memory_hit"}, stats["memory_hits"]),
+                ({"result": "disk_hit"}, stats["disk_hits"]),
+                ({"result": "miss"}, stats["misses"]),
+            ],
+        )
+    ]
+
+
+telemetry.gauge(
+    "observation_queue_depth",
+    observation_queue.pending_count,
+    "Observations recorded but not synced yet.",
+)
+telemetry.gauge(
+    "active_sessions", lambda: active_sessions["count"], "Open Shiny sessions."
+)
+telemetry.add_collector(http_client.metrics)
+telemetry.add_collector(_image_cache_metrics)
+
+
+def already_in_airtable(records):
+    """
+    Pulls the changes of the observation table into the mirror, then finds
+    the records that are already in it, such as the ones of an earlier sync
+    whose response was lost.
+
+    Returns:
+        set: The keys of those records; empty without a mirror, or when the
+        pull failed.
+    """
+    if airtable_mirror is None or not records:
+        return set()
+    sink = observation_sink
+    try:
+        airtable_mirror.pull(sink.table, sink.url, sink.headers)
+    except MirrorError as e:
+        print(f"Could not check Airtable for duplicates: {e}")
+        return set()
+    return airtable_mirror.existing(sink.table, records)
+
+
+def sync_unowned():
+    """
+    Syncs the queued observations of no device: imported ones, and the ones
+    of sessions without a device cookie that ended before syncing. Every
+    worker runs it now and then; claims keep two of them from pushing the
+    same observation.
+
+    Returns:
+        int: The number of observations synced.
+    """
+    kept_back = LOCAL_FIELDS
+    if not SEND_OBSERVATION_IDS:
+        kept_back += (OBSERVATION_ID_FIELD,)
+    ready = []
+    unowned = observation_queue.unowned()
+    live = observation_queue.live_uploads([obs_id for obs_id, _ in unowned])
+    for obs_id, fields in unowned:
+        if fields.get("Image status") == UPLOADING:
+            if obs_id in live:
+                continue
+            # its lease ran out, so the upload died with the worker doing it
+            fields["Image status"] = "failed: upload interrupted"
+            observation_queue.update(obs_id, fields)
+        if not fields.get(OBSERVATION_ID_FIELD):
+            # kept when the sync is retried, like the IDs of recorded observations
+            fields[OBSERVATION_ID_FIELD] = uuid.uuid4().hex
+            observation_queue.update(obs_id, fields)
+        ready.append(
+            (obs_id, {k: v for k, v in fields.items() if k not in kept_back})
+        )
+    ready, problems = validator.validate_records(ready)
+    for obs_id, problem in problems.items():
+        print(f"Queued observation {obs_id} was not synced: {problem}")
+    claimed = set(observation_queue.claim([obs_id for obs_id, _ in ready]))
+    records = [record for record in ready if record[0] in claimed]
+    duplicates = already_in_airtable(records)
+    fields = dict(records)
+    records = [record for record in records if record[0] not in duplicates]
+    result = sync_records(records, observation_sink)
+    for error in result.errors:
+        print(error)
+    observation_queue.acknowledge(list(result.synced) + list(duplicates))
+    observation_queue.release(result.failed)
+    survey_rollup.mark_synced(
+        [fields[obs_id] for obs_id in [*result.synced, *duplicates]]
+    )
+    return len(result.synced)
+
+
+def _sync_unowned_forever():
+    while True:
+        time.sleep(UNOWNED_SYNC_SECONDS)
+        try:
+            sync_unowned()
+        except Exception as e:  # keep trying; the next round may get through
+            print(f"Could not sync the observations of no device: {e}")
+
+
+threading.Thread(target=_sync_unowned_forever, daemon=True).start()
+
+
+def nav_controls() -> List[NavSetArg]:
+    controls = [
         record_observation(),
         verify_observation(),
         dichotomous_key(),
+        survey_summary(),
         release_notes(),
     ]
+    if ADMIN_TAB:
+        controls.append(performance_panel())
+    return controls
 
 
 app_ui = ui.page_navbar(
     title="SFBBO Arthropod Survey",
     *nav_controls(),
     id="navbar_id",
+    header=device_cookie(),
 )
 
+# device IDs the browsers are allowed to send in the device cookie
+DEVICE_PATTERN = re.compile(r"[0-9A-Za-z-]{8,64}")
+
+
+def device_id(session):
+    """
+    Returns the ID of the browser of a session, from its device cookie, or
+    None if it sent no valid one.
+    """
+    device = session.http_conn.cookies.get(DEVICE_COOKIE, "")
+    if DEVICE_PATTERN.fullmatch(device):
+        return device
+    return None
+
 
 def server(input, output, session):
     """
     This function is the main server function that handles the logic of the invertebrate survey app. It takes three arguments:
 
-    The function creates a new dataframe and sets it as a reactive value.
+    The function creates a buffer of the observations that are still waiting to be synced and tracks its changes in a reactive value.
     It then defines several reactive effects that update the UI based on user input.
     The function also defines several reactive events that handle user actions such as submitting and syncing data.
-    Finally, the function defines an output that displays the observations data frame in a data grid.
+    Finally, the function keeps the verify grid up to date by sending it the observations that changed.
 
     """
-    new_df = pd.DataFrame(
-        [],
-        columns=[
+    active_sessions["count"] += 1
+    # counts what each user action recomputes, with ARTHROPOD_TRACE_REACTIVE=1
+    trace = session_trace()
+    trace.attach(session)
+
+    # A session without a device cookie gets an ID of its own, so it only ever
+    # sees the observations it records. It leaves the observations of no device
+    # alone, as nobody could get them back after it ends, and gives up its own
+    # unsynced ones when it ends, for the worker to sync.
+    cookie_device = device_id(session)
+    device = cookie_device or f"session-{uuid.uuid4()}"
+
+    def _session_ended():
+        active_sessions["count"] -= 1
+        if cookie_device is None:
+            observation_queue.disown(device)
+
+    session.on_ended(_session_ended)
+
+    observations = ObservationBuffer(
+        [
             "Date observed",
             "Location",
             "Plot",
@@ -67,131 +345,322 @@ def server(input, output, session):
             "Species",
             "Count",
             "Notes",
-        ],
+            "Url",
+            "Image attachment",
+            # local only, never synced
+            "Thumbnail",
+            "Image status",
+            "Problems",
+        ]
     )
-    val = reactive.Value(new_df)
+    # Replay the observations this browser recorded before a reload or restart
+    # that were never synced
+    replayed = observation_queue.pending(device, adopt=cookie_device is not None)
+    live = observation_queue.live_uploads([obs_id for obs_id, _ in replayed])
+    for obs_id, fields in replayed:
+        changed = False
+        if fields.get("Image status") == UPLOADING and obs_id not in live:
+            # its lease ran out, so the upload died with the worker doing it
+            fields["Image status"] = "failed: upload interrupted"
+            changed = True
+        if not fields.get(OBSERVATION_ID_FIELD):
+            # imported, or queued before observations had IDs
+            fields[OBSERVATION_ID_FIELD] = uuid.uuid4().hex
+            changed = True
+        if changed:
+            observation_queue.update(obs_id, fields)
+        observations.append(obs_id, fields)
+    # observations whose image an earlier session of this browser is still
+    # uploading; the upload fills in the queue, and this session follows it
+    foreign_uploads = {
+        obs_id
+        for obs_id, fields in replayed
+        if fields.get("Image status") == UPLOADING and obs_id in live
+    }
+    # Set to the buffer's version after every change so that readers re-render
+    val = reactive.Value(observations.version)
+
+    @reactive.Effect
+    def _watch_uploads():
+        if not foreign_uploads:
+            return
+        reactive.invalidate_later(UPLOAD_CHECK_SECONDS)
+        current = observation_queue.pending_fields(foreign_uploads)
+        live = observation_queue.live_uploads(foreign_uploads)
+        for obs_id in list(foreign_uploads):
+            fields = current.get(obs_id)
+            if fields is not None and fields.get("Image status") == UPLOADING:
+                if obs_id in live:
+                    continue
+                fields["Image status"] = "failed: upload interrupted"
+                observation_queue.update(obs_id, fields)
+            foreign_uploads.discard(obs_id)
+            if obs_id not in observations:
+                continue
+            if fields is None:
+                # synced or cleared from another session meanwhile
+                observations.delete(obs_id)
+            else:
+                observations.update(obs_id, fields)
+        val.set(observations.version)
 
     notes_val = reactive.Value(None)
 
     @reactive.Effect
+    @trace.counted("show")
+    @telemetry.timed("show")
     def _show():
         """
         This function displays information and images related to a selected arthropod specimen.
 
-        It retrieves the input specimen, finds the corresponding image URL, ID notes, genus, and species from a dataframe.
-        If the image URL is not available or the genus and species are unknown, a default image URL is used.
-        The function then creates a UI card with the specimen name, image, ID notes, and an additional image (if available).
-        The card is stored in the 'notes_val' variable.
+        Cards of specimens that were already viewed in this worker are shown right away.
+        Otherwise the name and ID notes are shown immediately, and the card is replaced
+        by the full one with images once the selection has settled and they have been
+        looked up in the background. The card is stored in the 'notes_val' variable.
 
         Returns:
             None
         """
+        _cancel_card_loads()
         notes_val.set(None)
+        shown_specimen.update(name=None, complete=True)
         req(input.specimen())
         x = str(input.specimen())
-        id_notes = df.loc[df["Common Name"] == x, "ID notes"].values[0]
-        genus = df.loc[df["Common Name"] == x, "Genus"].values[0]
-        species = df.loc[df["Common Name"] == x, "Species"].values[0]
-        image_url = get_species_image(genus, species, 0)
-        if genus != "Unknown" and species != "Unknown":
-            image_url_2 = get_species_image(genus, species, 1)
-        else:
-            image_url, image_url_2 = "https://i.ibb.co/m6YDp69/sorry.jpg"
-        m = ui.card(
-            ui.h3(f"{x} ID notes"),
-            ui.tags.img(src=image_url, height="100%", width="100%"),
-            id_notes,
-            ui.tags.img(src=image_url_2, height="100%", width="100%"),
-        )
-        notes_val.set(m)
+        card = card_cache.get(x)
+        shown_specimen.update(name=x, complete=card is not None)
+        notes_val.set(card if card is not None else card_cache.text_card(x))
+
+    # the specimen once the picker has stayed on it for a moment, so that
+    # scrolling through species does not look up the photos of each of them
+    settled_specimen = debounce(input.specimen)
+
+    @reactive.Effect
+    @trace.counted("fetch_card")
+    def _fetch_card():
+        name = settled_specimen()
+        if name != shown_specimen["name"] or shown_specimen["complete"]:
+            return
+        task = asyncio.create_task(_load_card(name))
+        card_tasks.add(task)
+        task.add_done_callback(card_tasks.discard)
+
+    shown_specimen = {"name": None, "complete": True}
+    card_tasks = set()
+
+    def _cancel_card_loads():
+        # the photos already being fetched are still cached for the next view
+        for task in card_tasks:
+            task.cancel()
+            trace.count("load_card_cancelled")
+        card_tasks.clear()
+
+    @trace.counted("load_card")
+    @telemetry.timed("load_card")
+    async def _load_card(name):
+        """
+        Looks up the images of a specimen card off the event loop, then shows
+        the full card if the specimen is still selected.
+        """
+        loop = asyncio.get_running_loop()
+        card = await loop.run_in_executor(None, card_cache.full_card, name)
+        # past this point the load is no longer cancelled; it is checked instead
+        card_tasks.discard(asyncio.current_task())
+        async with reactive.lock():
+            if shown_specimen["name"] == name:
+                shown_specimen["complete"] = True
+                notes_val.set(card)
+                await reactive.flush()
 
     @render.ui
+    @trace.counted("notes")
     def notes():
         return notes_val.get()
 
-    @reactive.Effect
+    def _specimen_choices(request):
+        """
+        Answers the specimen picker's searches with the best matching species.
+        """
+        query = request.query_params.get("query", "")
+        try:
+            limit = int(request.query_params.get("maxop", SPECIMEN_SEARCH_LIMIT))
+        except ValueError:
+            limit = SPECIMEN_SEARCH_LIMIT
+        limit = min(max(limit, 1), SPECIMEN_SEARCH_LIMIT)
+        matches = search_index.search(query, limit)
+        return JSONResponse(
+            [
+                {"value": name, "label": name, "rank": len(matches) - i}
+                for i, (name, _) in enumerate(matches)
+            ]
+        )
+
     def _specimen():
-        ui.update_selectize(
+        # Point the picker at the search endpoint instead of sending it every species
+        session.send_input_message(
             "specimen",
-            label="Specimen",
-            choices=list(df["Common Name"].sort_values(ascending=True)),
-            selected="None",
+            {
+                "label": "Specimen",
+                "value": "",
+                "url": session.dynamic_route("specimen_search", _specimen_choices),
+            },
         )
 
+    # the route never changes, so it is sent once, with the first flush
+    session.on_flush(_specimen, once=True)
+
     @reactive.Effect
     @reactive.event(input.reset)
+    @trace.counted("reset")
+    @telemetry.timed("reset")
     def _reset():
-        df = val.get()
-        if not df.empty:
-            index_to_delete = list(input.observations_data_frame_selected_rows())
-            if index_to_delete and index_to_delete[0] in df.index:
-                df.drop(index_to_delete[0], inplace=True)
-                df = pd.DataFrame(df)
-                # Reindex the DataFrame
-                df.reset_index(drop=True, inplace=True)
-                val.set(df)
-                m = ui.modal(
-                    "Your observation have been cleared",
-                    easy_close=True,
-                    footer=None,
-                )
-                ui.modal_show(m)
+        # The grid reports the queue IDs of the selected rows
+        obs_ids = [
+            obs_id
+            for obs_id in input.observations_grid_selected()
+            if obs_id in observations
+        ]
+        if obs_ids:
+            obs_ids = observation_queue.discard(obs_ids, device)
+            survey_rollup.remove([observations.get(obs_id) for obs_id in obs_ids])
+            for obs_id in obs_ids:
+                observations.delete(obs_id)
+            val.set(observations.version)
+            m = ui.modal(
+                f"{len(obs_ids)} observation(s) have been cleared",
+                easy_close=True,
+                footer=None,
+            )
+            ui.modal_show(m)
 
     @reactive.Effect
     @reactive.event(input.sync)
+    @trace.counted("sync")
+    @telemetry.timed("sync")
     def _sync():
-        api_key = get_airtable_data()["api_key"]
-        base_id = get_airtable_data()["base_id"]
-        observation_table_name = get_airtable_data()["observation_table_name"]
-        url = get_url(base_id, observation_table_name)
-        df = val.get()
-        if not df.empty:
-            data = df.to_dict("records")
-            for record in data:
-                response = requests.post(
-                    url, json={"fields": record}, headers=get_headers(api_key)
-                )
-                if response.status_code == 200:
-                    print("Data successfully submitted to Airtable")
-                else:
-                    print(response.text)
-            df = val.get()
-            # Clear the DataFrame by creating a new empty one
-            df = pd.DataFrame(columns=df.columns)
-            val.set(df)
-            ui.update_selectize(
-                "survey_side",
-                label="Select the side",
-                choices=["Slough side", "Pond side"],
+        if len(observations):
+            # Observations still waiting for their image are kept for the next sync
+            kept_back = LOCAL_FIELDS
+            if not SEND_OBSERVATION_IDS:
+                kept_back += (OBSERVATION_ID_FIELD,)
+            ready = [
+                (obs_id, {k: v for k, v in fields.items() if k not in kept_back})
+                for obs_id, fields in observations.records()
+                if fields["Image status"] != UPLOADING
+            ]
+            waiting = len(observations) - len(ready)
+            # The batch is checked and given its taxonomy in one pass; observations
+            # with problems are kept back and flagged in the verify grid
+            ready, problems = validator.validate_records(ready)
+            for obs_id, problem in problems.items():
+                observations.update(obs_id, {"Problems": problem})
+            # Other worker processes share the queue; push only what this one claimed
+            ready_ids = [obs_id for obs_id, _ in ready]
+            claimed = set(observation_queue.claim(ready_ids, device=device))
+            records = [record for record in ready if record[0] in claimed]
+            # Observations another worker already synced or discarded are dropped
+            gone = set(ready_ids) - claimed - observation_queue.pending_ids(ready_ids)
+            waiting += len(ready) - len(records) - len(gone)
+            task = asyncio.create_task(_push(records, gone, waiting, problems))
+            sync_tasks.add(task)
+            task.add_done_callback(sync_tasks.discard)
+
+    sync_tasks = set()
+
+    @trace.counted("push")
+    @telemetry.timed("push")
+    async def _push(records, gone, waiting, problems):
+        """
+        Sends the claimed observations to the sink off the event loop, then
+        drops the synced ones from the session and reports the sync.
+        """
+        loop = asyncio.get_running_loop()
+        duplicates = await loop.run_in_executor(None, already_in_airtable, records)
+        records = [record for record in records if record[0] not in duplicates]
+        # in batches of the largest size the sink accepts
+        result = await loop.run_in_executor(
+            None, sync_records, records, observation_sink
+        )
+        for error in result.errors:
+            print(error)
+        async with reactive.lock():
+            # Keep only the observations the sink did not confirm
+            observation_queue.acknowledge(list(result.synced) + list(duplicates))
+            observation_queue.release(result.failed)
+            observation_queue.compact()
+            survey_rollup.mark_synced(
+                [observations.get(obs_id) for obs_id in [*result.synced, *duplicates]]
             )
+            for obs_id in list(result.synced) + list(gone) + list(duplicates):
+                observations.delete(obs_id)
+            val.set(observations.version)
+            # back to the first side for the next survey point; the choices stay
+            with reactive.isolate():
+                if input.survey_side() != "Slough side":
+                    ui.update_selectize("survey_side", selected="Slough side")
+            if result.failed or waiting or problems:
+                message = (
+                    f"{len(result.synced)} observations have been synced to "
+                    f"{observation_sink.name}. "
+                    f"{len(result.failed)} could not be synced and {waiting} are "
+                    "waiting for an image upload or being synced from another "
+                    "session; they are kept for the next sync."
+                )
+                if problems:
+                    message += (
+                        f" {len(problems)} have problems, shown in the verify grid; "
+                        "clear them and record them again."
+                    )
+            else:
+                message = (
+                    f"Your observations have been synced to {observation_sink.name}."
+                )
+            if duplicates:
+                message += (
+                    f" {len(duplicates)} were already in {observation_sink.name} and"
+                    " were not sent again."
+                )
             m = ui.modal(
-                "Your observations have been synced",
+                message,
                 easy_close=True,
                 footer=None,
             )
             ui.modal_show(m)
+            await reactive.flush()
+
+    def _export_format():
+        fmt = input.export_format() if "export_format" in input else "csv"
+        return fmt if fmt in available_formats() else "csv"
+
+    @session.download(
+        filename=lambda: f"observations-{date.today()}.{_export_format()}",
+        media_type=lambda: MEDIA_TYPES[_export_format()],
+    )
+    def export_observations():
+        """
+        Streams the session's observations, chunk by chunk, in the chosen format.
+        """
+        return stream_observations(
+            export_rows(observations.records(), validator), _export_format()
+        )
 
     @reactive.Effect
     @reactive.event(input.submit)
+    @trace.counted("submit")
+    @telemetry.timed("submit")
     def _submit():
         """
         This function is triggered when the submit button is clicked.
         It handles the submission of the arthropod survey form and records the observation.
         """
         req(input.surveyors())
+        # the picker is cleared after each submit, so a second click needs a new pick
+        if not input.specimen():
+            ui.notification_show("Pick a specimen before submitting.", type="warning")
+            return
         if input.file1() and input.file1() is not None:
-            path = input.file1()[0]["datapath"]
-            url = upload_image_to_imgur(path)
+            # out of the session's upload directory, which goes when it ends
+            path = upload_pipeline.spool(input.file1()[0]["datapath"])
             input.file1().clear()
-            m = ui.modal(
-                "This is your uploaded image",
-                ui.br(),
-                ui.br(),
-                ui.tags.img(src=url, height="100%", width="100%"),
-                easy_close=True,
-                footer=None,
-            )
-            ui.modal_show(m)
             ui.remove_ui(selector="div:has(> #file1-label)")
             ui.insert_ui(
                 ui.input_file(
@@ -203,8 +672,13 @@ def server(input, output, session):
                 selector="#submit",
                 where="beforeBegin",
             )
+            image_status = UPLOADING
         else:
-            url = ""
+            path = None
+            image_status = ""
+        url = ""
+        # Class, Order, Family, Genus and Species are filled in from the catalog
+        # when the observations are synced, for the whole batch at once
         data = {
             "fields": {
                 "Date observed": str(input.survey_date()),
@@ -212,61 +686,256 @@ def server(input, output, session):
                 "Plot": str(input.plot()),
                 "Survey Point": str(input.survey_point()),
                 "Side": str(input.survey_side()),
-                "Class": df.loc[
-                    df["Common Name"] == str(input.specimen()), "Order"
-                ].values[0],
-                "Order": df.loc[
-                    df["Common Name"] == str(input.specimen()), "Order"
-                ].values[0],
-                "Family": df.loc[
-                    df["Common Name"] == str(input.specimen()), "Family"
-                ].values[0],
                 "Common Name": str(input.specimen()),
-                "Genus": df.loc[
-                    df["Common Name"] == str(input.specimen()), "Genus"
-                ].values[0],
-                "Species": df.loc[
-                    df["Common Name"] == str(input.specimen()), "Species"
-                ].values[0],
                 "Count": int(input.count()),
                 "Notes": str(input.notes()),
                 "Surveyors": str(", ".join(input.surveyors())),
                 "Url": url,
                 "Image attachment": [{"url": url}],
+                "Image status": image_status,
+                OBSERVATION_ID_FIELD: uuid.uuid4().hex,
             }
         }
 
-        newValue = val.get()
-        newValue = newValue._append(data["fields"], ignore_index=True)
-        val.set(newValue)
+        obs_id = observation_queue.append(
+            data["fields"], device, uploading=path is not None
+        )
+        observations.append(obs_id, data["fields"])
+        survey_rollup.add([data["fields"]])
+        val.set(observations.version)
+        if path is not None:
+            # The observation is recorded right away; the image URL is filled in later
+            task = asyncio.create_task(_upload_image(obs_id, path))
+            upload_tasks.add(task)
+            task.add_done_callback(upload_tasks.discard)
         ui.notification_show("Your observation has been recorded.", duration=2)
-        ui.update_selectize(
-            "specimen",
-            label="Specimen",
-            choices=list(df["Common Name"].sort_values(ascending=True)),
-            selected="None",
+        # only reset what changed; labels and ranges never do
+        ui.update_selectize("specimen", selected="")
+        if input.count() != 1:
+            ui.update_slider("count", value=1)
+        if input.notes():
+            ui.update_text("notes", value="")
+
+    upload_tasks = set()
+
+    @trace.counted("upload_image")
+    async def _upload_image(obs_id, path):
+        """
+        Uploads the image of an observation in the background, then fills in
+        its URL, or reports the failure in the verify grid.
+        """
+        upload = asyncio.ensure_future(upload_pipeline.upload(path))
+        # renew the upload's lease while it runs, so that sessions opened in the
+        # meantime do not take it for interrupted
+        while not (await asyncio.wait([upload], timeout=UPLOAD_LEASE / 3))[0]:
+            observation_queue.renew_upload(obs_id)
+        try:
+            result = upload.result()
+        except UploadError as e:
+            url = None
+            fields = {"Image status": f"failed: {e}"}
+        else:
+            url = result.url
+            fields = {
+                "Url": url,
+                "Image attachment": [{"url": url}],
+                "Image status": "uploaded",
+            }
+            if result.thumbnail:
+                fields["Thumbnail"] = f"thumbnails/{result.digest}.jpg"
+        async with reactive.lock():
+            if obs_id in observations:
+                observations.update(obs_id, fields)
+                observation_queue.update(obs_id, observations.get(obs_id))
+                val.set(observations.version)
+            if url:
+                if result.reused:
+                    detail = "This photo was uploaded before; it was not sent again"
+                else:
+                    detail = (
+                        f"Compressed from {result.original_bytes / 1e6:.1f} MB "
+                        f"to {result.uploaded_bytes / 1e6:.1f} MB "
+                        f"in {result.preprocess_seconds:.1f} s"
+                    )
+                m = ui.modal(
+                    "This is your uploaded image",
+                    ui.br(),
+                    ui.tags.small(detail),
+                    ui.br(),
+                    # the local thumbnail shows at once; the full image is a click away
+                    ui.tags.a(
+                        ui.tags.img(
+                            src=fields.get("Thumbnail", url), style="max-width: 100%"
+                        ),
+                        href=url,
+                        target="_blank",
+                    ),
+                    easy_close=True,
+                    footer=None,
+                )
+                ui.modal_show(m)
+            else:
+                ui.notification_show(
+                    f"Image upload {fields['Image status']}", type="error"
+                )
+            await reactive.flush()
+
+    # ids of the dichotomous key nodes visited so far, starting at the root
+    key_path = reactive.Value((identification_key.root,))
+
+    @reactive.Effect
+    @reactive.event(input.key_answer)
+    def _key_answer():
+        node = identification_key[key_path.get()[-1]]
+        # ignore answers to a question that is no longer shown
+        if input.key_answer() in [next_id for _, next_id in node.answers]:
+            key_path.set(key_path.get() + (input.key_answer(),))
+
+    @reactive.Effect
+    @reactive.event(input.key_back)
+    def _key_back():
+        if len(key_path.get()) > 1:
+            key_path.set(key_path.get()[:-1])
+
+    @reactive.Effect
+    @reactive.event(input.key_restart)
+    def _key_restart():
+        key_path.set((identification_key.root,))
+
+    @render.ui
+    @trace.counted("key_node")
+    def key_node():
+        path = key_path.get()
+        steps = []
+        for parent_id, node_id in zip(path, path[1:]):
+            parent = identification_key[parent_id]
+            answer = next(a for a, n in parent.answers if n == node_id)
+            steps.append((parent.question, answer))
+        return key_node_ui(
+            identification_key[path[-1]],
+            steps,
+            identification_key.next_images(path[-1]),
         )
-        ui.update_slider("count", label="Count observed", min=1, max=100, value=1)
-        ui.update_text("notes", label="Notes", value="")
-
-    @output
-    @render.data_frame
-    def observations_data_frame():
-        return render.DataGrid(
-            val.get()[
-                [
-                    "Date observed",
-                    "Plot",
-                    "Survey Point",
-                    "Side",
-                    "Common Name",
-                    "Count",
-                    "Notes",
-                ]
-            ],
-            row_selection_mode="single",
+
+    @render.ui
+    @trace.counted("possible_candidates")
+    def possible_candidates():
+        return possible_candidates_ui(identification_key[key_path.get()[-1]])
+
+    if ADMIN_TAB:
+
+        @render.ui
+        def performance():
+            reactive.invalidate_later(5)
+            return performance_ui(telemetry.metrics(), telemetry.enabled)
+
+    @reactive.poll(survey_rollup.revision, 2)
+    def rollup_revision():
+        # changes when any session of any worker records, clears or syncs
+        return survey_rollup.revision()
+
+    @reactive.Calc
+    @trace.counted("summary")
+    def summary():
+        """
+        Adds up the rollup for the choices of the Survey summary tab, only
+        while the tab is shown.
+        """
+        req(input.navbar_id() == "Survey summary")
+        rollup_revision()
+        location = input.summary_location()
+        rows = survey_rollup.summary(
+            input.summary_taxon(),
+            input.summary_dimension(),
+            input.summary_period(),
+            filters={"Location": None if location == "All" else location},
+            include_pending=input.summary_pending(),
+        )
+        return summary_frame(rows, input.summary_taxon(), input.summary_dimension())
+
+    @reactive.Effect
+    @trace.counted("summary_chart")
+    async def _summary_chart():
+        figure = summary_figure(
+            summary(),
+            input.summary_taxon(),
+            input.summary_dimension(),
+            input.summary_measure(),
+        )
+        await session.send_custom_message(
+            SUMMARY_MESSAGE_TYPE, {"id": "summary_chart", "figure": figure}
         )
 
+    @render.ui
+    @trace.counted("summary_table")
+    def summary_table():
+        return summary_table_ui(
+            summary(),
+            input.summary_taxon(),
+            input.summary_dimension(),
+            input.summary_measure(),
+        )
+
+    grid = GridState("observations_grid")
+
+    @reactive.Effect
+    @trace.counted("grid")
+    async def _grid():
+        """
+        Sends the verify grid the observations added, removed or changed since
+        it was last updated, instead of the whole table.
+        """
+        val.get()
+        message = grid.update(observations)
+        if message is not None:
+            await session.send_custom_message(MESSAGE_TYPE, message)
+
 
 app = App(app_ui, server)
+
+
+def metrics_endpoint(request):
+    # not authenticated, so only answer scrapers on the same machine
+    if request.client is None or request.client.host not in ("127.0.0.1", "::1"):
+        return Response(status_code=403)
+    if not telemetry.enabled:
+        return Response(status_code=404)
+    return PlainTextResponse(
+        telemetry.prometheus(), media_type="text/plain; version=0.0.4"
+    )
+
+
+def thumbnail_endpoint(request):
+    try:
+        path = image_store.thumbnail_path(request.path_params["digest"])
+    except ValueError:
+        return Response(status_code=404)
+    if not os.path.exists(path):
+        return Response(status_code=404)
+    # named by the photo's SHA-256, so a thumbnail never changes
+    return FileResponse(
+        path,
+        media_type="image/jpeg",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
+
+
+def plotly_js_endpoint(request):
+    # the plotly.js of the installed plotly package, for the Survey summary charts
+    import plotly.offline
+
+    return Response(
+        plotly.offline.get_plotlyjs(),
+        media_type="application/javascript",
+        headers={"Cache-Control": "public, max-age=86400"},
+    )
+
+
+app.starlette_app.router.routes.insert(0, Route("/metrics", metrics_endpoint))
+app.starlette_app.router.routes.insert(
+    0, Route(f"/{PLOTLY_JS_PATH}", plotly_js_endpoint)
+)
+app.starlette_app.router.routes.insert(
+    0, Route("/thumbnails/{digest}.jpg", thumbnail_endpoint)
+)
 ()
@@ -0,0 +1,385 @@
+"""
+Local SQLite mirror of Airtable tables, kept current with incremental pulls.
+
+The first pull of a table lists all of its records. Later pulls only ask for
+the records modified since the previous pull (with a filterByFormula on
+LAST_MODIFIED_TIME()), page by page with Airtable's offset cursor, so an
+unchanged table costs a single request. Records are upserted by their
+Airtable record ID. Deleted records are only noticed by a full pull.
+
+The mirror lets the app find observations that are already in Airtable
+before pushing them again, and rebuild data.csv from the species table,
+without reading whole tables through the API each time.
+
+Usage:
+
+    python -m app_files.airtable_mirror pull
+    python -m app_files.airtable_mirror species-csv data.csv
+"""
+import argparse
+import csv
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from app_files.airtable_utils import get_airtable_data, get_headers, get_url
+from app_files.catalog import CSV_COLUMNS, SpeciesRecord, TaxonomyCatalog
+from app_files.http_client import http_client
+from app_files.sync import (
+    AIRTABLE_REQUESTS_PER_SECOND,
+    RETRY_STATUS_CODES,
+    TokenBucket,
+    backoff_delay,
+)
+from app_files.telemetry import telemetry
+
+# Airtable returns at most 100 records per page
+PAGE_SIZE = 100
+# seconds each incremental pull reaches back before the previous one, so that
+# records modified while it ran, or with a skewed clock, are not missed
+PULL_OVERLAP = 60
+# field holding the ID the app gives each observation, kept when it is synced
+OBSERVATION_ID_FIELD = "Observation ID"
+# fields that identify an observation when looking for duplicates. Two real
+# observations may have the same values in all the other fields, e.g. the same
+# species counted twice at one spot on one day, so only the ID is used.
+OBSERVATION_KEY_FIELDS = (OBSERVATION_ID_FIELD,)
+
+
+class MirrorError(Exception):
+    """
+    Raised when a page of records could not be fetched from Airtable.
+    """
+
+
+class PullResult(NamedTuple):
+    """
+    Outcome of a pull: records received, pages requested, and whether it was
+    a full pull.
+    """
+
+    records: int
+    pages: int
+    full: bool
+
+
+def fingerprint(fields, key_fields):
+    """
+    Returns a string identifying a record by the values of its key fields, or
+    None when they are all empty, as a record without an ID matches nothing.
+    """
+    values = [str(fields.get(key, "") or "") for key in key_fields]
+    return json.dumps(values) if any(values) else None
+
+
+def airtable_time(timestamp):
+    """
+    Formats a Unix timestamp the way Airtable formulas expect it.
+    """
+    moment = datetime.fromtimestamp(timestamp, timezone.utc)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def fetch_page(url, headers, params, bucket, max_retries=5, timeout=30):
+    """
+    Lists one page of records, retrying on rate limiting and server errors.
+
+    Returns:
+        dict: The decoded response, with "records" and, unless it is the
+        last page, "offset".
+
+    Raises:
+        MirrorError: If the page could not be fetched.
+    """
+    import requests
+
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        retry_after = 0
+        try:
+            response = http_client.get(
+                url,
+                endpoint="airtable list records",
+                params=params,
+                headers=headers,
+                timeout=timeout,
+            )
+        except requests.RequestException as e:
+            error = str(e)
+        else:
+            if response.status_code == 200:
+                return response.json()
+            error = f"{response.status_code}: {response.text}"
+            if response.status_code not in RETRY_STATUS_CODES:
+                raise MirrorError(error)
+            header = response.headers.get("Retry-After", "")
+            retry_after = int(header) if header.isdigit() else 0
+        if attempt < max_retries:
+            time.sleep(max(backoff_delay(attempt), retry_after))
+    raise MirrorError(error)
+
+
+class AirtableMirror:
+    """
+    SQLite copy of the records of Airtable tables.
+
+    Args:
+        path (str): Path of the SQLite database.
+        key_fields (dict): For each table whose duplicates are looked up,
+            the fields that identify a record.
+    """
+
+    def __init__(self, path="airtable_mirror.sqlite3", key_fields=None):
+        self.key_fields = dict(key_fields or {})
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                table_name TEXT NOT NULL,
+                id TEXT NOT NULL,
+                fields TEXT NOT NULL,
+                fingerprint TEXT,
+                pulled_at REAL NOT NULL,
+                PRIMARY KEY (table_name, id)
+            );
+            CREATE INDEX IF NOT EXISTS records_fingerprint
+                ON records (table_name, fingerprint);
+            CREATE TABLE IF NOT EXISTS pulls (
+                table_name TEXT PRIMARY KEY,
+                pulled_at REAL NOT NULL
+            );
+            """
+        )
+        self._db.commit()
+
+    def last_pull(self, table):
+        """
+        Returns when the last pull of a table started, or None.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT pulled_at FROM pulls WHERE table_name = ?", (table,)
+            ).fetchone()
+        return row[0] if row else None
+
+    @telemetry.timed("airtable_pull")
+    def pull(
+        self,
+        table,
+        url,
+        headers,
+        full=False,
+        page_size=PAGE_SIZE,
+        requests_per_second=AIRTABLE_REQUESTS_PER_SECOND,
+    ):
+        """
+        Brings the mirror of a table up to date.
+
+        Args:
+            table (str): The table name, as stored in the mirror.
+            url (str): The table URL.
+            headers (dict): The request headers.
+            full (bool): List every record, and drop the mirrored records
+                that are no longer in Airtable. The first pull of a table is
+                always full.
+            page_size (int): Records per page.
+            requests_per_second (float): Maximum request rate.
+
+        Returns:
+            PullResult: How many records and pages were received.
+
+        Raises:
+            MirrorError: If a page could not be fetched. The pages received
+                before are kept, and the next pull starts from the same point.
+        """
+        started = time.time()
+        since = self.last_pull(table)
+        full = full or since is None
+        params = {"pageSize": page_size}
+        if not full:
+            params["filterByFormula"] = (
+                "IS_AFTER(LAST_MODIFIED_TIME(), "
+                f"'{airtable_time(since - PULL_OVERLAP)}')"
+            )
+        bucket = TokenBucket(requests_per_second, capacity=1)
+        records = pages = 0
+        while True:
+            page = fetch_page(url, headers, params, bucket)
+            pages += 1
+            records += len(page.get("records", []))
+            self._upsert(table, page.get("records", []), started)
+            if not page.get("offset"):
+                break
+            params["offset"] = page["offset"]
+        with self._lock:
+            if full:
+                self._db.execute(
+                    "DELETE FROM records WHERE table_name = ? AND pulled_at < ?",
+                    (table, started),
+                )
+            self._db.execute(
+                "INSERT OR REPLACE INTO pulls (table_name, pulled_at) VALUES (?, ?)",
+                (table, started),
+            )
+            self._db.commit()
+        telemetry.increment(
+            "airtable_records_pulled_total",
+            records,
+            "Records received from Airtable by mirror pulls.",
+        )
+        return PullResult(records, pages, full)
+
+    def records(self, table):
+        """
+        Returns the mirrored records of a table.
+
+        Returns:
+            list: (Airtable record ID, fields) pairs.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, fields FROM records WHERE table_name = ? ORDER BY id",
+                (table,),
+            ).fetchall()
+        return [(record_id, json.loads(fields)) for record_id, fields in rows]
+
+    def count(self, table):
+        with self._lock:
+            (count,) = self._db.execute(
+                "SELECT COUNT(*) FROM records WHERE table_name = ?", (table,)
+            ).fetchone()
+        return count
+
+    def existing(self, table, records):
+        """
+        Finds the records that are already in a mirrored table, by their key
+        fields. Records whose key fields are empty are never found.
+
+        Args:
+            table (str): A table with key fields.
+            records (list): (key, fields) pairs, such as observations about
+                to be pushed.
+
+        Returns:
+            set: The keys of the records already in the table.
+        """
+        key_fields = self.key_fields[table]
+        by_fingerprint = {}
+        for key, fields in records:
+            print_ = fingerprint(fields, key_fields)
+            if print_ is not None:
+                by_fingerprint.setdefault(print_, []).append(key)
+        found = set()
+        prints = list(by_fingerprint)
+        with self._lock:
+            # stay under SQLite's limit on bound parameters
+            for i in range(0, len(prints), 500):
+                batch = prints[i : i + 500]
+                rows = self._db.execute(
+                    "SELECT DISTINCT fingerprint FROM records WHERE table_name = ?"
+                    f" AND fingerprint IN ({', '.join('?' * len(batch))})",
+                    [table, *batch],
+                ).fetchall()
+                for (print_,) in rows:
+                    found.update(by_fingerprint[print_])
+        return found
+
+    def species_catalog(self, table):
+        """
+        Builds a species catalog from a mirrored table laid out like data.csv.
+        """
+        return TaxonomyCatalog(
+            SpeciesRecord(*(str(fields.get(column, "")) for column in CSV_COLUMNS))
+            for _, fields in self.records(table)
+            if fields.get("Common Name")
+        )
+
+    def write_species_csv(self, table, path):
+        """
+        Writes a mirrored species table as a CSV file laid out like data.csv.
+
+        Returns:
+            int: The number of species written.
+        """
+        catalog = self.species_catalog(table)
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(CSV_COLUMNS)
+            for name in catalog.common_names():
+                writer.writerow(catalog[name])
+        return len(catalog)
+
+    def close(self):
+        self._db.close()
+
+    def _upsert(self, table, records, pulled_at):
+        key_fields = self.key_fields.get(table)
+        rows = [
+            (
+                table,
+                record["id"],
+                json.dumps(record.get("fields", {})),
+                fingerprint(record.get("fields", {}), key_fields)
+                if key_fields
+                else None,
+                pulled_at,
+            )
+            for record in records
+        ]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO records"
+                " (table_name, id, fields, fingerprint, pulled_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Mirror the Airtable observation and species tables locally."
+    )
+    parser.add_argument("--mirror", default="airtable_mirror.sqlite3")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pull = commands.add_parser("pull", help="pull the records changed since last time")
+    pull.add_argument(
+        "--full", action="store_true", help="list every record and drop deleted ones"
+    )
+    species = commands.add_parser(
+        "species-csv", help="write the mirrored species table as a data.csv file"
+    )
+    species.add_argument("output")
+    args = parser.parse_args()
+
+    airtable = get_airtable_data()
+    observations = airtable["observation_table_name"]
+    mirror = AirtableMirror(
+        args.mirror, key_fields={observations: OBSERVATION_KEY_FIELDS}
+    )
+    if args.command == "pull":
+        headers = get_headers(airtable["api_key"])
+        for table in (airtable["data_table_name"], observations):
+            url = get_url(airtable["base_id"], table)
+            try:
+                result = mirror.pull(table, url, headers, full=args.full)
+            except MirrorError as e:
+                parser.exit(1, f"Could not pull {table}: {e}\n")
+            print(
+                f"{table}: {result.records} records in {result.pages} pages "
+                f"({'full' if result.full else 'incremental'}), "
+                f"{mirror.count(table)} mirrored"
+            )
+    else:
+        count = mirror.write_species_csv(airtable["data_table_name"], args.output)
+        print(f"Wrote {count} species to {args.output}")
+    mirror.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,119 @@
-import requests
-import pandas as pd
+import os
+from typing import List, NamedTuple, Optional
 
+from app_files.http_client import http_client
+from app_files.telemetry import telemetry
 
-def get_species_image(genus, species, image_number):
+
+# the API URLs can be pointed at local stand-ins, e.g. by the benchmarks
+INATURALIST_API_URL = os.environ.get(
+    "ARTHROPOD_INATURALIST_URL", "https://api.inaturalist.org/v1"
+)
+AIRTABLE_API_URL = os.environ.get("ARTHROPOD_AIRTABLE_URL", "https://airtable.com/v0")
+DEFAULT_IMAGE_URL = "https://i.ibb.co/m6YDp69/sorry.jpg"
+
+
+class SpeciesPhotos(NamedTuple):
     """
-    Retrieves the image URL for a given species.
+    The iNaturalist taxon matched for a species and its photo URLs.
+    """
+
+    taxon_id: Optional[int]
+    photo_urls: List[str]
+
+
+@telemetry.timed("fetch_species_photos")
+def fetch_species_photos(genus, species, api_url=INATURALIST_API_URL):
+    """
+    Looks up a species on iNaturalist and retrieves all of its photo URLs.
 
     Args:
         genus (str): The genus of the species.
         species (str): The species name.
-        image_number (int): The number of the image to retrieve. The first image is 0, the second is 1, etc.
+        api_url (str): The base URL of the iNaturalist API.
 
     Returns:
-        str: The URL of the species image, or a default image URL if no image is found.
+        SpeciesPhotos: The taxon ID and large photo URLs, with no taxon ID and
+        no photos when iNaturalist has no match, or None when a request failed.
     """
-    base_url = "https://api.inaturalist.org/v1/taxa/autocomplete"
     params = {
         "q": f"{genus} {species}",
         "limit": 1,  # Limit to the first result
     }
 
-    response = requests.get(base_url, params=params)
-
-    if response.status_code == 200:
-        data = response.json()
-        if data["results"] and data["results"][0]["id"]:
-            taxon_id = data["results"][0]["id"]
-            photo_url = f"https://api.inaturalist.org/v1/taxa/{taxon_id}?locale=en"
-            photo_response = requests.get(photo_url)
-            if photo_response.status_code == 200:
-                photo_data = photo_response.json()
-                if (
-                    photo_data["results"]
-                    and photo_data["results"][0]["taxon_photos"]
-                    and len(photo_data["results"][0]["taxon_photos"]) > 1
-                ):
-                    if (
-                        "large_url"
-                        in photo_data["results"][0]["taxon_photos"][1]["photo"]
-                    ):
-                        image_url = photo_data["results"][0]["taxon_photos"][
-                            image_number
-                        ]["photo"]["large_url"]
-                        return image_url
-
-    return "https://i.ibb.co/m6YDp69/sorry.jpg"
+    response = http_client.get(
+        f"{api_url}/taxa/autocomplete",
+        endpoint="inaturalist taxa/autocomplete",
+        params=params,
+    )
+    if response.status_code != 200:
+        return None
+
+    data = response.json()
+    if not (data["results"] and data["results"][0]["id"]):
+        return SpeciesPhotos(None, [])
+
+    taxon_id = data["results"][0]["id"]
+    photo_response = http_client.get(
+        f"{api_url}/taxa/{taxon_id}?locale=en", endpoint="inaturalist taxa/{id}"
+    )
+    if photo_response.status_code != 200:
+        return None
+
+    photo_data = photo_response.json()
+    photo_urls = []
+    if photo_data["results"]:
+        for taxon_photo in photo_data["results"][0]["taxon_photos"] or []:
+            if "large_url" in taxon_photo["photo"]:
+                photo_urls.append(taxon_photo["photo"]["large_url"])
+    return SpeciesPhotos(taxon_id, photo_urls)
+
+
+def pick_image_url(photos, image_number):
+    """
+    Picks one image URL out of fetched species photos.
+
+    Args:
+        photos (SpeciesPhotos): The fetched photos, or None.
+        image_number (int): The number of the image to retrieve. The first image is 0, the second is 1, etc.
+
+    Returns:
+        str: The URL of the species image, or a default image URL if there are
+        fewer than two photos or no photo with that number.
+    """
+    if photos is None or len(photos.photo_urls) < 2:
+        return DEFAULT_IMAGE_URL
+    if image_number >= len(photos.photo_urls):
+        return DEFAULT_IMAGE_URL
+    return photos.photo_urls[image_number]
+
+
+@telemetry.timed("get_species_image")
+def get_species_image(genus, species, image_number):
+    """
+    Retrieves the image URL for a given species.
+
+    Args:
+        genus (str): The genus of the species.
+        species (str): The species name.
+        image_number (int): The number of the image to retrieve. The first image is 0, the second is 1, etc.
+
+    Returns:
+        str: The URL of the species image, or a default image URL if no image is found.
+    """
+    return pick_image_url(fetch_species_photos(genus, species), image_number)
 
 
 def get_airtable_data():
     return {
-        "api_key": "<api_key>",
-        "base_id": "<base_id",
-        "data_table_name": "<data_table_name>",
-        "observation_table_name": "<observation_table_name>",
+        "api_key": os.environ.get("ARTHROPOD_AIRTABLE_API_KEY", "<api_key>"),
+        "base_id": os.environ.get("ARTHROPOD_AIRTABLE_BASE_ID", "<base_id"),
+        "data_table_name": os.environ.get(
+            "ARTHROPOD_AIRTABLE_DATA_TABLE", "<data_table_name>"
+        ),
+        "observation_table_name": os.environ.get(
+            "ARTHROPOD_AIRTABLE_OBSERVATION_TABLE", "<observation_table_name>"
+        ),
     }
 
 
@@ -61,4 +122,4 @@ def get_headers(api_key):
 
 
 def get_url(base_id, table_name):
-    return f"https://airtable.com/v0/{base_id}/{table_name}"
+    return f"{AIRTABLE_API_URL}/{base_id}/{table_name}"
@@ -0,0 +1,95 @@
+import threading
+
+from shiny import ui
+
+from app_files.airtable_utils import pick_image_url
+
+
+class SpecimenCardCache:
+    """
+    Builds the specimen cards shown next to the record form and keeps them for
+    every session of the worker.
+
+    A card has a text part (name and ID notes) that only needs the catalog and
+    two images that need iNaturalist. text_card() returns right away with
+    placeholders for the images; full_card() resolves the images and memoizes
+    the finished card, so a species that was already viewed is shown again
+    without any network traffic. Cards are rebuilt from the image cache when
+    it already holds their images, so with a shared image cache a species
+    viewed in one worker process is shown right away by all of them.
+
+    Args:
+        catalog (TaxonomyCatalog): The species catalog.
+        image_cache (SpeciesImageCache): Where species photos are looked up.
+    """
+
+    def __init__(self, catalog, image_cache):
+        self.catalog = catalog
+        self.image_cache = image_cache
+        self._cards = {}
+        self._lock = threading.Lock()
+
+    def get(self, common_name):
+        """
+        Returns the finished card of a species, or None if its images still
+        have to be looked up on iNaturalist.
+        """
+        card = self._cards.get(common_name)
+        if card is not None:
+            return card
+        record = self.catalog[common_name]
+        if record.genus == "Unknown" or record.species == "Unknown":
+            return self._finish(common_name, None)
+        photos = self.image_cache.cached(record.genus, record.species)
+        if photos is None:
+            return None
+        return self._finish(common_name, photos)
+
+    def text_card(self, common_name):
+        """
+        Returns the card of a species with placeholders instead of the images.
+        """
+        placeholder = ui.tags.p("Loading image…", class_="text-muted")
+        return self._card(common_name, placeholder, placeholder)
+
+    def full_card(self, common_name):
+        """
+        Returns the finished card of a species, looking up its images if needed.
+        This may block on iNaturalist, so call it from a worker thread.
+        """
+        import requests
+
+        card = self._cards.get(common_name)
+        if card is not None:
+            return card
+
+        record = self.catalog[common_name]
+        known = record.genus != "Unknown" and record.species != "Unknown"
+        photos = None
+        if known:
+            try:
+                photos = self.image_cache.get(record.genus, record.species)
+            except requests.RequestException as e:
+                print(f"Could not look up images of {common_name}: {e}")
+        # a failed lookup is not memoized, so that it is retried next time
+        memoize = photos is not None or not known
+        return self._finish(common_name, photos, memoize)
+
+    def _finish(self, common_name, photos, memoize=True):
+        card = self._card(
+            common_name,
+            ui.tags.img(src=pick_image_url(photos, 0), height="100%", width="100%"),
+            ui.tags.img(src=pick_image_url(photos, 1), height="100%", width="100%"),
+        )
+        if memoize:
+            with self._lock:
+                self._cards[common_name] = card
+        return card
+
+    def _card(self, common_name, image, image_2):
+        return ui.card(
+            ui.h3(f"{common_name} ID notes"),
+            image,
+            self.catalog[common_name].id_notes,
+            image_2,
+        )
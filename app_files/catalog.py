@@ -0,0 +1,123 @@
+import csv
+from bisect import bisect_left
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+
+class SpeciesRecord(NamedTuple):
+    """
+    One row of the species catalog.
+    """
+
+    common_name: str
+    class_: str
+    order: str
+    family: str
+    genus: str
+    species: str
+    id_notes: str
+
+
+# data.csv column for each SpeciesRecord field, in field order
+CSV_COLUMNS = (
+    "Common Name",
+    "Class",
+    "Order",
+    "Family",
+    "Genus",
+    "Species",
+    "ID notes",
+)
+
+
+class TaxonomyCatalog:
+    """
+    In-memory species catalog indexed by Common Name.
+
+    The catalog is built once and then answers exact, case-insensitive and
+    prefix lookups without scanning the rows, so the cost of a lookup does not
+    grow with the number of species.
+    """
+
+    def __init__(self, records: Iterable[SpeciesRecord]):
+        self._by_name: Dict[str, SpeciesRecord] = {}
+        self._by_folded_name: Dict[str, SpeciesRecord] = {}
+        for record in records:
+            self._by_name[record.common_name] = record
+            self._by_folded_name.setdefault(record.common_name.casefold(), record)
+        self._sorted_names = sorted(self._by_name)
+        # (folded name, name) pairs sorted for bisect-based prefix search
+        self._folded_index = sorted(
+            (name.casefold(), name) for name in self._by_name
+        )
+
+    @classmethod
+    def from_csv(cls, path) -> "TaxonomyCatalog":
+        """
+        Builds a catalog from a CSV file laid out like data.csv.
+
+        Args:
+            path (str): Path to the CSV file.
+
+        Returns:
+            TaxonomyCatalog: The catalog.
+        """
+        with open(path, newline="", encoding="utf-8-sig") as file:
+            reader = csv.DictReader(file)
+            return cls(
+                SpeciesRecord(*(row[column] for column in CSV_COLUMNS))
+                for row in reader
+            )
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    def __contains__(self, common_name) -> bool:
+        return common_name in self._by_name
+
+    def __getitem__(self, common_name) -> SpeciesRecord:
+        return self._by_name[common_name]
+
+    def get(self, common_name, default=None) -> Optional[SpeciesRecord]:
+        """
+        Looks up a species by its exact Common Name.
+        """
+        return self._by_name.get(common_name, default)
+
+    def lookup(self, common_name) -> Optional[SpeciesRecord]:
+        """
+        Looks up a species by Common Name, ignoring case.
+        """
+        record = self._by_name.get(common_name)
+        if record is None:
+            record = self._by_folded_name.get(common_name.casefold())
+        return record
+
+    def prefix(self, text, limit=None) -> List[SpeciesRecord]:
+        """
+        Returns the species whose Common Name starts with the given text,
+        ignoring case, in alphabetical order.
+
+        Args:
+            text (str): The prefix to match.
+            limit (int): The maximum number of results, or None for all.
+
+        Returns:
+            list: The matching SpeciesRecords.
+        """
+        folded = text.casefold()
+        start = bisect_left(self._folded_index, (folded, ""))
+        matches = []
+        for position in range(start, len(self._folded_index)):
+            folded_name, name = self._folded_index[position]
+            if not folded_name.startswith(folded):
+                break
+            matches.append(self._by_name[name])
+            if limit is not None and len(matches) >= limit:
+                break
+        return matches
+
+    def common_names(self) -> List[str]:
+        """
+        Returns every Common Name, sorted.
+        """
+        return list(self._sorted_names)
@@ -0,0 +1,356 @@
+"""
+Prebuilt binary copy of the species catalog, for fast app startup.
+
+Parsing data.csv on every cold start is wasted work: the catalog only changes
+when data.csv does. The artifact stores the catalog's records in a compact
+binary layout, stamped with the size, modification time and SHA-256 of the
+data.csv it was built from. load_catalog() uses it while it matches data.csv
+and rebuilds it otherwise.
+
+Layout (little-endian):
+    header          magic, format version, source size, source mtime (ns),
+                    source SHA-256 and number of records (HEADER)
+    offsets         number of records * fields + 1 uint32 offsets into the
+                    strings, one per field, record after record
+    folded order    number of records uint32 record numbers, sorted by
+                    case-folded Common Name
+    strings         the UTF-8 field values, back to back
+
+Records are stored sorted by Common Name, so MappedCatalog can answer lookups
+straight from a memory-mapped file. Every worker process maps the same file,
+and the operating system keeps a single copy of it in memory for all of them.
+
+Build it at deploy time with
+    python -m app_files.catalog_artifact --data data.csv --output data.catalog
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from typing import List, Optional
+
+from app_files.catalog import CSV_COLUMNS, SpeciesRecord, TaxonomyCatalog
+
+MAGIC = b"ARTHCAT\0"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<8sIQQ32sI")
+FIELDS = len(CSV_COLUMNS)
+DEFAULT_ARTIFACT_PATH = "data.catalog"
+
+
+def file_stamp(path):
+    """
+    Returns the (size, mtime in ns) of a file, which identify a version of it
+    without reading it.
+    """
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def file_sha256(path):
+    """
+    Returns the SHA-256 digest of a file, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 16), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def write_artifact(catalog, path, source):
+    """
+    Writes the catalog to an artifact file, stamped with its source.
+
+    Args:
+        catalog (TaxonomyCatalog): The catalog to store.
+        path (str): Where to write the artifact. It is replaced atomically.
+        source (str): Path to the data.csv the catalog was read from.
+    """
+    size, mtime_ns = file_stamp(source)
+    names = catalog.common_names()
+    offsets = array("I", [0])
+    strings = bytearray()
+    for name in names:
+        for value in catalog[name]:
+            strings += value.encode("utf-8")
+            offsets.append(len(strings))
+    if len(strings) >= 1 << 32:
+        raise ValueError("the catalog is too large for the artifact format")
+    folded_order = array(
+        "I", sorted(range(len(names)), key=lambda i: names[i].casefold())
+    )
+    if sys.byteorder != "little":
+        offsets.byteswap()
+        folded_order.byteswap()
+
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, size, mtime_ns, file_sha256(source), len(names)
+    )
+    # unique per process, as several workers may rebuild the artifact at once
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(header)
+        file.write(offsets.tobytes())
+        file.write(folded_order.tobytes())
+        file.write(strings)
+    os.replace(temp_path, path)
+
+
+def read_header(data):
+    """
+    Unpacks the header of an artifact.
+
+    Args:
+        data (bytes): The artifact, or at least its first HEADER.size bytes.
+
+    Returns:
+        tuple: (source size, source mtime in ns, source SHA-256, record count).
+
+    Raises:
+        ValueError: If the data is not an artifact of this format version.
+    """
+    if len(data) < HEADER.size:
+        raise ValueError("truncated catalog artifact")
+    magic, version, size, mtime_ns, sha256, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("not a catalog artifact of this version")
+    return size, mtime_ns, sha256, count
+
+
+def _read_tables(data, count):
+    # returns the offsets, the folded order and where the strings start
+    offsets_end = HEADER.size + (count * FIELDS + 1) * 4
+    strings_start = offsets_end + count * 4
+    if len(data) < strings_start:
+        raise ValueError("truncated catalog artifact")
+    view = memoryview(data)
+    if sys.byteorder == "little":
+        # no copy: the tables are read straight from the (mapped) file
+        offsets = view[HEADER.size : offsets_end].cast("I")
+        folded_order = view[offsets_end:strings_start].cast("I")
+    else:
+        offsets = array("I", view[HEADER.size : offsets_end].tobytes())
+        folded_order = array("I", view[offsets_end:strings_start].tobytes())
+        offsets.byteswap()
+        folded_order.byteswap()
+    if strings_start + offsets[-1] > len(data):
+        raise ValueError("truncated catalog artifact")
+    return offsets, folded_order, strings_start
+
+
+def read_artifact(data):
+    """
+    Decodes the records of an artifact.
+
+    Args:
+        data (bytes): The whole artifact.
+
+    Returns:
+        list: The SpeciesRecords, sorted by Common Name.
+    """
+    _, _, _, count = read_header(data)
+    offsets, _, start = _read_tables(data, count)
+    values = [
+        data[start + offsets[i] : start + offsets[i + 1]].decode("utf-8")
+        for i in range(count * FIELDS)
+    ]
+    return [
+        SpeciesRecord(*values[i : i + FIELDS]) for i in range(0, len(values), FIELDS)
+    ]
+
+
+class MappedCatalog:
+    """
+    Species catalog read straight from a memory-mapped artifact.
+
+    It answers the same lookups as TaxonomyCatalog, by binary search over the
+    artifact's sorted tables, and only decodes the records it returns. The
+    process keeps no copy of the catalog of its own, so its memory use does
+    not grow with the catalog, and all workers share the mapped pages.
+
+    Args:
+        path (str): Path to the artifact.
+
+    Raises:
+        OSError: If the artifact cannot be opened.
+        ValueError: If it is not a valid artifact.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = read_header(self._map)
+        self._count = self.header[3]
+        self._offsets, self._folded_order, self._strings = _read_tables(
+            self._map, self._count
+        )
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, common_name) -> bool:
+        return self._find(common_name) is not None
+
+    def __getitem__(self, common_name) -> SpeciesRecord:
+        position = self._find(common_name)
+        if position is None:
+            raise KeyError(common_name)
+        return self._record(position)
+
+    def get(self, common_name, default=None) -> Optional[SpeciesRecord]:
+        """
+        Looks up a species by its exact Common Name.
+        """
+        position = self._find(common_name)
+        return default if position is None else self._record(position)
+
+    def lookup(self, common_name) -> Optional[SpeciesRecord]:
+        """
+        Looks up a species by Common Name, ignoring case.
+        """
+        position = self._find(common_name)
+        if position is None:
+            folded = common_name.casefold()
+            start = self._bisect_folded(folded)
+            if start < self._count:
+                position = self._folded_order[start]
+                if self._value(position, 0).casefold() != folded:
+                    position = None
+        return None if position is None else self._record(position)
+
+    def prefix(self, text, limit=None) -> List[SpeciesRecord]:
+        """
+        Returns the species whose Common Name starts with the given text,
+        ignoring case, in alphabetical order.
+        """
+        folded = text.casefold()
+        matches = []
+        for i in range(self._bisect_folded(folded), self._count):
+            position = self._folded_order[i]
+            if not self._value(position, 0).casefold().startswith(folded):
+                break
+            matches.append(self._record(position))
+            if limit is not None and len(matches) >= limit:
+                break
+        return matches
+
+    def common_names(self) -> List[str]:
+        """
+        Returns every Common Name, sorted.
+        """
+        return [self._value(position, 0) for position in range(self._count)]
+
+    def close(self):
+        for table in (self._offsets, self._folded_order):
+            if isinstance(table, memoryview):
+                table.release()
+        self._map.close()
+
+    def _value(self, position, field):
+        i = position * FIELDS + field
+        start = self._strings + self._offsets[i]
+        return self._map[start : self._strings + self._offsets[i + 1]].decode("utf-8")
+
+    def _record(self, position):
+        return SpeciesRecord(
+            *(self._value(position, field) for field in range(FIELDS))
+        )
+
+    def _find(self, common_name):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._value(middle, 0) < common_name:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self._value(low, 0) == common_name:
+            return low
+        return None
+
+    def _bisect_folded(self, folded):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._value(self._folded_order[middle], 0).casefold() < folded:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+def is_fresh(header, source):
+    """
+    Tells whether an artifact header still matches its source file.
+
+    The size and modification time are checked first; only when they differ,
+    e.g. after a fresh checkout, is the source hashed.
+    """
+    size, mtime_ns, sha256, _ = header
+    if (size, mtime_ns) == file_stamp(source):
+        return True
+    return size == os.path.getsize(source) and sha256 == file_sha256(source)
+
+
+def load_catalog(source, artifact_path=DEFAULT_ARTIFACT_PATH, mapped=False):
+    """
+    Loads the species catalog from its artifact, rebuilding the artifact from
+    the CSV file first when it is missing or out of date.
+
+    Args:
+        source (str): Path to data.csv.
+        artifact_path (str): Path to the artifact.
+        mapped (bool): Return a MappedCatalog over the artifact, shared with
+            the other worker processes, instead of reading the records into a
+            TaxonomyCatalog.
+
+    Returns:
+        TaxonomyCatalog: The catalog, or a MappedCatalog.
+    """
+    try:
+        if mapped:
+            catalog = MappedCatalog(artifact_path)
+            if is_fresh(catalog.header, source):
+                return catalog
+            catalog.close()
+        else:
+            with open(artifact_path, "rb") as file:
+                data = file.read()
+            if is_fresh(read_header(data), source):
+                return TaxonomyCatalog(read_artifact(data))
+    except (OSError, ValueError):
+        pass
+
+    catalog = TaxonomyCatalog.from_csv(source)
+    try:
+        write_artifact(catalog, artifact_path, source)
+        if mapped:
+            return MappedCatalog(artifact_path)
+    except OSError as e:
+        # e.g. a read-only deployment; the app still works, just starts slower
+        print(f"Could not write the catalog artifact {artifact_path}: {e}")
+    return catalog
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the binary species catalog the app loads at startup."
+    )
+    parser.add_argument("--data", default="data.csv", help="the species CSV file")
+    parser.add_argument(
+        "--output", default=DEFAULT_ARTIFACT_PATH, help="where to write the artifact"
+    )
+    args = parser.parse_args()
+
+    catalog = TaxonomyCatalog.from_csv(args.data)
+    write_artifact(catalog, args.output, args.data)
+    print(f"Wrote {len(catalog)} species to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Shared client for every outbound HTTP call of the app (iNaturalist, Imgur and
+Airtable).
+
+All calls go through one requests.Session, which keeps a pool of keep-alive
+connections per host, so repeated calls to the same API skip the TCP and TLS
+handshakes. Every call has connect and read timeouts and is timed per
+endpoint. requests (and httpx) are only imported on the first call, so they
+do not slow down app startup.
+"""
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+from app_files.telemetry import LatencyHistogram, Metric
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (5, 30)
+
+
+class HttpClient:
+    """
+    Pooled HTTP client with timeouts and per-endpoint latency and error metrics.
+
+    Args:
+        timeout (tuple): Default (connect, read) timeouts in seconds.
+        pool_connections (int): Number of hosts to keep a connection pool for.
+        pool_maxsize (int): Maximum number of connections kept per host.
+        http2 (bool): Send requests over HTTP/2 when the optional httpx
+            package (with its http2 extra) is installed.
+    """
+
+    def __init__(
+        self,
+        timeout=DEFAULT_TIMEOUT,
+        pool_connections=10,
+        pool_maxsize=10,
+        http2=False,
+    ):
+        self.timeout = timeout
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.http2 = http2
+        self._session = None
+        self._httpx = None
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._errors = {}
+
+    def get(self, url, endpoint=None, **kwargs):
+        return self.request("GET", url, endpoint, **kwargs)
+
+    def post(self, url, endpoint=None, **kwargs):
+        return self.request("POST", url, endpoint, **kwargs)
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        """
+        Sends a request and records its latency and outcome.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL.
+            endpoint (str): Name the metrics are recorded under. Defaults to
+                the method, host and path of the URL.
+            **kwargs: Passed on to requests, e.g. params, json, files, headers
+                or timeout.
+
+        Returns:
+            requests.Response: The response. With HTTP/2 enabled, an
+            httpx.Response, which has the same status_code, headers, text and
+            json() members.
+
+        Raises:
+            requests.RequestException: If the request could not be completed.
+        """
+        if endpoint is None:
+            parts = urlsplit(url)
+            endpoint = f"{method} {parts.netloc}{parts.path}"
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        failed = True
+        try:
+            self._connect()
+            if self._httpx is not None:
+                response = self._send_http2(method, url, **kwargs)
+            else:
+                response = self._session.request(method, url, **kwargs)
+            failed = response.status_code >= 400
+            return response
+        finally:
+            self._record(endpoint, time.perf_counter() - start, failed)
+
+    def stats(self):
+        """
+        Returns the latency histogram and error count of every endpoint called so far.
+        """
+        with self._lock:
+            return {
+                endpoint: {**histogram.snapshot(), "errors": self._errors[endpoint]}
+                for endpoint, histogram in self._latency.items()
+            }
+
+    def metrics(self):
+        """
+        Returns the latency and error metrics of every endpoint, for export.
+        """
+        stats = self.stats()
+        return [
+            Metric(
+                "http_request_duration_seconds",
+                "histogram",
+                "Latency of outbound HTTP calls.",
+                [({"endpoint": endpoint}, entry) for endpoint, entry in stats.items()],
+            ),
+            Metric(
+                "http_request_errors_total",
+                "counter",
+                "Outbound HTTP calls that failed or returned an error status.",
+                [
+                    ({"endpoint": endpoint}, entry["errors"])
+                    for endpoint, entry in stats.items()
+                ],
+            ),
+        ]
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+        if self._httpx is not None:
+            self._httpx.close()
+
+    def _connect(self):
+        # set up the connection pools on the first request
+        if self._session is not None:
+            return
+        with self._lock:
+            if self._session is not None:
+                return
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            if self.http2:
+                # HTTP/2 is optional; httpx raises ImportError when it is
+                # missing, or when it is installed without h2
+                try:
+                    import httpx
+
+                    self._httpx = httpx.Client(
+                        http2=True,
+                        limits=httpx.Limits(
+                            max_connections=self.pool_connections * self.pool_maxsize,
+                            max_keepalive_connections=self.pool_maxsize,
+                        ),
+                    )
+                except ImportError as e:
+                    print(f"HTTP/2 is not available ({e}), falling back to HTTP/1.1")
+            self._session = session
+
+    def _record(self, endpoint, seconds, failed):
+        with self._lock:
+            histogram = self._latency.get(endpoint)
+            if histogram is None:
+                histogram = self._latency[endpoint] = LatencyHistogram()
+                self._errors[endpoint] = 0
+            histogram.observe(seconds)
+            if failed:
+                self._errors[endpoint] += 1
+
+    def _send_http2(self, method, url, timeout, **kwargs):
+        import httpx
+        import requests
+
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            timeout = httpx.Timeout(read, connect=connect)
+        try:
+            return self._httpx.request(method, url, timeout=timeout, **kwargs)
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.ConnectionError(str(e)) from e
+
+
+# the client shared by the whole app; set ARTHROPOD_HTTP2=1 to use HTTP/2
+http_client = HttpClient(http2=os.environ.get("ARTHROPOD_HTTP2") == "1")
@@ -0,0 +1,139 @@
+import json
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app_files.catalog import CSV_COLUMNS, SpeciesRecord
+
+
+class KeyNode(NamedTuple):
+    """
+    One step of the dichotomous key: either a question whose answers lead to
+    other nodes, or a result (a leaf) with an example image.
+    """
+
+    id: str
+    question: Optional[str]
+    # (answer, id of the node it leads to) pairs, empty for a leaf
+    answers: Tuple[Tuple[str, str], ...]
+    result: Optional[str]
+    image: Optional[str]
+    # Common Names of the species still possible at this node
+    candidates: Tuple[str, ...]
+
+    @property
+    def is_leaf(self):
+        return not self.answers
+
+
+def _matches(record: SpeciesRecord, taxa: List[Dict[str, str]]) -> bool:
+    # a record matches a leaf if it has every value of any one of its filters
+    return any(
+        all(record[CSV_COLUMNS.index(column)] == value for column, value in f.items())
+        for f in taxa
+    )
+
+
+class DichotomousKey:
+    """
+    A dichotomous key compiled from data into a decision tree.
+
+    The key is described in a JSON file (see dichotomous_key.json) as a root
+    node id and a map of nodes. A question node has a "question" and
+    "answers" mapping each answer to the next node; a leaf has a "result", an
+    "image" and "taxa", a list of {data.csv column: value} filters selecting
+    the species it stands for. Compiling checks that the nodes form a tree and
+    works out, once, which species are still possible at every node, so
+    walking the key is a dictionary lookup per answer.
+
+    Args:
+        root (str): Id of the first node.
+        nodes (dict): The nodes, by id, as read from the JSON file.
+        catalog (TaxonomyCatalog): The species catalog the leaves refer to.
+
+    Raises:
+        ValueError: If an answer leads to a missing node, a node is reached
+            twice or never, or a leaf has no valid taxa.
+    """
+
+    def __init__(self, root, nodes, catalog):
+        self.root = root
+        records = [catalog[name] for name in catalog.common_names()]
+        self._nodes: Dict[str, KeyNode] = {}
+        self._compile(root, nodes, records)
+        unreachable = set(nodes) - set(self._nodes)
+        if unreachable:
+            raise ValueError(f"unreachable key nodes: {', '.join(sorted(unreachable))}")
+
+    @classmethod
+    def from_json(cls, path, catalog) -> "DichotomousKey":
+        """
+        Compiles the key described in a JSON file.
+
+        Args:
+            path (str): Path to the JSON file.
+            catalog (TaxonomyCatalog): The species catalog.
+
+        Returns:
+            DichotomousKey: The compiled key.
+        """
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+        return cls(data["root"], data["nodes"], catalog)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, node_id) -> bool:
+        return node_id in self._nodes
+
+    def __getitem__(self, node_id) -> KeyNode:
+        return self._nodes[node_id]
+
+    def next_images(self, node_id) -> List[str]:
+        """
+        Returns the images of the nodes one answer away from the given one,
+        which are worth prefetching while the surveyor reads the question.
+        """
+        return [
+            self._nodes[next_id].image
+            for _, next_id in self._nodes[node_id].answers
+            if self._nodes[next_id].image
+        ]
+
+    def _compile(self, node_id, nodes, records) -> KeyNode:
+        if node_id not in nodes:
+            raise ValueError(f"key node {node_id!r} does not exist")
+        if node_id in self._nodes:
+            raise ValueError(f"key node {node_id!r} is reached more than once")
+        spec = nodes[node_id]
+        # reserve the id so that a cycle back to this node is caught above
+        self._nodes[node_id] = None
+        answers = tuple(spec.get("answers", {}).items())
+        if answers:
+            candidates = set()
+            for _, next_id in answers:
+                candidates.update(self._compile(next_id, nodes, records).candidates)
+        elif spec.get("taxa"):
+            for f in spec["taxa"]:
+                unknown = set(f) - set(CSV_COLUMNS)
+                if unknown:
+                    raise ValueError(
+                        f"key node {node_id!r} filters on unknown columns: "
+                        f"{', '.join(sorted(unknown))}"
+                    )
+            candidates = {
+                record.common_name
+                for record in records
+                if _matches(record, spec["taxa"])
+            }
+        else:
+            raise ValueError(f"key node {node_id!r} has neither answers nor taxa")
+        node = KeyNode(
+            node_id,
+            spec.get("question"),
+            answers,
+            spec.get("result"),
+            spec.get("image"),
+            tuple(sorted(candidates)),
+        )
+        self._nodes[node_id] = node
+        return node
@@ -0,0 +1,250 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app_files.airtable_utils import SpeciesPhotos, fetch_species_photos, pick_image_url
+
+# one week
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+
+class SpeciesImageCache:
+    """
+    Two-level cache of iNaturalist species photos keyed by genus and species.
+
+    Lookups go to an in-process LRU first, then to a persistent SQLite store,
+    and only then to iNaturalist. A single fetch stores the taxon ID and every
+    photo URL, so all images of a species cost one round trip pair at most.
+    Worker processes that open the same SQLite file share the store, so a
+    species looked up by one worker is a disk hit for all the others.
+
+    Args:
+        path (str): Path of the SQLite database, or ":memory:" for a cache that
+            only lives as long as the process.
+        ttl (float): Seconds after which a stored entry is fetched again.
+        max_entries (int): Maximum number of species kept in the SQLite store;
+            the least recently used ones are evicted first.
+        memory_entries (int): Maximum number of species kept in the in-process LRU.
+        fetcher (callable): Called as fetcher(genus, species) on a miss and
+            expected to return SpeciesPhotos, or None when the fetch failed.
+    """
+
+    def __init__(
+        self,
+        path=":memory:",
+        ttl=DEFAULT_TTL,
+        max_entries=5000,
+        memory_entries=256,
+        fetcher=fetch_species_photos,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.fetcher = fetcher
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        if path != ":memory:":
+            # lets workers read the store while another one writes to it
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS species_images (
+                key TEXT PRIMARY KEY,
+                taxon_id INTEGER,
+                photo_urls TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS species_images_accessed_at"
+            " ON species_images (accessed_at)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(genus, species):
+        return f"{genus} {species}".casefold()
+
+    def get(self, genus, species):
+        """
+        Returns the photos of a species, fetching them on a miss.
+
+        Args:
+            genus (str): The genus of the species.
+            species (str): The species name.
+
+        Returns:
+            SpeciesPhotos: The cached or freshly fetched photos, or None when
+            the species is not cached and fetching it failed.
+        """
+        photos = self.cached(genus, species)
+        if photos is not None:
+            return photos
+        with self._lock:
+            self.misses += 1
+
+        photos = self.fetcher(genus, species)
+        if photos is not None:
+            self.put(genus, species, photos)
+        return photos
+
+    def cached(self, genus, species):
+        """
+        Returns the photos of a species if either cache level holds them,
+        without ever fetching them.
+        """
+        key = self.key(genus, species)
+        now = time.time()
+        with self._lock:
+            photos = self._get_memory(key, now)
+            if photos is not None:
+                self.memory_hits += 1
+                return photos
+            photos = self._get_disk(key, now)
+            if photos is not None:
+                self.disk_hits += 1
+            return photos
+
+    def image_url(self, genus, species, image_number):
+        """
+        Returns one image URL of a species, like get_species_image does.
+        """
+        return pick_image_url(self.get(genus, species), image_number)
+
+    def put(self, genus, species, photos, fetched_at=None):
+        """
+        Stores the photos of a species in both cache levels.
+        """
+        key = self.key(genus, species)
+        now = time.time()
+        if fetched_at is None:
+            fetched_at = now
+        with self._lock:
+            self._put_memory(key, photos, fetched_at)
+            self._db.execute(
+                "INSERT OR REPLACE INTO species_images VALUES (?, ?, ?, ?, ?)",
+                (key, photos.taxon_id, json.dumps(photos.photo_urls), fetched_at, now),
+            )
+            self._evict_disk()
+            self._db.commit()
+
+    def preload(self, entries, fetched_at=None):
+        """
+        Seeds the persistent store with prefetched photos. Species that are
+        already stored keep their entry, unless it has expired.
+
+        Args:
+            entries (dict): Maps (genus, species) to SpeciesPhotos.
+            fetched_at (float): When the entries count as fetched, as a Unix
+                timestamp. Defaults to now, so that prefetched photos get a
+                full TTL from each load however old the prefetch is; the
+                photos of a species seldom change.
+        """
+        now = time.time()
+        if fetched_at is None:
+            fetched_at = now
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO species_images VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET taxon_id = excluded.taxon_id,"
+                " photo_urls = excluded.photo_urls, fetched_at = excluded.fetched_at"
+                " WHERE species_images.fetched_at < ?",
+                [
+                    (
+                        self.key(genus, species),
+                        photos.taxon_id,
+                        json.dumps(photos.photo_urls),
+                        fetched_at,
+                        now,
+                        now - self.ttl,
+                    )
+                    for (genus, species), photos in entries.items()
+                ],
+            )
+            self._evict_disk()
+            self._db.commit()
+
+    def stats(self):
+        """
+        Returns the hit and miss counters and the number of cached species.
+        """
+        with self._lock:
+            (stored,) = self._db.execute(
+                "SELECT COUNT(*) FROM species_images"
+            ).fetchone()
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "disk_entries": stored,
+            }
+
+    def clear(self):
+        """
+        Drops every cached entry.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM species_images")
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def _get_memory(self, key, now):
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        photos, fetched_at = entry
+        if now - fetched_at > self.ttl:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return photos
+
+    def _put_memory(self, key, photos, fetched_at):
+        self._memory[key] = (photos, fetched_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _get_disk(self, key, now):
+        row = self._db.execute(
+            "SELECT taxon_id, photo_urls, fetched_at FROM species_images WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        taxon_id, photo_urls, fetched_at = row
+        if now - fetched_at > self.ttl:
+            self._db.execute("DELETE FROM species_images WHERE key = ?", (key,))
+            self._db.commit()
+            return None
+        self._db.execute(
+            "UPDATE species_images SET accessed_at = ? WHERE key = ?", (now, key)
+        )
+        self._db.commit()
+        photos = SpeciesPhotos(taxon_id, json.loads(photo_urls))
+        self._put_memory(key, photos, fetched_at)
+        return photos
+
+    def _evict_disk(self):
+        self._db.execute(
+            """
+            DELETE FROM species_images WHERE key IN (
+                SELECT key FROM species_images
+                ORDER BY accessed_at DESC
+                LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        )
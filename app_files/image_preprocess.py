@@ -0,0 +1,95 @@
+import os
+import time
+from typing import NamedTuple
+
+# longest edge, in pixels, of the images we upload
+MAX_EDGE = 2048
+# JPEG quality of the re-encoded images
+QUALITY = 82
+
+EXIF_IFD = 0x8769
+DATETIME = 0x0132
+DATETIME_ORIGINAL = 0x9003
+OFFSET_TIME_ORIGINAL = 0x9011
+
+
+class PreprocessResult(NamedTuple):
+    """
+    The file to upload, its size and the size of the original, and how long
+    preprocessing took.
+    """
+
+    path: str
+    original_bytes: int
+    compressed_bytes: int
+    seconds: float
+
+
+def capture_time_exif(exif):
+    """
+    Builds EXIF data holding only the capture time of the given EXIF data.
+    """
+    from PIL import Image
+
+    capture_exif = Image.Exif()
+    if DATETIME in exif:
+        capture_exif[DATETIME] = exif[DATETIME]
+    original = exif.get_ifd(EXIF_IFD)
+    for tag in (DATETIME_ORIGINAL, OFFSET_TIME_ORIGINAL):
+        if tag in original:
+            capture_exif.get_ifd(EXIF_IFD)[tag] = original[tag]
+    return capture_exif
+
+
+def preprocess_image(path, output_path=None, max_edge=MAX_EDGE, quality=QUALITY):
+    """
+    Shrinks a photo before it is uploaded.
+
+    The photo is rotated according to its EXIF orientation, scaled down so that
+    its longest edge is at most max_edge pixels, and re-encoded as JPEG. All
+    metadata except the capture time is dropped. JPEGs are decoded in draft
+    mode at the smallest scale that is still at least max_edge pixels, so a
+    48 MP photo is never decoded at full resolution.
+
+    Args:
+        path (str): Path of the original image.
+        output_path (str): Where to write the compressed image. Defaults to the
+            original path with a ".upload.jpg" suffix.
+        max_edge (int): Longest edge of the compressed image, in pixels.
+        quality (int): JPEG quality of the compressed image.
+
+    Returns:
+        PreprocessResult: The compressed image, or the original one if
+        compressing did not make it smaller.
+    """
+    # Pillow is only imported once a photo is actually uploaded
+    from PIL import Image, ImageOps
+
+    start = time.perf_counter()
+    if output_path is None:
+        output_path = f"{path}.upload.jpg"
+    original_bytes = os.path.getsize(path)
+
+    with Image.open(path) as image:
+        exif = image.getexif()
+        # only has an effect on JPEGs; picks a DCT scale of 1/2, 1/4 or 1/8
+        image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(
+            output_path,
+            "JPEG",
+            quality=quality,
+            optimize=True,
+            exif=capture_time_exif(exif).tobytes(),
+        )
+
+    compressed_bytes = os.path.getsize(output_path)
+    if compressed_bytes >= original_bytes:
+        os.remove(output_path)
+        output_path, compressed_bytes = path, original_bytes
+    return PreprocessResult(
+        output_path, original_bytes, compressed_bytes, time.perf_counter() - start
+    )
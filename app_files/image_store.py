@@ -0,0 +1,139 @@
+"""
+Content-addressed store of the photos picked for upload.
+
+Each photo is known by the SHA-256 of its file. The store remembers the remote
+URL each photo was uploaded to, so a photo picked again, say for several
+observations of one specimen, is not uploaded twice. It also keeps a small
+JPEG thumbnail of each photo to show in the app instead of the full image.
+Worker processes that open the same directory share the store.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+# longest edge, in pixels, of the thumbnails shown in the app
+THUMBNAIL_EDGE = 256
+# JPEG quality of the thumbnails
+THUMBNAIL_QUALITY = 80
+# bytes read at a time while hashing
+READ_SIZE = 1 << 20
+
+DIGEST_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+def file_digest(path, read_size=READ_SIZE):
+    """
+    Returns the SHA-256 of a file as hex, reading it a block at a time.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while True:
+            block = file.read(read_size)
+            if not block:
+                return digest.hexdigest()
+            digest.update(block)
+
+
+class ImageStore:
+    """
+    Remembers where photos were uploaded, and keeps their thumbnails.
+
+    Args:
+        directory (str): Directory of the SQLite index and the thumbnails.
+        thumbnail_edge (int): Longest edge of the thumbnails, in pixels.
+    """
+
+    def __init__(self, directory="image_store", thumbnail_edge=THUMBNAIL_EDGE):
+        self.directory = directory
+        self.thumbnail_edge = thumbnail_edge
+        os.makedirs(os.path.join(directory, "thumbnails"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(directory, "images.sqlite3"),
+            timeout=30,
+            check_same_thread=False,
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                digest TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                bytes INTEGER NOT NULL,
+                uploaded_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.commit()
+
+    def url(self, digest):
+        """
+        Returns the URL a photo was uploaded to, or None.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url FROM images WHERE digest = ?", (digest,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def remember(self, digest, url, size):
+        """
+        Records the URL a photo of size bytes was uploaded to.
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO images (digest, url, bytes, uploaded_at)"
+                " VALUES (?, ?, ?, ?)",
+                (digest, url, size, time.time()),
+            )
+            self._db.commit()
+
+    def thumbnail_path(self, digest):
+        """
+        Returns where the thumbnail of a photo is, or would be, stored.
+
+        Raises:
+            ValueError: If digest is not a SHA-256 in hex.
+        """
+        if not DIGEST_PATTERN.fullmatch(digest):
+            raise ValueError(f"Not a SHA-256 digest: {digest}")
+        return os.path.join(self.directory, "thumbnails", f"{digest}.jpg")
+
+    def thumbnail(self, path, digest):
+        """
+        Makes the thumbnail of a photo, unless it already exists.
+
+        Args:
+            path (str): Path of the photo.
+            digest (str): Its SHA-256, from file_digest().
+
+        Returns:
+            str: The path of the thumbnail.
+        """
+        from PIL import Image, ImageOps
+
+        target = self.thumbnail_path(digest)
+        if os.path.exists(target):
+            return target
+        edge = self.thumbnail_edge
+        with Image.open(path) as image:
+            image.draft("RGB", (edge, edge))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            # written aside and renamed, so other workers never see half a file
+            fd, temporary = tempfile.mkstemp(
+                suffix=".jpg", dir=os.path.dirname(target)
+            )
+            with os.fdopen(fd, "wb") as file:
+                image.save(file, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+        os.replace(temporary, target)
+        return target
+
+    def close(self):
+        self._db.close()
@@ -1,10 +1,18 @@
-import requests
+import os
 
+from app_files.http_client import http_client
+from app_files.telemetry import telemetry
 
-def upload_image_to_imgur(image_path):
-    client_id = "<insert_your_client_id_here>"
-    # Set Imgur API endpoint
-    api_url = "https://api.imgur.com/3/upload"
+IMGUR_UPLOAD_URL = os.environ.get(
+    "ARTHROPOD_IMGUR_URL", "https://api.imgur.com/3/upload"
+)
+# (connect, read) timeouts in seconds
+UPLOAD_TIMEOUT = (10, 120)
+
+
+@telemetry.timed("upload_image_to_imgur")
+def upload_image_to_imgur(image_path, api_url=IMGUR_UPLOAD_URL, timeout=UPLOAD_TIMEOUT):
+    client_id = os.environ.get("ARTHROPOD_IMGUR_CLIENT_ID", "<insert_your_client_id_here>")
 
     # Set headers with client ID
     headers = {
@@ -18,7 +26,14 @@ def upload_image_to_imgur(image_path):
         data = {"type": "file"}
 
         # Make the API request
-        response = requests.post(api_url, headers=headers, files=files, data=data)
+        response = http_client.post(
+            api_url,
+            endpoint="imgur upload",
+            headers=headers,
+            files=files,
+            data=data,
+            timeout=timeout,
+        )
 
         # Check if the request was successful
         if response.status_code == 200:
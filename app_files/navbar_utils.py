@@ -1,11 +1,87 @@
 from shiny import App, Inputs, Outputs, Session, reactive, render, ui, req
 import json
+import os
 
-# read survey.json file
-with open("survey.json", 'r') as file:
+from app_files.observation_grid import observation_grid
+from app_files.observation_io import available_formats
+from app_files.survey_rollup import DIMENSIONS, PERIODS, TAXA
+
+# read survey.json file, next to app.py whatever the working directory
+SURVEY_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "survey.json")
+with open(SURVEY_PATH, 'r') as file:
     data = json.load(file)
 
 
+# selectize.js options of the specimen picker. Its options are searched on the
+# server, so the client shows them in the server's order instead of filtering
+# them again with its own matching.
+SPECIMEN_SELECTIZE_CONFIG = {
+    "loadThrottle": 150,
+    "maxOptions": 50,
+    "score": """function(search) {
+        var self = this;
+        return function(item) { return (self.serverRanks || {})[item.value] || 0; };
+    }""",
+    "onLoad": """function(data) {
+        var ranks = {};
+        for (var i = 0; i < data.length; i++) { ranks[data[i].value] = data[i].rank; }
+        this.serverRanks = ranks;
+        // always ask the server again, the ranks only hold for the latest query
+        this.loadedSearches = {};
+        this.refreshOptions(this.isFocused);
+    }""",
+}
+
+
+def specimen_selectize():
+    """
+    Builds the specimen picker. It is laid out like ui.input_selectize (whose
+    selectize.js dependency the other pickers on the page bring in), but
+    carries the options above.
+    """
+    return ui.div(
+        ui.tags.label(
+            "Specimen", class_="control-label", id="specimen-label", for_="specimen"
+        ),
+        ui.div(
+            ui.tags.select(class_="shiny-input-select", id="specimen"),
+            ui.tags.script(
+                json.dumps(SPECIMEN_SELECTIZE_CONFIG),
+                type="application/json",
+                data_for="specimen",
+                data_eval=json.dumps(["score", "onLoad"]),
+            ),
+        ),
+        class_="form-group shiny-input-container",
+    )
+
+
+# cookie with a random ID of the browser, so that a reload restores the unsynced
+# observations recorded in it and nobody else's
+DEVICE_COOKIE = "arthropod_device"
+# sets the cookie while the page loads, before Shiny opens its websocket, whose
+# handshake then carries it
+DEVICE_SCRIPT = """
+(function() {
+  var name = "%s=";
+  if (document.cookie.split("; ").some(function(c) { return c.indexOf(name) === 0; })) {
+    return;
+  }
+  var id = window.crypto && crypto.randomUUID
+    ? crypto.randomUUID()
+    : Date.now().toString(36) + "-" + Math.random().toString(36).slice(2);
+  document.cookie = name + id + "; max-age=31536000; path=/; SameSite=Lax";
+})();
+""" % DEVICE_COOKIE
+
+
+def device_cookie():
+    """
+    Builds the script that gives the browser its device cookie.
+    """
+    return ui.tags.script(DEVICE_SCRIPT)
+
+
 def record_observation():
     return ui.nav(
         "Record observation",
@@ -37,7 +113,7 @@ def record_observation():
                     label="Select the side",
                     choices=data["survey_side"],
                 ),
-                ui.input_selectize("specimen", label="Specimen", choices={}),
+                specimen_selectize(),
                 ui.input_slider(
                     "count", label="Count observed", min=1, max=100, value=1
                 ),
@@ -62,162 +138,289 @@ def record_observation():
 def verify_observation():
     return ui.nav(
         "Verify observation",
-        ui.output_data_frame("observations_data_frame"),
+        observation_grid("observations_grid"),
         ui.page_fluid(
             ui.input_action_button(
-                "reset", "Clear selected observation", class_="btn btn-outline-info"
+                "reset", "Clear selected observations", class_="btn btn-outline-info"
             ),
             ui.br(),
             ui.br(),
             ui.input_action_button(
                 "sync", "Sync all observations", class_="btn btn-outline-danger"
             ),
+            ui.br(),
+            ui.br(),
+            ui.input_select(
+                "export_format",
+                "Download format",
+                {fmt: fmt.upper() for fmt in available_formats()},
+            ),
+            ui.download_button("export_observations", "Download observations"),
         ),
     )
 
 
 def dichotomous_key():
+    # only the current step of the key is rendered, by the server (see key_node)
     return ui.nav(
         "Dichotomous Key for Arthropods (WIP)",
         ui.layout_column_wrap(
-            ui.card(
-                ui.input_radio_buttons(
-                    "legs",
-                    "Choose number of legs in specimen",
-                    ["8 legs", "6 legs", "More than 8 legs"],
-                    selected=None,
-                ),
-                ui.panel_conditional(
-                    "input.legs === 'More than 8 legs'",
-                    ui.input_radio_buttons(
-                        "is_isopod",
-                        "Does it have seven pairs of tiny legs?",
-                        ["Yes", "No"],
-                    ),
-                    ui.panel_conditional(
-                        "input.legs === 'More than 8 legs' && input.is_isopod === 'Yes'",
-                        ui.code("It is an isopod"),
-                        ui.br(),
-                        ui.br(),
-                        ui.tags.img(
-                            src="https://upload.wikimedia.org/wikipedia/commons/7/7f/Oniscus_asellus_-_male_side_2_%28aka%29.jpg",
-                            width="100%",
-                            height="100%",
-                        ),
-                    ),
-                    ui.panel_conditional(
-                        "input.legs === 'More than 8 legs' && input.is_isopod === 'No'",
-                        ui.input_radio_buttons(
-                            "pair_of_legs",
-                            "How many pairs of legs does the specimen have in each body segment?",
-                            ["1", "2"],
-                        ),
-                        ui.panel_conditional(
-                            "input.legs === 'More than 8 legs' && input.pair_of_legs === '2'",
-                            ui.code("It is a millipede"),
-                            ui.br(),
-                            ui.br(),
-                            ui.tags.img(
-                                src="https://upload.wikimedia.org/wikipedia/commons/b/bb/Millipede_collage.jpg",
-                                width="100%",
-                                height="100%",
-                            ),
-                        ),
-                        ui.panel_conditional(
-                            "input.legs === 'More than 8 legs' && input.pair_of_legs === '1'",
-                            ui.code("It is a centipede"),
-                            ui.br(),
-                            ui.br(),
-                            ui.tags.img(
-                                src="https://upload.wikimedia.org/wikipedia/commons/c/c1/Chilopoda_collage.png",
-                                width="100%",
-                                height="100%",
-                            ),
-                        ),
-                    ),
+            ui.card(ui.output_ui("key_node")),
+            ui.output_ui("possible_candidates"),
+        ),
+    )
+
+
+def key_node_ui(node, path, prefetch):
+    """
+    Builds the card body of one step of the dichotomous key.
+
+    Args:
+        node (KeyNode): The current node.
+        path (list): The (question, answer) pairs that led to it.
+        prefetch (list): Image URLs the browser may fetch ahead of time.
+
+    Returns:
+        ui.TagList: The answers so far, then the question or the result.
+    """
+    steps = [ui.tags.li(f"{question} {answer}") for question, answer in path]
+    if node.is_leaf:
+        body = [
+            ui.code(node.result),
+            ui.br(),
+            ui.br(),
+            ui.tags.img(src=node.image, width="100%", height="100%"),
+        ]
+    else:
+        body = [
+            ui.input_radio_buttons(
+                "key_answer",
+                node.question,
+                {next_id: answer for answer, next_id in node.answers},
+                selected="",
+            )
+        ]
+    buttons = []
+    if path:
+        buttons = [
+            ui.input_action_button(
+                "key_back", "Back", class_="btn btn-outline-secondary btn-sm"
+            ),
+            ui.input_action_button(
+                "key_restart", "Start over", class_="btn btn-outline-secondary btn-sm"
+            ),
+        ]
+    return ui.TagList(
+        ui.tags.ol(*steps, class_="text-muted") if steps else None,
+        *body,
+        ui.div(*buttons),
+        *[ui.tags.link(rel="prefetch", href=url, as_="image") for url in prefetch],
+    )
+
+
+def possible_candidates_ui(node):
+    """
+    Lists the species that are still possible at a step of the dichotomous key.
+    """
+    return ui.card(
+        ui.h4(f"Possible candidates ({len(node.candidates)})"),
+        ui.tags.ul(*[ui.tags.li(name) for name in node.candidates]),
+    )
+
+
+def performance_panel():
+    return ui.nav(
+        "Performance",
+        ui.output_ui("performance"),
+    )
+
+
+def performance_ui(metrics, enabled):
+    """
+    Builds the tables of the Performance tab.
+
+    Args:
+        metrics (list): The Metrics recorded by the app's telemetry.
+        enabled (bool): Whether telemetry is recording.
+
+    Returns:
+        ui.TagList: One table of timings and one of counters and gauges.
+    """
+    if not enabled:
+        return ui.markdown(
+            "Telemetry is off. Set `ARTHROPOD_TELEMETRY=1` to record it."
+        )
+    timings, values = [], []
+    for metric in metrics:
+        for labels, value in metric.samples:
+            label = ", ".join(labels.values())
+            if metric.kind != "histogram":
+                values.append(
+                    ui.tags.tr(
+                        ui.tags.td(metric.name), ui.tags.td(label), ui.tags.td(value)
+                    )
+                )
+                continue
+            if not value["count"]:
+                continue
+            # upper bound of the bucket holding the 95th percentile
+            cumulative, p95 = 0, float("inf")
+            for bound, count in value["buckets"].items():
+                cumulative += count
+                if cumulative >= 0.95 * value["count"]:
+                    p95 = bound
+                    break
+            timings.append(
+                ui.tags.tr(
+                    ui.tags.td(metric.name),
+                    ui.tags.td(label),
+                    ui.tags.td(value["count"]),
+                    ui.tags.td(f"{1000 * value['sum'] / value['count']:.1f}"),
+                    ui.tags.td(f"≤ {p95} s"),
+                )
+            )
+    header = ["Metric", "Operation", "Calls", "Mean (ms)", "95th percentile"]
+    return ui.TagList(
+        ui.tags.table(
+            ui.tags.thead(ui.tags.tr(*[ui.tags.th(name) for name in header])),
+            ui.tags.tbody(*timings),
+            class_="table table-sm",
+        ),
+        ui.tags.table(
+            ui.tags.thead(
+                ui.tags.tr(*[ui.tags.th(name) for name in ("Metric", "Label", "Value")])
+            ),
+            ui.tags.tbody(*values),
+            class_="table table-sm",
+        ),
+    )
+
+
+# custom message type of the survey summary charts, as handled in SUMMARY_SCRIPT
+SUMMARY_MESSAGE_TYPE = "survey_summary"
+# where the app serves the plotly.js bundled with the plotly package
+PLOTLY_JS_PATH = "plotly.min.js"
+# what the summary counts, by SurveyRollup.summary() column
+SUMMARY_MEASURES = {
+    "individuals": "Individuals counted",
+    "observations": "Observations",
+}
+# taxa shown separately in the summary chart; the others are added up as "Other"
+SUMMARY_TOP_TAXA = 10
+
+# plotly.js is only fetched when the first chart arrives, so that pages whose
+# Survey summary tab is never opened do not download it
+SUMMARY_SCRIPT = """
+(function() {
+  if (window.surveySummaryLoaded) return;
+  window.surveySummaryLoaded = true;
+  var pending = null, loading = false;
+
+  function draw(message) {
+    var figure = JSON.parse(message.figure);
+    Plotly.react(message.id, figure.data, figure.layout, {responsive: true});
+  }
+
+  Shiny.addCustomMessageHandler("survey_summary", function(message) {
+    if (window.Plotly) return draw(message);
+    pending = message;
+    if (loading) return;
+    loading = true;
+    var script = document.createElement("script");
+    script.src = "%s";
+    script.onload = function() { draw(pending); };
+    document.head.appendChild(script);
+  });
+})();
+""" % PLOTLY_JS_PATH
+
+
+def survey_summary():
+    return ui.nav(
+        "Survey summary",
+        ui.layout_sidebar(
+            ui.sidebar(
+                ui.input_select("summary_taxon", "Count by", list(TAXA)),
+                ui.input_select("summary_dimension", "Per", list(DIMENSIONS)),
+                ui.input_select(
+                    "summary_period", "Over", list(PERIODS), selected="Month"
                 ),
-                ui.panel_conditional(
-                    "input.legs === '6 legs'",
-                    ui.code("It is an insect"),
-                    ui.br(),
-                    ui.br(),
-                    ui.tags.img(
-                        src="https://upload.wikimedia.org/wikipedia/commons/e/ec/Insecta_Diversity.jpg",
-                        width="100%",
-                        height="100%",
-                    ),
+                ui.input_select("summary_measure", "Show", SUMMARY_MEASURES),
+                ui.input_select(
+                    "summary_location", "Location", ["All"] + data["location"]
                 ),
-                ui.panel_conditional(
-                    "input.legs === '8 legs'",
-                    ui.input_radio_buttons(
-                        "distinct",
-                        "Is the body separated into a cephalothorax and abdomen?",
-                        ["Yes", "No"],
-                    ),
-                    ui.panel_conditional(
-                        "input.legs === '8 legs' && input.distinct === 'Yes'",
-                        ui.code("It is a spider"),
-                        ui.br(),
-                        ui.br(),
-                        ui.tags.img(
-                            src="https://upload.wikimedia.org/wikipedia/commons/f/f9/Spiders_Diversity.jpg",
-                            width="100%",
-                            height="100%",
-                        ),
-                    ),
-                    ui.panel_conditional(
-                        "input.legs === '8 legs' && input.distinct === 'No'",
-                        ui.input_radio_buttons(
-                            "body_shape",
-                            "Does it have stilt-like legs?",
-                            ["Yes", "No"],
-                        ),
-                    ),
-                    ui.panel_conditional(
-                        "input.legs === '8 legs' && input.distinct === 'No' && input.body_shape === 'Yes'",
-                        ui.code("It is a harvestman"),
-                        ui.br(),
-                        ui.br(),
-                        ui.tags.img(
-                            src="https://upload.wikimedia.org/wikipedia/commons/9/90/Opiliones_harvestman.jpg",
-                            width="100%",
-                            height="100%",
-                        ),
-                    ),
-                    ui.panel_conditional(
-                        "input.legs === '8 legs' && input.distinct === 'No' && input.body_shape === 'No'",
-                        ui.input_radio_buttons(
-                            "arachnid_size",
-                            "Is it barely noticeable using the naked eye?",
-                            ["Yes", "No"],
-                        ),
-                    ),
-                    ui.panel_conditional(
-                        "input.legs === '8 legs' && input.distinct === 'No' && input.body_shape === 'No' && input.arachnid_size === 'Yes'",
-                        ui.code("It is a mite"),
-                        ui.br(),
-                        ui.br(),
-                        ui.tags.img(
-                            src="https://upload.wikimedia.org/wikipedia/commons/8/8d/Trombidium_holosericeum_%28aka%29.jpg",
-                            width="100%",
-                            height="100%",
-                        ),
-                    ),
-                    ui.panel_conditional(
-                        "input.legs === '8 legs' && input.distinct === 'No' && input.body_shape === 'No' && input.arachnid_size === 'No'",
-                        ui.code("It is a tick"),
-                        ui.br(),
-                        ui.br(),
-                        ui.tags.img(
-                            src="https://upload.wikimedia.org/wikipedia/commons/3/34/Adult_deer_tick.jpg",
-                            width="100%",
-                            height="100%",
-                        ),
-                    ),
+                ui.input_checkbox(
+                    "summary_pending", "Include observations not synced yet", True
                 ),
             ),
-            ui.output_ui("possible_candidates"),
+            ui.div(id="summary_chart"),
+            ui.output_ui("summary_table"),
+            ui.tags.script(SUMMARY_SCRIPT),
+        ),
+    )
+
+
+def summary_frame(rows, taxon, dimension, top=SUMMARY_TOP_TAXA):
+    """
+    Turns the rows of SurveyRollup.summary() into a DataFrame, with the taxa
+    beyond the most counted ones added up as "Other".
+    """
+    import pandas as pd
+
+    frame = pd.DataFrame(
+        rows, columns=["Period", dimension, taxon, "observations", "individuals"]
+    )
+    totals = frame.groupby(taxon)["individuals"].sum()
+    kept = totals.sort_values(ascending=False).index[:top]
+    frame[taxon] = frame[taxon].where(frame[taxon].isin(kept), "Other")
+    return frame.groupby(["Period", dimension, taxon], as_index=False).sum()
+
+
+def summary_figure(frame, taxon, dimension, measure):
+    """
+    Builds the summary chart: the counts of each period, stacked by taxon,
+    with one row of bars per value of the dimension.
+
+    Returns:
+        str: The plotly figure, as JSON.
+    """
+    import plotly.express as px
+
+    figure = px.bar(
+        frame,
+        x="Period",
+        y=measure,
+        color=taxon,
+        facet_row=dimension,
+        labels={measure: SUMMARY_MEASURES[measure]},
+        height=max(300, 220 * frame[dimension].nunique()),
+    )
+    figure.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
+    figure.update_layout(margin={"t": 30, "r": 30}, legend_title_text=taxon)
+    return figure.to_json()
+
+
+def summary_table_ui(frame, taxon, dimension, measure):
+    """
+    Builds the table of the totals of each taxon per value of the dimension.
+    """
+    if not len(frame):
+        return ui.markdown("No observations match these choices yet.")
+    table = frame.pivot_table(
+        index=taxon, columns=dimension, values=measure, aggfunc="sum", fill_value=0
+    )
+    table["Total"] = table.sum(axis=1)
+    table = table.sort_values("Total", ascending=False)
+    header = [taxon] + [str(column) for column in table.columns]
+    return ui.tags.table(
+        ui.tags.thead(ui.tags.tr(*[ui.tags.th(name) for name in header])),
+        ui.tags.tbody(
+            *[
+                ui.tags.tr(ui.tags.td(name), *[ui.tags.td(int(v)) for v in values])
+                for name, values in zip(table.index, table.values)
+            ]
         ),
+        class_="table table-sm",
     )
 
 
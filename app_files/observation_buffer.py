@@ -0,0 +1,140 @@
+class ObservationBuffer:
+    """
+    Append-optimized, columnar store of the observations of a session.
+
+    Each column is a plain list, so appending a row is amortized O(1) and never
+    copies the rows already stored. Rows are addressed by a stable row ID;
+    deleting one only marks its slot, and the slots are reclaimed once they
+    make up half of the buffer. A DataFrame is only built by to_frame(), when
+    something actually needs one.
+
+    Args:
+        columns (list): The column names. Fields with other names are added as
+            new columns when they first appear.
+    """
+
+    def __init__(self, columns):
+        self._columns = {column: [] for column in columns}
+        # row ID of each slot, or None when the row in that slot was deleted
+        self._ids = []
+        self._positions = {}
+        self._deleted = 0
+        # bumped on every change, so readers can tell when to rebuild their views
+        self.version = 0
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, row_id):
+        return row_id in self._positions
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def append(self, row_id, fields):
+        """
+        Adds a row.
+
+        Args:
+            row_id: A unique ID for the row, such as its observation queue ID.
+            fields (dict): The value of each column. Missing columns are None.
+        """
+        if row_id in self._positions:
+            raise KeyError(f"Row {row_id} already exists")
+        for column in fields:
+            if column not in self._columns:
+                self._columns[column] = [None] * len(self._ids)
+        for column, values in self._columns.items():
+            values.append(fields.get(column))
+        self._positions[row_id] = len(self._ids)
+        self._ids.append(row_id)
+        self.version += 1
+
+    def update(self, row_id, fields):
+        """
+        Changes some fields of a row in place.
+        """
+        position = self._positions[row_id]
+        for column, value in fields.items():
+            if column not in self._columns:
+                self._columns[column] = [None] * len(self._ids)
+            self._columns[column][position] = value
+        self.version += 1
+
+    def delete(self, row_id):
+        """
+        Removes a row by its ID.
+        """
+        position = self._positions.pop(row_id)
+        self._ids[position] = None
+        self._deleted += 1
+        if self._deleted * 2 > len(self._ids):
+            self._compact()
+        self.version += 1
+
+    def get(self, row_id):
+        """
+        Returns the fields of a row as a dict.
+        """
+        position = self._positions[row_id]
+        return {column: values[position] for column, values in self._columns.items()}
+
+    def ids(self):
+        """
+        Returns the IDs of the rows, in the order they were added.
+        """
+        return [row_id for row_id in self._ids if row_id is not None]
+
+    def records(self):
+        """
+        Returns (row ID, fields) pairs for every row, in the order they were added.
+        """
+        return [(row_id, self.get(row_id)) for row_id in self.ids()]
+
+    def rows(self, columns):
+        """
+        Yields (row ID, values) pairs for every row, in the order they were
+        added, with the values of the given columns as a tuple.
+        """
+        values = [self._columns[column] for column in columns]
+        for position, row_id in enumerate(self._ids):
+            if row_id is not None:
+                yield row_id, tuple(column[position] for column in values)
+
+    def to_frame(self, columns=None):
+        """
+        Builds a DataFrame of the rows, indexed by row ID.
+
+        Args:
+            columns (list): The columns to include, or None for all of them.
+        """
+        # pandas takes a while to import, and is not needed until the grid renders
+        import pandas as pd
+
+        if columns is None:
+            columns = self.columns
+        if self._deleted:
+            live = self._live_positions()
+            data = {
+                column: [self._columns[column][position] for position in live]
+                for column in columns
+            }
+        else:
+            data = {column: self._columns[column] for column in columns}
+        return pd.DataFrame(data, index=self.ids(), columns=columns)
+
+    def _live_positions(self):
+        return [
+            position for position, row_id in enumerate(self._ids) if row_id is not None
+        ]
+
+    def _compact(self):
+        live = self._live_positions()
+        for column, values in self._columns.items():
+            self._columns[column] = [values[position] for position in live]
+        self._ids = [self._ids[position] for position in live]
+        self._positions = {
+            row_id: position for position, row_id in enumerate(self._ids)
+        }
+        self._deleted = 0
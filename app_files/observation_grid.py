@@ -0,0 +1,285 @@
+"""
+Verify grid of the observations of a session, updated in place.
+
+The browser keeps the rows and draws one page of them at a time. The server
+keeps a copy of what the browser has and, whenever the observations change,
+sends only the difference: the rows added, the rows removed and the cells
+changed, each row addressed by its observation ID. Rows are selected with
+checkboxes; the IDs of the selected rows are sent back as the input
+"<id>_selected". Cells of image columns hold the URL of an image to show.
+"""
+import json
+
+from shiny import ui
+
+# columns of the observations shown in the verify grid
+GRID_COLUMNS = [
+    "Date observed",
+    "Plot",
+    "Survey Point",
+    "Side",
+    "Common Name",
+    "Count",
+    "Notes",
+    "Thumbnail",
+    "Image status",
+    "Problems",
+]
+# columns of GRID_COLUMNS shown as images
+IMAGE_COLUMNS = ("Thumbnail",)
+# custom message type of the grid updates, as handled in GRID_SCRIPT
+MESSAGE_TYPE = "observation_grid"
+
+GRID_SCRIPT = """
+(function() {
+  if (window.observationGrids) return;
+  var grids = window.observationGrids = {};
+
+  function state(id) {
+    if (!grids[id]) grids[id] = {rows: new Map(), selected: new Set(), page: 0};
+    return grids[id];
+  }
+
+  function sendSelection(id) {
+    if (window.Shiny && Shiny.setInputValue) {
+      Shiny.setInputValue(id + "_selected", Array.from(state(id).selected));
+    }
+  }
+
+  function pageIds(id, el) {
+    var g = state(id), size = Number(el.dataset.pageSize);
+    var pages = Math.max(1, Math.ceil(g.rows.size / size));
+    g.page = Math.max(0, Math.min(g.page, pages - 1));
+    var ids = Array.from(g.rows.keys()).slice(g.page * size, (g.page + 1) * size);
+    return {ids: ids, pages: pages, start: g.page * size};
+  }
+
+  function fill(cell, value, isImage) {
+    if (!isImage) {
+      cell.textContent = value;
+      return;
+    }
+    cell.replaceChildren();
+    if (!value) return;
+    var img = document.createElement("img");
+    img.src = value;
+    img.height = 48;
+    img.loading = "lazy";
+    cell.appendChild(img);
+  }
+
+  function imageColumns(el) {
+    return new Set(JSON.parse(el.dataset.imageColumns || "[]"));
+  }
+
+  function render(id) {
+    var el = document.getElementById(id), g = state(id);
+    if (!el) return;
+    var page = pageIds(id, el), body = document.createDocumentFragment();
+    var images = imageColumns(el);
+    page.ids.forEach(function(rowId) {
+      var tr = document.createElement("tr"), td = document.createElement("td");
+      var box = document.createElement("input");
+      box.type = "checkbox";
+      box.checked = g.selected.has(rowId);
+      box.addEventListener("change", function() {
+        box.checked ? g.selected.add(rowId) : g.selected.delete(rowId);
+        sendSelection(id);
+      });
+      td.appendChild(box);
+      tr.appendChild(td);
+      g.rows.get(rowId).forEach(function(value, column) {
+        var cell = document.createElement("td");
+        fill(cell, value, images.has(column));
+        tr.appendChild(cell);
+      });
+      tr.dataset.rowId = rowId;
+      body.appendChild(tr);
+    });
+    el.querySelector("tbody").replaceChildren(body);
+    el.querySelector(".grid-all").checked =
+      page.ids.length > 0 && page.ids.every(function(r) { return g.selected.has(r); });
+    el.querySelector(".grid-status").textContent = g.rows.size
+      ? "Rows " + (page.start + 1) + "-" + (page.start + page.ids.length) +
+        " of " + g.rows.size
+      : "No observations yet";
+    el.querySelector(".grid-previous").disabled = g.page === 0;
+    el.querySelector(".grid-next").disabled = g.page >= page.pages - 1;
+  }
+
+  function bind(id) {
+    var el = document.getElementById(id);
+    if (!el || el.dataset.bound) return;
+    el.dataset.bound = "true";
+    el.querySelector(".grid-previous").addEventListener("click", function() {
+      state(id).page -= 1;
+      render(id);
+    });
+    el.querySelector(".grid-next").addEventListener("click", function() {
+      state(id).page += 1;
+      render(id);
+    });
+    el.querySelector(".grid-all").addEventListener("change", function(event) {
+      var g = state(id);
+      pageIds(id, el).ids.forEach(function(rowId) {
+        event.target.checked ? g.selected.add(rowId) : g.selected.delete(rowId);
+      });
+      sendSelection(id);
+      render(id);
+    });
+  }
+
+  Shiny.addCustomMessageHandler("observation_grid", function(message) {
+    var id = message.id, g = state(id), redraw = false, selectionChanged = false;
+    bind(id);
+    if (message.reset) {
+      g.rows.clear();
+      selectionChanged = g.selected.size > 0;
+      g.selected.clear();
+      redraw = true;
+    }
+    message.remove.forEach(function(rowId) {
+      g.rows.delete(rowId);
+      selectionChanged = g.selected.delete(rowId) || selectionChanged;
+      redraw = true;
+    });
+    message.add.forEach(function(row) {
+      g.rows.set(row[0], row[1]);
+      redraw = true;
+    });
+    var el = document.getElementById(id), images = el ? imageColumns(el) : new Set();
+    message.patch.forEach(function(change) {
+      var cells = g.rows.get(change[0]);
+      var tr = el && el.querySelector('tr[data-row-id="' + change[0] + '"]');
+      Object.keys(change[1]).forEach(function(column) {
+        cells[Number(column)] = change[1][column];
+        // the first cell of a row holds its checkbox
+        if (tr) {
+          fill(
+            tr.children[Number(column) + 1], change[1][column],
+            images.has(Number(column))
+          );
+        }
+      });
+    });
+    if (selectionChanged) sendSelection(id);
+    if (redraw) render(id);
+  });
+})();
+"""
+
+
+def observation_grid(
+    id, columns=GRID_COLUMNS, page_size=25, image_columns=IMAGE_COLUMNS
+):
+    """
+    Builds the verify grid. It is filled by the updates of a GridState.
+
+    Args:
+        id (str): The ID of the grid.
+        columns (list): The column names.
+        page_size (int): The number of rows shown per page.
+        image_columns (tuple): The columns whose cells are image URLs.
+    """
+    return ui.div(
+        ui.tags.table(
+            ui.tags.thead(
+                ui.tags.tr(
+                    ui.tags.th(
+                        ui.tags.input(
+                            type="checkbox",
+                            class_="grid-all",
+                            title="Select the rows of this page",
+                        )
+                    ),
+                    *[ui.tags.th(column) for column in columns],
+                )
+            ),
+            ui.tags.tbody(),
+            class_="table table-sm table-hover",
+        ),
+        ui.div(
+            ui.tags.button(
+                "Previous", type="button", class_="btn btn-sm btn-light grid-previous"
+            ),
+            ui.tags.span("No observations yet", class_="grid-status mx-2"),
+            ui.tags.button(
+                "Next", type="button", class_="btn btn-sm btn-light grid-next"
+            ),
+        ),
+        ui.tags.script(GRID_SCRIPT),
+        id=id,
+        class_="observation-grid",
+        data_page_size=str(page_size),
+        data_image_columns=json.dumps(
+            [i for i, column in enumerate(columns) if column in image_columns]
+        ),
+    )
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return str(value)
+
+
+class GridState:
+    """
+    The rows a browser's verify grid holds, so that it is only sent what
+    changed.
+
+    Args:
+        id (str): The ID of the grid.
+        columns (list): The columns shown, in order.
+    """
+
+    def __init__(self, id, columns=GRID_COLUMNS):
+        self.id = id
+        self.columns = list(columns)
+        self._rows = None
+
+    def update(self, buffer):
+        """
+        Compares the grid with the observations and records the difference.
+
+        Args:
+            buffer (ObservationBuffer): The observations of the session.
+
+        Returns:
+            dict: The custom message bringing the browser up to date, or None
+            if it already is. The first message resets the grid, so that a
+            reconnected browser drops the rows it had before.
+        """
+        rows = {
+            row_id: tuple(map(_cell, values))
+            for row_id, values in buffer.rows(self.columns)
+        }
+        reset = self._rows is None
+        previous = self._rows or {}
+        added, patched = [], []
+        for row_id, cells in rows.items():
+            old = previous.get(row_id)
+            if old is None:
+                added.append([row_id, list(cells)])
+            elif old != cells:
+                changed = {
+                    column: value
+                    for column, (was, value) in enumerate(zip(old, cells))
+                    if was != value
+                }
+                patched.append([row_id, changed])
+        removed = [row_id for row_id in previous if row_id not in rows]
+        self._rows = rows
+        if not (reset or added or patched or removed):
+            return None
+        return {
+            "id": self.id,
+            "reset": reset,
+            "add": added,
+            "remove": removed,
+            "patch": patched,
+        }
@@ -0,0 +1,433 @@
+"""
+Bulk export and import of observations as CSV, JSONL or Parquet.
+
+Exports are written in chunks, so a large queue is never held in memory as
+one table, and the download of a session's observations starts before the
+last row is formatted. Imports, such as backfills of paper datasheets, are
+read in chunks too; each chunk is checked against data.csv and survey.json
+as one batch (see validation.py), and its taxonomy columns are filled in
+from the catalog. Valid rows can be written to a file for
+Airtable's own CSV import, which costs no API calls, or appended to the
+local observation queue.
+
+Parquet needs the optional pyarrow package.
+
+Usage:
+
+    python -m app_files.observation_io export observations.csv
+    python -m app_files.observation_io import datasheet.csv --output clean.csv \
+        --rejects rejects.csv
+"""
+import argparse
+import csv
+import importlib.util
+import io
+import json
+import os
+import tempfile
+import time
+
+from app_files.validation import ObservationValidator
+
+# columns of an export, in order; "Queue ID" is empty for imported rows
+EXPORT_COLUMNS = [
+    "Queue ID",
+    "Date observed",
+    "Location",
+    "Plot",
+    "Surveyors",
+    "Survey Point",
+    "Side",
+    "Class",
+    "Order",
+    "Family",
+    "Common Name",
+    "Genus",
+    "Species",
+    "Count",
+    "Notes",
+    "Url",
+    "Image status",
+    "Problems",
+]
+INTEGER_COLUMNS = ("Queue ID", "Count")
+FORMATS = ("csv", "jsonl", "parquet")
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+# rows formatted per chunk (and per Parquet row group)
+CHUNK_SIZE = 5000
+
+
+def available_formats():
+    """
+    Returns the formats that can be written here; Parquet only with pyarrow.
+    """
+    if importlib.util.find_spec("pyarrow") is None:
+        return [fmt for fmt in FORMATS if fmt != "parquet"]
+    return list(FORMATS)
+
+
+def _pyarrow():
+    # pyarrow is optional and only needed for Parquet
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ValueError("Parquet files need the pyarrow package") from e
+    return pyarrow, pyarrow.parquet
+
+
+def format_of(path):
+    """
+    Returns the format of a file from its extension.
+    """
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    fmt = {"ndjson": "jsonl", "pq": "parquet"}.get(extension, extension)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported file type: {path}")
+    return fmt
+
+
+def chunked(rows, size=CHUNK_SIZE):
+    """
+    Splits an iterable into lists of at most size items.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_rows(records, validator, columns=EXPORT_COLUMNS):
+    """
+    Yields export rows (tuples in column order) of observations, with their
+    taxonomy filled in. Each chunk of observations is validated as one
+    batch; the rows that do not pass keep their values and get their
+    problems in the "Problems" column.
+
+    Args:
+        records (iterable): (id, fields) pairs, such as the records of a
+            session's ObservationBuffer or ObservationQueue.iter_pending().
+        validator (ObservationValidator): Checks the observations.
+    """
+    for chunk in chunked(records):
+        valid, problems = validator.validate_records(chunk)
+        enriched = dict(valid)
+        for obs_id, fields in chunk:
+            if obs_id in problems:
+                fields = {**fields, "Problems": problems[obs_id]}
+            else:
+                fields = {**enriched[obs_id], "Problems": ""}
+            yield (obs_id,) + tuple(fields.get(column) for column in columns[1:])
+
+
+class ObservationWriter:
+    """
+    Writes rows of observations to a binary file, chunk by chunk.
+
+    Args:
+        file: A binary file object.
+        fmt (str): "csv", "jsonl" or "parquet".
+        columns (list): The column names, in the order of the row values.
+        integer_columns (tuple): Columns stored as integers in Parquet; the
+            others are stored as text.
+    """
+
+    def __init__(
+        self, file, fmt, columns=EXPORT_COLUMNS, integer_columns=INTEGER_COLUMNS
+    ):
+        self.file = file
+        self.fmt = fmt
+        self.columns = list(columns)
+        self.rows = 0
+        if fmt == "csv":
+            self._text = io.TextIOWrapper(
+                file, encoding="utf-8", newline="", write_through=True
+            )
+            self._csv = csv.writer(self._text)
+            self._csv.writerow(self.columns)
+        elif fmt == "parquet":
+            pa, pq = _pyarrow()
+            self._schema = pa.schema(
+                [
+                    (column, pa.int64() if column in integer_columns else pa.string())
+                    for column in self.columns
+                ]
+            )
+            self._table = pa.Table.from_pylist
+            self._parquet = pq.ParquetWriter(file, self._schema)
+        elif fmt != "jsonl":
+            raise ValueError(f"Unsupported format: {fmt}")
+
+    def write(self, rows):
+        """
+        Writes a chunk of rows.
+
+        Args:
+            rows (list): Tuples of values, in column order.
+        """
+        if self.fmt == "csv":
+            self._csv.writerows(rows)
+        elif self.fmt == "jsonl":
+            lines = [
+                json.dumps(dict(zip(self.columns, row)), ensure_ascii=False) + "\n"
+                for row in rows
+            ]
+            self.file.write("".join(lines).encode("utf-8"))
+        else:
+            records = [dict(zip(self.columns, row)) for row in rows]
+            self._parquet.write_table(self._table(records, schema=self._schema))
+        self.rows += len(rows)
+
+    def close(self):
+        """
+        Finishes the file, without closing the file object.
+        """
+        if self.fmt == "csv":
+            self._text.detach()
+        elif self.fmt == "parquet":
+            self._parquet.close()
+
+
+def write_observations(rows, path, fmt=None, columns=EXPORT_COLUMNS):
+    """
+    Writes rows of observations to a file, chunk by chunk.
+
+    Returns:
+        int: The number of rows written.
+    """
+    with open(path, "wb") as file:
+        writer = ObservationWriter(file, fmt or format_of(path), columns)
+        for chunk in chunked(rows):
+            writer.write(chunk)
+        writer.close()
+    return writer.rows
+
+
+def stream_observations(rows, fmt, columns=EXPORT_COLUMNS):
+    """
+    Yields an export as chunks of bytes, for a streaming download.
+
+    CSV and JSONL chunks are sent as soon as they are formatted. A Parquet
+    file only becomes valid once its footer is written, so it is spooled to
+    a temporary file first and then sent in blocks.
+    """
+    if fmt == "parquet":
+        with tempfile.TemporaryFile() as file:
+            writer = ObservationWriter(file, fmt, columns)
+            for chunk in chunked(rows):
+                writer.write(chunk)
+            writer.close()
+            file.seek(0)
+            while True:
+                block = file.read(1 << 20)
+                if not block:
+                    return
+                yield block
+    spool = io.BytesIO()
+    writer = ObservationWriter(spool, fmt, columns)
+    for chunk in chunked(rows):
+        writer.write(chunk)
+        yield spool.getvalue()
+        spool.seek(0)
+        spool.truncate()
+    writer.close()
+    if spool.getvalue():
+        yield spool.getvalue()
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """
+    Reads a CSV, JSONL or Parquet datasheet as DataFrames of chunk_size rows.
+    Every column is read as text.
+    """
+    import pandas as pd
+
+    fmt = format_of(path)
+    if fmt == "csv":
+        chunks = pd.read_csv(
+            path,
+            dtype=str,
+            keep_default_na=False,
+            chunksize=chunk_size,
+            encoding="utf-8-sig",
+        )
+    elif fmt == "jsonl":
+        chunks = pd.read_json(path, lines=True, dtype=False, chunksize=chunk_size)
+    else:
+        _, pq = _pyarrow()
+        batches = pq.ParquetFile(path).iter_batches(batch_size=chunk_size)
+        chunks = (batch.to_pandas() for batch in batches)
+    start = 0
+    for chunk in chunks:
+        # number the rows across chunks, so rejected rows can be found in the file
+        chunk.index = range(start, start + len(chunk))
+        start += len(chunk)
+        yield chunk.fillna("").astype(str)
+
+
+def frame_rows(frame):
+    """
+    Returns the rows of a DataFrame as tuples of plain Python values.
+    """
+    return frame.astype(object).itertuples(index=False, name=None)
+
+
+def queue_fields(frame):
+    """
+    Turns valid imported rows into observation fields for the local queue.
+    """
+    for row in frame.drop(columns=["Queue ID"]).to_dict("records"):
+        row["Count"] = int(row["Count"])
+        row["Image attachment"] = [{"url": row["Url"]}]
+        yield row
+
+
+def import_observations(
+    path,
+    output=None,
+    rejects=None,
+    queue=None,
+    taxonomy_path="data.csv",
+    survey_path="survey.json",
+    rollup=None,
+):
+    """
+    Validates a datasheet and writes its valid and rejected rows.
+
+    Args:
+        path (str): The CSV, JSONL or Parquet datasheet.
+        output (str): File for the valid rows, in the format of its extension.
+        rejects (str): File for the rejected rows, their row number and errors.
+        queue (ObservationQueue): Queue to append the valid rows to.
+        taxonomy_path (str): Path of data.csv.
+        survey_path (str): Path of survey.json.
+        rollup (SurveyRollup): Rollup to count the rows appended to the queue
+            in, as not synced yet, like the observations recorded in the app.
+
+    Returns:
+        tuple: (valid, rejected) row counts.
+    """
+    validator = ObservationValidator(taxonomy_path, survey_path)
+    files, writers = [], {}
+    counts = {"valid": 0, "rejected": 0}
+    try:
+        for chunk in read_chunks(path):
+            valid, rejected = validator.validate_frame(chunk)
+            valid = valid.reindex(columns=EXPORT_COLUMNS, fill_value="")
+            valid["Queue ID"] = None
+            # the row number in the datasheet, counting from 1 after the header
+            rejected.insert(len(rejected.columns) - 1, "Row", rejected.index + 1)
+            counts["valid"] += len(valid)
+            counts["rejected"] += len(rejected)
+            for name, target, frame in (
+                ("valid", output, valid),
+                ("rejected", rejects, rejected),
+            ):
+                if target is None or not len(frame):
+                    continue
+                if name not in writers:
+                    files.append(open(target, "wb"))
+                    writers[name] = ObservationWriter(
+                        files[-1],
+                        format_of(target),
+                        list(frame.columns),
+                        # rejected rows keep their values as read, as text
+                        INTEGER_COLUMNS if name == "valid" else ("Row",),
+                    )
+                writers[name].write(list(frame_rows(frame)))
+            if queue is not None and len(valid):
+                fields = list(queue_fields(valid))
+                queue.extend(fields)
+                if rollup is not None:
+                    rollup.add(fields)
+    finally:
+        for writer in writers.values():
+            writer.close()
+        for file in files:
+            file.close()
+    return counts["valid"], counts["rejected"]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export or import observations as CSV, JSONL or Parquet."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser(
+        "export", help="export the observations waiting in the local queue"
+    )
+    export.add_argument("output", help="file to write; its extension sets the format")
+    export.add_argument("--queue", default="observations.sqlite3")
+    backfill = commands.add_parser(
+        "import", help="validate a datasheet against data.csv and survey.json"
+    )
+    backfill.add_argument("datasheet", help="CSV, JSONL or Parquet file to import")
+    backfill.add_argument("--output", help="file for the valid rows")
+    backfill.add_argument("--rejects", help="file for the rejected rows")
+    backfill.add_argument(
+        "--queue", help="also append the valid rows to this observation queue"
+    )
+    backfill.add_argument(
+        "--rollup",
+        default="survey_rollup.sqlite3",
+        help="survey rollup to count the rows appended to the queue in",
+    )
+    for command in (export, backfill):
+        command.add_argument("--data", default="data.csv", help="path of data.csv")
+        command.add_argument(
+            "--survey", default="survey.json", help="path of survey.json"
+        )
+    args = parser.parse_args()
+
+    from app_files.catalog import TaxonomyCatalog
+    from app_files.observation_queue import ObservationQueue
+    from app_files.survey_rollup import SurveyRollup
+
+    start = time.perf_counter()
+    try:
+        if args.command == "export":
+            queue = ObservationQueue(args.queue)
+            validator = ObservationValidator(args.data, args.survey)
+            count = write_observations(
+                export_rows(queue.iter_pending(), validator), args.output
+            )
+            queue.close()
+            print(
+                f"Exported {count} observations to {args.output} "
+                f"in {time.perf_counter() - start:.1f} s"
+            )
+            return
+        queue = rollup = None
+        if args.queue:
+            queue = ObservationQueue(args.queue)
+            rollup = SurveyRollup(args.rollup, TaxonomyCatalog.from_csv(args.data))
+        valid, rejected = import_observations(
+            args.datasheet,
+            args.output,
+            args.rejects,
+            queue,
+            args.data,
+            args.survey,
+            rollup,
+        )
+        if queue is not None:
+            queue.close()
+            rollup.close()
+    except ValueError as e:
+        parser.error(str(e))
+    print(
+        f"{valid} valid and {rejected} rejected rows "
+        f"in {time.perf_counter() - start:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+    main()
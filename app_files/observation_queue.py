@@ -0,0 +1,431 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+# seconds a worker may hold a claim on observations before others may take them
+CLAIM_LEASE = 300
+# seconds an image upload holds its observation before it counts as interrupted;
+# the uploading worker renews the lease while the upload runs
+UPLOAD_LEASE = 120
+
+
+class ObservationQueue:
+    """
+    Durable local log of recorded observations waiting to be synced.
+
+    Observations are appended to a SQLite database in WAL mode as soon as they
+    are recorded, so they survive browser reloads, worker restarts and long
+    offline periods. Each append is a single-row insert that does not rewrite
+    anything already stored. Syncing marks records as acknowledged, and
+    compact() later drops the acknowledged records from disk.
+
+    Several worker processes may share one database. Before pushing records,
+    a worker claims them; a claim is taken atomically under SQLite's write
+    lock, so two workers never push the same record. Claims expire after a
+    lease, so records claimed by a worker that died are synced by another.
+
+    Each observation belongs to the device, i.e. the browser, that recorded
+    it. pending(), claim() and discard() given a device only touch that
+    device's observations, so a surveyor who reloads gets back their own
+    unsynced observations and can neither clear nor sync anybody else's.
+    Observations of no device, such as imported ones, are taken over by the
+    first browser that asks for them, or synced by a worker from unowned().
+
+    Args:
+        path (str): Path of the SQLite database.
+    """
+
+    def __init__(self, path="observations.sqlite3"):
+        self._lock = threading.Lock()
+        # identifies this queue's claims among all the workers sharing the file
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+        # wait for other workers' writes instead of failing with "database is locked"
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # with WAL, NORMAL only risks the last commits on power loss, never corruption
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS observations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fields TEXT NOT NULL,
+                recorded_at REAL NOT NULL,
+                acked_at REAL,
+                claimed_by TEXT,
+                claimed_until REAL,
+                device TEXT,
+                upload_until REAL
+            )
+            """
+        )
+        # queues created before claims, devices or upload leases lack their columns
+        columns = {
+            row[1] for row in self._db.execute("PRAGMA table_info(observations)")
+        }
+        for column, kind in (
+            ("claimed_by", "TEXT"),
+            ("claimed_until", "REAL"),
+            ("device", "TEXT"),
+            ("upload_until", "REAL"),
+        ):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE observations ADD COLUMN {column} {kind}")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS observations_pending"
+            " ON observations (id) WHERE acked_at IS NULL"
+        )
+        self._db.commit()
+
+    def append(self, fields, device=None, uploading=False):
+        """
+        Stores a new observation.
+
+        Args:
+            fields (dict): The observation fields. They must be JSON serializable.
+            device (str): The device that recorded it.
+            uploading (bool): Whether its image is being uploaded. The upload
+                holds a lease, which renew_upload() extends while it runs.
+
+        Returns:
+            int: The ID of the observation in the queue.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO observations (fields, recorded_at, device, upload_until)"
+                " VALUES (?, ?, ?, ?)",
+                (
+                    json.dumps(fields),
+                    now,
+                    device,
+                    now + UPLOAD_LEASE if uploading else None,
+                ),
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def extend(self, records):
+        """
+        Stores many observations in one transaction, as for a bulk import.
+        They belong to no device until one takes them over in pending().
+
+        Args:
+            records (iterable): The fields of each observation.
+
+        Returns:
+            int: The number of observations stored.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._db.executemany(
+                "INSERT INTO observations (fields, recorded_at) VALUES (?, ?)",
+                ((json.dumps(fields), now) for fields in records),
+            )
+            self._db.commit()
+            return cursor.rowcount
+
+    def update(self, obs_id, fields):
+        """
+        Replaces the fields of an observation that has not been synced yet.
+        """
+        with self._lock:
+            self._db.execute(
+                "UPDATE observations SET fields = ? WHERE id = ?",
+                (json.dumps(fields), int(obs_id)),
+            )
+            self._db.commit()
+
+    def renew_upload(self, obs_id, lease=UPLOAD_LEASE):
+        """
+        Extends the lease on the image upload of an observation.
+        """
+        with self._lock:
+            self._db.execute(
+                "UPDATE observations SET upload_until = ? WHERE id = ?",
+                (time.time() + lease, int(obs_id)),
+            )
+            self._db.commit()
+
+    def live_uploads(self, ids):
+        """
+        Returns which of the given observations have an image upload whose
+        lease has not run out, i.e. one that a running worker is still doing.
+        """
+        ids = [int(obs_id) for obs_id in ids]
+        now = time.time()
+        live = set()
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                batch = ids[start : start + 500]
+                marks = ", ".join("?" * len(batch))
+                live.update(
+                    obs_id
+                    for (obs_id,) in self._db.execute(
+                        f"SELECT id FROM observations WHERE id IN ({marks})"
+                        " AND upload_until >= ?",
+                        (*batch, now),
+                    )
+                )
+        return live
+
+    def pending(self, device=None, adopt=True):
+        """
+        Returns the observations that have not been acknowledged yet.
+
+        Args:
+            device (str): Only return the observations of this device.
+            adopt (bool): Whether the device first takes over the pending
+                observations of no device, such as imported ones or ones
+                queued before devices were recorded. Only a device that will
+                come back, such as one with a persistent cookie, should.
+
+        Returns:
+            list: (id, fields) pairs in the order they were recorded.
+        """
+        with self._lock:
+            if device is None:
+                rows = self._db.execute(
+                    "SELECT id, fields FROM observations WHERE acked_at IS NULL"
+                    " ORDER BY id"
+                ).fetchall()
+            else:
+                if adopt:
+                    self._db.execute(
+                        "UPDATE observations SET device = ?"
+                        " WHERE device IS NULL AND acked_at IS NULL",
+                        (device,),
+                    )
+                    self._db.commit()
+                rows = self._db.execute(
+                    "SELECT id, fields FROM observations"
+                    " WHERE acked_at IS NULL AND device = ? ORDER BY id",
+                    (device,),
+                ).fetchall()
+        return [(obs_id, json.loads(fields)) for obs_id, fields in rows]
+
+    def unowned(self):
+        """
+        Returns the pending observations of no device.
+
+        Returns:
+            list: (id, fields) pairs in the order they were recorded.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, fields FROM observations"
+                " WHERE acked_at IS NULL AND device IS NULL ORDER BY id"
+            ).fetchall()
+        return [(obs_id, json.loads(fields)) for obs_id, fields in rows]
+
+    def disown(self, device):
+        """
+        Gives up the pending observations of a device that will not come back,
+        so that another device or a worker syncs them.
+        """
+        with self._lock:
+            self._db.execute(
+                "UPDATE observations SET device = NULL"
+                " WHERE device = ? AND acked_at IS NULL",
+                (device,),
+            )
+            self._db.commit()
+
+    def iter_pending(self, batch_size=1000):
+        """
+        Yields the observations that have not been acknowledged yet, reading
+        batch_size of them at a time so that a large queue is never loaded
+        whole.
+
+        Yields:
+            tuple: (id, fields) pairs in the order they were recorded.
+        """
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT id, fields FROM observations"
+                    " WHERE acked_at IS NULL AND id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size),
+                ).fetchall()
+            for obs_id, fields in rows:
+                yield obs_id, json.loads(fields)
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def pending_count(self):
+        with self._lock:
+            (count,) = self._db.execute(
+                "SELECT COUNT(*) FROM observations WHERE acked_at IS NULL"
+            ).fetchone()
+        return count
+
+    def claim(self, ids, lease=CLAIM_LEASE, device=None):
+        """
+        Claims pending observations for syncing by this worker.
+
+        Observations that were already synced, discarded or claimed by another
+        worker whose lease has not run out are left alone, and so are those of
+        another device when a device is given.
+
+        Args:
+            ids (list): The IDs of the observations to claim.
+            lease (float): Seconds until the claim expires.
+            device (str): Only claim the observations of this device.
+
+        Returns:
+            list: The IDs that were claimed, in the order given.
+        """
+        ids = [int(obs_id) for obs_id in ids]
+        now = time.time()
+        claimed = set()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock, so no other worker can
+            # claim the same rows between the UPDATE and the SELECT
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for start in range(0, len(ids), 500):
+                    batch = ids[start : start + 500]
+                    marks = ", ".join("?" * len(batch))
+                    self._db.execute(
+                        "UPDATE observations SET claimed_by = ?, claimed_until = ?"
+                        f" WHERE id IN ({marks}) AND acked_at IS NULL"
+                        " AND (claimed_until IS NULL OR claimed_until < ?"
+                        " OR claimed_by = ?) AND (? IS NULL OR device = ?)",
+                        (self.owner, now + lease, *batch, now, self.owner)
+                        + (device, device),
+                    )
+                    claimed.update(
+                        obs_id
+                        for (obs_id,) in self._db.execute(
+                            f"SELECT id FROM observations WHERE id IN ({marks})"
+                            " AND claimed_by = ? AND acked_at IS NULL",
+                            (*batch, self.owner),
+                        )
+                    )
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+        return [obs_id for obs_id in ids if obs_id in claimed]
+
+    def release(self, ids):
+        """
+        Gives up this worker's claims, e.g. on observations that failed to sync.
+        """
+        with self._lock:
+            self._db.executemany(
+                "UPDATE observations SET claimed_by = NULL, claimed_until = NULL"
+                " WHERE id = ? AND claimed_by = ?",
+                [(int(obs_id), self.owner) for obs_id in ids],
+            )
+            self._db.commit()
+
+    def pending_ids(self, ids):
+        """
+        Returns which of the given observations have not been synced or
+        discarded yet, by any worker.
+        """
+        ids = [int(obs_id) for obs_id in ids]
+        pending = set()
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                batch = ids[start : start + 500]
+                marks = ", ".join("?" * len(batch))
+                pending.update(
+                    obs_id
+                    for (obs_id,) in self._db.execute(
+                        f"SELECT id FROM observations WHERE id IN ({marks})"
+                        " AND acked_at IS NULL",
+                        batch,
+                    )
+                )
+        return pending
+
+    def pending_fields(self, ids):
+        """
+        Returns the current fields of those of the given observations that
+        have not been synced or discarded yet, by any worker.
+
+        Returns:
+            dict: The fields by observation ID.
+        """
+        ids = [int(obs_id) for obs_id in ids]
+        pending = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                batch = ids[start : start + 500]
+                marks = ", ".join("?" * len(batch))
+                pending.update(
+                    (obs_id, json.loads(fields))
+                    for obs_id, fields in self._db.execute(
+                        f"SELECT id, fields FROM observations WHERE id IN ({marks})"
+                        " AND acked_at IS NULL",
+                        batch,
+                    )
+                )
+        return pending
+
+    def acknowledge(self, ids):
+        """
+        Marks observations as synced.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "UPDATE observations SET acked_at = ?, claimed_by = NULL,"
+                " claimed_until = NULL WHERE id = ?",
+                [(now, int(obs_id)) for obs_id in ids],
+            )
+            self._db.commit()
+
+    def discard(self, ids, device=None):
+        """
+        Removes observations that should never be synced, such as ones the
+        surveyor cleared.
+
+        Args:
+            ids (list): The IDs of the observations.
+            device (str): Only remove the observations of this device.
+
+        Returns:
+            list: The IDs that were removed.
+        """
+        removed = []
+        with self._lock:
+            for obs_id in ids:
+                cursor = self._db.execute(
+                    "DELETE FROM observations WHERE id = ?"
+                    " AND (? IS NULL OR device = ?)",
+                    (int(obs_id), device, device),
+                )
+                if cursor.rowcount:
+                    removed.append(obs_id)
+            self._db.commit()
+        return removed
+
+    def compact(self, older_than=0):
+        """
+        Deletes acknowledged observations and shrinks the write-ahead log.
+
+        Args:
+            older_than (float): Only delete observations acknowledged at least
+                this many seconds ago.
+
+        Returns:
+            int: The number of observations deleted.
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM observations WHERE acked_at IS NOT NULL AND acked_at <= ?",
+                (time.time() - older_than,),
+            )
+            self._db.commit()
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            return cursor.rowcount
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,170 @@
+"""
+Resolves iNaturalist photos for every species in the catalog ahead of time.
+
+Run from the repository root, usually after editing data.csv or before a deploy:
+
+    python -m app_files.prefetch --data data.csv --output species_images.json
+
+The output is a sidecar file that app.py loads into the species image cache at
+startup, so specimen cards do not wait on iNaturalist the first time they are
+opened.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from app_files.airtable_utils import (
+    INATURALIST_API_URL,
+    SpeciesPhotos,
+    fetch_species_photos,
+)
+from app_files.catalog import TaxonomyCatalog
+
+# bump when the layout of the sidecar file changes
+SIDECAR_VERSION = 1
+DEFAULT_SIDECAR_PATH = "species_images.json"
+# age, in seconds, after which a sidecar is reported as stale; its photos are
+# still loaded
+SIDECAR_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def species_to_prefetch(catalog):
+    """
+    Returns the distinct (genus, species) pairs of a catalog, skipping the
+    ones whose genus or species is "Unknown".
+    """
+    pairs = set()
+    for name in catalog.common_names():
+        record = catalog[name]
+        if record.genus != "Unknown" and record.species != "Unknown":
+            pairs.add((record.genus, record.species))
+    return sorted(pairs)
+
+
+def prefetch_species_photos(pairs, max_workers=8, api_url=INATURALIST_API_URL):
+    """
+    Fetches the photos of many species with bounded concurrency.
+
+    Args:
+        pairs (list): (genus, species) pairs to look up.
+        max_workers (int): Maximum number of requests in flight at once.
+        api_url (str): The base URL of the iNaturalist API.
+
+    Returns:
+        tuple: A dict mapping each fetched pair to its SpeciesPhotos, and a
+        list of the pairs whose fetch failed.
+    """
+
+    def fetch(pair):
+        try:
+            return fetch_species_photos(*pair, api_url=api_url)
+        except Exception as e:
+            print(f"Failed to fetch {pair[0]} {pair[1]}: {e}")
+            return None
+
+    fetched = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for pair, photos in zip(pairs, executor.map(fetch, pairs)):
+            if photos is None:
+                failed.append(pair)
+            else:
+                fetched[pair] = photos
+    return fetched, failed
+
+
+def write_sidecar(path, fetched):
+    """
+    Atomically writes fetched species photos to a sidecar file.
+    """
+    sidecar = {
+        "version": SIDECAR_VERSION,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "species": [
+            {
+                "genus": genus,
+                "species": species,
+                "taxon_id": photos.taxon_id,
+                "photo_urls": photos.photo_urls,
+            }
+            for (genus, species), photos in sorted(fetched.items())
+        ],
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(sidecar, file, indent=1)
+    os.replace(tmp_path, path)
+
+
+def load_sidecar(path, max_age=SIDECAR_MAX_AGE):
+    """
+    Reads a sidecar file written by write_sidecar, and warns when it is older
+    than max_age seconds.
+
+    Args:
+        path (str): Path of the sidecar file.
+        max_age (float): Age after which the sidecar should be regenerated.
+
+    Returns:
+        tuple: A dict mapping (genus, species) to SpeciesPhotos, and the time
+        the file was generated as a Unix timestamp. The dict is empty when the
+        file does not exist or was written by another sidecar version.
+    """
+    if not os.path.exists(path):
+        return {}, None
+    with open(path, encoding="utf-8") as file:
+        sidecar = json.load(file)
+    if sidecar.get("version") != SIDECAR_VERSION:
+        print(f"Ignoring {path}: unsupported sidecar version {sidecar.get('version')}")
+        return {}, None
+    generated_at = datetime.fromisoformat(sidecar["generated_at"]).timestamp()
+    age = time.time() - generated_at
+    if age > max_age:
+        print(
+            f"{path} was generated {age / 86400:.0f} days ago; run "
+            "python -m app_files.prefetch to refresh the species photos"
+        )
+    entries = {
+        (entry["genus"], entry["species"]): SpeciesPhotos(
+            entry["taxon_id"], entry["photo_urls"]
+        )
+        for entry in sidecar["species"]
+    }
+    return entries, generated_at
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Prefetch iNaturalist photo URLs for every species in the catalog."
+    )
+    parser.add_argument("--data", default="data.csv", help="species catalog CSV")
+    parser.add_argument(
+        "--output", default=DEFAULT_SIDECAR_PATH, help="sidecar file to write"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=8, help="maximum concurrent requests"
+    )
+    parser.add_argument(
+        "--api-url", default=INATURALIST_API_URL, help="iNaturalist API base URL"
+    )
+    args = parser.parse_args(argv)
+
+    catalog = TaxonomyCatalog.from_csv(args.data)
+    pairs = species_to_prefetch(catalog)
+    start = time.perf_counter()
+    fetched, failed = prefetch_species_photos(pairs, args.workers, args.api_url)
+    write_sidecar(args.output, fetched)
+    print(
+        f"Prefetched {len(fetched)} of {len(pairs)} species into {args.output}"
+        f" in {time.perf_counter() - start:.1f}s"
+    )
+    if failed:
+        print("Failed: " + ", ".join(f"{genus} {species}" for genus, species in failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,169 @@
+"""
+Helpers for the reactive graph of the server function: inputs that settle
+before anything expensive depends on them, and a trace of what each user
+action recomputes.
+
+The trace is off unless ARTHROPOD_TRACE_REACTIVE=1 is set. When it is on,
+each session counts the runs of its instrumented effects, outputs and tasks,
+and after every flush sends the counts, with the outbound HTTP requests of
+the worker since the previous flush, as a "reactive_trace" custom message.
+benchmarks/bench_scenarios.py --scenarios trace collects these messages for a
+browse-and-submit cycle.
+"""
+import asyncio
+import functools
+import os
+import time
+
+from shiny import reactive
+
+from app_files.http_client import http_client
+
+# custom message type of the trace, sent after each flush of a session
+TRACE_MESSAGE_TYPE = "reactive_trace"
+# seconds the specimen picker must stay on a species before its photos are
+# looked up
+SETTLE_SECONDS = 0.3
+
+
+def debounce(read, delay=SETTLE_SECONDS):
+    """
+    Follows a reactive value once it has stopped changing.
+
+    A change that comes after `delay` quiet seconds is taken at once; one
+    that follows another change sooner only once `delay` seconds pass without
+    a further change. So a single pick is acted on right away, while
+    scrolling through choices only acts on the first one and the one the user
+    stops at. Call it inside the server function.
+
+    Args:
+        read (callable): Reads the reactive value, such as input.specimen.
+        delay (float): Seconds the value must stay the same.
+
+    Returns:
+        callable: Reads the settled value, and takes a dependency on it.
+    """
+    # (change, value): numbered, so that returning to the value that settled
+    # last still counts as a change
+    settled = reactive.Value((0, None))
+    # only the latest change may settle; earlier timers wake up and do nothing
+    latest = {"change": 0, "at": float("-inf")}
+    # asyncio only keeps weak references to tasks, so the timers are kept here
+    timers = set()
+
+    async def _settle(value, change):
+        await asyncio.sleep(delay)
+        async with reactive.lock():
+            if latest["change"] == change:
+                settled.set((change, value))
+                await reactive.flush()
+
+    @reactive.Effect
+    def _follow():
+        value = read()
+        now = time.monotonic()
+        quiet = now - latest["at"] >= delay
+        latest["change"] += 1
+        latest["at"] = now
+        if quiet:
+            settled.set((latest["change"], value))
+        else:
+            timer = asyncio.create_task(_settle(value, latest["change"]))
+            timers.add(timer)
+            timer.add_done_callback(timers.discard)
+
+    return lambda: settled.get()[1]
+
+
+def _http_requests():
+    return {
+        endpoint: stats["count"] for endpoint, stats in http_client.stats().items()
+    }
+
+
+class ReactiveTrace:
+    """
+    Counts the runs of a session's reactive effects, outputs and background
+    tasks between flushes.
+
+    Args:
+        enabled (bool): Whether anything is counted.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counts = {}
+        self._requests = _http_requests() if enabled else {}
+
+    def counted(self, name):
+        """
+        Decorator counting each call of a function or coroutine function
+        under the given name. With the trace off, the function is returned as
+        is.
+        """
+
+        def decorate(fn):
+            if not self.enabled:
+                return fn
+            if asyncio.iscoroutinefunction(fn):
+
+                @functools.wraps(fn)
+                async def counted_coroutine(*args, **kwargs):
+                    self.count(name)
+                    return await fn(*args, **kwargs)
+
+                return counted_coroutine
+
+            @functools.wraps(fn)
+            def counted_function(*args, **kwargs):
+                self.count(name)
+                return fn(*args, **kwargs)
+
+            return counted_function
+
+        return decorate
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def take(self):
+        """
+        Returns what ran since the last call, and starts counting again.
+
+        Returns:
+            dict: The runs by name under "runs", and the HTTP requests of the
+            whole worker by endpoint under "http"; None if nothing ran.
+        """
+        requests = _http_requests()
+        http = {
+            endpoint: count - self._requests.get(endpoint, 0)
+            for endpoint, count in requests.items()
+            if count != self._requests.get(endpoint, 0)
+        }
+        runs, self.counts, self._requests = self.counts, {}, requests
+        if not runs and not http:
+            return None
+        return {"runs": runs, "http": http}
+
+    def attach(self, session):
+        """
+        Sends the session what ran after each of its flushes.
+        """
+        if not self.enabled:
+            return
+
+        async def _report():
+            message = self.take()
+            if message is not None:
+                await session.send_custom_message(TRACE_MESSAGE_TYPE, message)
+
+        session.on_flushed(_report, once=False)
+
+
+def session_trace():
+    """
+    Returns a ReactiveTrace for a new session, on when
+    ARTHROPOD_TRACE_REACTIVE=1 is set.
+    """
+    return ReactiveTrace(enabled=os.environ.get("ARTHROPOD_TRACE_REACTIVE") == "1")
@@ -0,0 +1,91 @@
+import re
+from collections import Counter
+
+# searchable fields of a SpeciesRecord and how much a match in each one counts
+SEARCH_FIELDS = (
+    ("common_name", 1.0),
+    ("genus", 0.8),
+    ("species", 0.8),
+    ("family", 0.6),
+    ("order", 0.5),
+)
+# share of the query's trigrams a field must contain to count as a match
+MIN_SIMILARITY = 0.4
+
+
+def trigrams(text):
+    """
+    Returns the set of trigrams of the words in a text, ignoring case. Words
+    are padded so that their beginnings weigh more than their ends.
+    """
+    grams = set()
+    for word in re.findall(r"\w+", text.casefold()):
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class SpeciesSearchIndex:
+    """
+    Typo-tolerant search over the species catalog.
+
+    Common Name, Genus, Species, Family and Order are split into word
+    trigrams, and each trigram points to the fields containing it. A query
+    matches the fields that share enough of its trigrams, so misspellings such
+    as "argentin aunt" still find "Argentine Ant". Results are ranked by how
+    much of the query they contain, weighted by field, with a bonus when the
+    Common Name contains the query as typed.
+
+    Args:
+        catalog (TaxonomyCatalog): The species catalog.
+    """
+
+    def __init__(self, catalog):
+        self._names = catalog.common_names()
+        self._folded_names = [name.casefold() for name in self._names]
+        self._postings = {}
+        for doc, name in enumerate(self._names):
+            record = catalog[name]
+            for field, (attribute, _) in enumerate(SEARCH_FIELDS):
+                for gram in trigrams(getattr(record, attribute)):
+                    self._postings.setdefault(gram, []).append((doc, field))
+
+    def search(self, query, limit=50):
+        """
+        Finds the species best matching a query.
+
+        Args:
+            query (str): What the surveyor typed.
+            limit (int): The maximum number of results.
+
+        Returns:
+            list: (Common Name, score) pairs, best match first. An empty query
+            returns the first species in alphabetical order.
+        """
+        query_grams = trigrams(query)
+        if not query_grams:
+            return [(name, 0.0) for name in self._names[:limit]]
+
+        hits = Counter()
+        for gram in query_grams:
+            hits.update(self._postings.get(gram, ()))
+
+        scores = {}
+        for (doc, field), count in hits.items():
+            similarity = count / len(query_grams)
+            if similarity < MIN_SIMILARITY:
+                continue
+            score = similarity * SEARCH_FIELDS[field][1]
+            if score > scores.get(doc, 0.0):
+                scores[doc] = score
+
+        folded_query = query.strip().casefold()
+        for doc in scores:
+            position = self._folded_names[doc].find(folded_query)
+            if position == 0:
+                scores[doc] += 1.0
+            elif position > 0:
+                scores[doc] += 0.5
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self._names[item[0]]))
+        return [(self._names[doc], score) for doc, score in ranked[:limit]]
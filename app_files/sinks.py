@@ -0,0 +1,301 @@
+"""
+Targets the synced observations are sent to.
+
+A sink takes batches of observation fields. Each sink declares the largest
+batch it accepts and how many batches may be in flight at once, and
+sync_records() sends with these limits. Airtable takes 10 records per
+request at 5 requests per second, and a free base holds 1,000 records; the
+SQLite, DuckDB and bulk HTTP sinks take thousands of records per batch.
+
+The app's sink is set with ARTHROPOD_SINK:
+
+    airtable        the Airtable observation table (the default)
+    sqlite:PATH     a table in a local SQLite database
+    duckdb:PATH     a table in a local DuckDB database (needs duckdb)
+    jsonl:URL       POST requests of JSON Lines to a bulk ingestion endpoint
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from app_files.airtable_utils import get_airtable_data, get_headers, get_url
+from app_files.sync import (
+    AIRTABLE_BATCH_SIZE,
+    AIRTABLE_REQUESTS_PER_SECOND,
+    TokenBucket,
+    post_batch,
+    post_with_retries,
+)
+
+
+class ObservationSink:
+    """
+    Base class of the sinks. Subclasses implement send_batch().
+
+    Attributes:
+        name (str): Shown in messages about the sync.
+        batch_size (int): The most records send_batch() accepts at once.
+        max_workers (int): How many batches may be sent at the same time.
+    """
+
+    name = "sink"
+    batch_size = 1
+    max_workers = 1
+
+    def send_batch(self, fields):
+        """
+        Stores one batch of observations.
+
+        Args:
+            fields (list): The fields of each observation, at most
+                batch_size of them.
+
+        Returns:
+            str: None when every observation was stored, otherwise an error
+            message. Either all of the batch is stored or none of it.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class AirtableSink(ObservationSink):
+    """
+    Creates records in an Airtable table, 10 per request, within the rate
+    limit of the base.
+
+    Args:
+        url (str): The table URL.
+        headers (dict): The request headers.
+        table (str): The table name.
+        requests_per_second (float): Maximum request rate across all syncs.
+        max_workers (int): Maximum number of requests in flight at once.
+        max_retries (int): How many times to retry each batch.
+    """
+
+    name = "Airtable"
+    batch_size = AIRTABLE_BATCH_SIZE
+
+    def __init__(
+        self,
+        url,
+        headers,
+        table=None,
+        requests_per_second=AIRTABLE_REQUESTS_PER_SECOND,
+        max_workers=AIRTABLE_REQUESTS_PER_SECOND,
+        max_retries=5,
+    ):
+        self.url = url
+        self.headers = headers
+        self.table = table
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(requests_per_second, capacity=1)
+
+    @classmethod
+    def from_config(cls):
+        """
+        Builds the sink of the observation table set in the environment.
+        """
+        airtable = get_airtable_data()
+        table = airtable["observation_table_name"]
+        return cls(
+            get_url(airtable["base_id"], table),
+            get_headers(airtable["api_key"]),
+            table,
+        )
+
+    def send_batch(self, fields):
+        return post_batch(
+            self.url, self.headers, fields, self._bucket, self.max_retries
+        )
+
+
+class SQLiteSink(ObservationSink):
+    """
+    Appends observations to a table of a local SQLite database, one
+    transaction per batch. Each row holds the fields as JSON, which SQLite's
+    JSON functions can query.
+
+    Args:
+        path (str): Path of the SQLite database.
+        table (str): The table name.
+        batch_size (int): Observations per transaction.
+    """
+
+    name = "SQLite"
+
+    def __init__(
+        self, path="synced_observations.sqlite3", table="observations", batch_size=5000
+    ):
+        self.table = table
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fields TEXT NOT NULL,
+                synced_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.commit()
+
+    def send_batch(self, fields):
+        now = time.time()
+        rows = [(json.dumps(record), now) for record in fields]
+        with self._lock:
+            try:
+                with self._db:
+                    self._db.executemany(
+                        f"INSERT INTO {self.table} (fields, synced_at) VALUES (?, ?)",
+                        rows,
+                    )
+            except sqlite3.Error as e:
+                return str(e)
+        return None
+
+    def count(self):
+        with self._lock:
+            query = f"SELECT COUNT(*) FROM {self.table}"
+            (count,) = self._db.execute(query).fetchone()
+        return count
+
+    def close(self):
+        self._db.close()
+
+
+def _duckdb():
+    # duckdb is optional and only needed for the DuckDB sink
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ValueError("The DuckDB sink needs the duckdb package") from e
+    return duckdb
+
+
+class DuckDBSink(ObservationSink):
+    """
+    Appends observations to a table of a local DuckDB database, one
+    transaction per batch, with the fields as JSON. A DuckDB file can only be
+    open in one process at a time, so the database is opened for each batch
+    and closed again, which lets several workers take turns.
+
+    Args:
+        path (str): Path of the DuckDB database.
+        table (str): The table name.
+        batch_size (int): Observations per transaction.
+    """
+
+    name = "DuckDB"
+
+    def __init__(
+        self, path="synced_observations.duckdb", table="observations", batch_size=10000
+    ):
+        self._duckdb = _duckdb()
+        self.path = path
+        self.table = table
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        with self._lock, self._duckdb.connect(path) as db:
+            db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (fields JSON, synced_at DOUBLE)"
+            )
+
+    def send_batch(self, fields):
+        now = time.time()
+        rows = [(json.dumps(record), now) for record in fields]
+        with self._lock:
+            try:
+                with self._duckdb.connect(self.path) as db:
+                    db.execute("BEGIN TRANSACTION")
+                    db.executemany(f"INSERT INTO {self.table} VALUES (?, ?)", rows)
+                    db.execute("COMMIT")
+            except self._duckdb.Error as e:
+                return str(e)
+        return None
+
+    def count(self):
+        with self._lock, self._duckdb.connect(self.path) as db:
+            (count,) = db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        return count
+
+
+class JsonlSink(ObservationSink):
+    """
+    Sends observations to a bulk ingestion endpoint, one POST request of JSON
+    Lines (one observation per line) per batch. Any 2xx response means the
+    whole batch was stored.
+
+    Args:
+        url (str): The endpoint.
+        headers (dict): Extra request headers, e.g. for authentication.
+        batch_size (int): Observations per request.
+        max_workers (int): Maximum number of requests in flight at once.
+        requests_per_second (float): Maximum request rate, or None.
+        max_retries (int): How many times to retry each batch.
+    """
+
+    name = "the ingestion endpoint"
+
+    def __init__(
+        self,
+        url,
+        headers=None,
+        batch_size=1000,
+        max_workers=4,
+        requests_per_second=None,
+        max_retries=5,
+    ):
+        self.url = url
+        self.headers = {**(headers or {}), "Content-Type": "application/x-ndjson"}
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self._bucket = (
+            TokenBucket(requests_per_second) if requests_per_second else None
+        )
+
+    def send_batch(self, fields):
+        body = "".join(
+            json.dumps(record, ensure_ascii=False) + "\n" for record in fields
+        )
+        return post_with_retries(
+            self.url,
+            "jsonl ingest",
+            self._bucket,
+            lambda response: None,
+            self.max_retries,
+            data=body.encode("utf-8"),
+            headers=self.headers,
+        )
+
+
+def open_sink(spec="airtable"):
+    """
+    Builds a sink from its description, as in ARTHROPOD_SINK.
+
+    Args:
+        spec (str): "airtable", "sqlite:PATH", "duckdb:PATH" or "jsonl:URL".
+
+    Returns:
+        ObservationSink: The sink.
+
+    Raises:
+        ValueError: If the description is not one of these.
+    """
+    kind, _, target = spec.partition(":")
+    if kind == "airtable" and not target:
+        return AirtableSink.from_config()
+    if kind == "sqlite" and target:
+        return SQLiteSink(target)
+    if kind == "duckdb" and target:
+        return DuckDBSink(target)
+    if kind == "jsonl" and target:
+        return JsonlSink(target)
+    raise ValueError(f"Unknown observation sink: {spec}")
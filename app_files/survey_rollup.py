@@ -0,0 +1,270 @@
+"""
+Survey summaries kept up to date as observations are recorded and synced.
+
+Every observation adds its count to one row of each rollup table, keyed by
+day (or month), location, plot, survey point, side and species, with the
+species' Order and Family from the catalog. Clearing an observation
+subtracts it again, and syncing it moves it from the "not synced yet" rows
+to the synced ones. The summaries of the Survey summary tab group and filter
+these tables, which hold at most one row per species and survey spot a day
+(or a month), instead of aggregating the raw observations each time they are
+drawn.
+
+The rollup is shared by all worker processes, like the observation queue.
+It can be rebuilt from the Airtable mirror and the queue, for instance to
+include years of observations synced before it existed.
+
+Usage:
+
+    python -m app_files.airtable_mirror pull
+    python -m app_files.survey_rollup rebuild
+"""
+import argparse
+import sqlite3
+import threading
+
+# columns of the rollup that identify a survey spot, by observation field
+DIMENSIONS = {
+    "Location": "location",
+    "Plot": "plot",
+    "Survey Point": "survey_point",
+    "Side": "side",
+}
+# columns of the rollup that name the taxon at each rank
+TAXA = {
+    "Species": "common_name",
+    "Order": "order_name",
+    "Family": "family",
+}
+# rollup tables, by the function giving the date of the row counting a day:
+# "daily" rows are keyed by the day, "monthly" ones by the first of the month
+ROLLUPS = {"daily": lambda day: day, "monthly": lambda day: day[:7] + "-01"}
+# rollup table read for each period, and SQLite expression of the first day of
+# the period holding `day`
+PERIODS = {
+    "Day": ("daily", "day"),
+    "Week": ("daily", "date(day, '-6 days', 'weekday 1')"),
+    "Month": ("monthly", "day"),
+    "Year": ("monthly", "substr(day, 1, 4) || '-01-01'"),
+}
+
+
+class SurveyRollup:
+    """
+    Counts of observations and individuals by day, survey spot and species.
+
+    Args:
+        path (str): Path of the SQLite database.
+        catalog (TaxonomyCatalog): Gives the Order and Family of each species.
+    """
+
+    def __init__(self, path="survey_rollup.sqlite3", catalog=None):
+        self.catalog = catalog
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for table in ROLLUPS:
+            self._db.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    day TEXT NOT NULL,
+                    location TEXT NOT NULL,
+                    plot TEXT NOT NULL,
+                    survey_point TEXT NOT NULL,
+                    side TEXT NOT NULL,
+                    common_name TEXT NOT NULL,
+                    order_name TEXT NOT NULL,
+                    family TEXT NOT NULL,
+                    synced INTEGER NOT NULL,
+                    observations INTEGER NOT NULL,
+                    individuals INTEGER NOT NULL,
+                    PRIMARY KEY (
+                        day, location, plot, survey_point, side, common_name, synced
+                    )
+                ) WITHOUT ROWID
+                """
+            )
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS revision (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO revision (id, value) VALUES (0, 0);
+            """
+        )
+        self._db.commit()
+
+    def revision(self):
+        """
+        Returns a number that changes whenever any worker changes the rollup.
+        """
+        with self._lock:
+            (value,) = self._db.execute(
+                "SELECT value FROM revision WHERE id = 0"
+            ).fetchone()
+        return value
+
+    def add(self, observations, synced=False):
+        """
+        Counts observations, such as one that was just recorded.
+
+        Args:
+            observations (list): The fields of each observation.
+            synced (bool): Whether they are already in Airtable.
+        """
+        self._apply([(observations, synced, 1)])
+
+    def remove(self, observations, synced=False):
+        """
+        Stops counting observations, such as ones the surveyor cleared.
+        """
+        self._apply([(observations, synced, -1)])
+
+    def mark_synced(self, observations):
+        """
+        Moves observations that were just synced to the synced counts.
+        """
+        self._apply([(observations, False, -1), (observations, True, 1)])
+
+    def rebuild(self, synced, pending):
+        """
+        Replaces the whole rollup.
+
+        Args:
+            synced (iterable): The fields of the observations in Airtable.
+            pending (iterable): The fields of the observations not synced yet.
+        """
+        self._apply([(synced, True, 1), (pending, False, 1)], replace=True)
+
+    def summary(
+        self,
+        taxon="Species",
+        dimension="Location",
+        period="Month",
+        filters=None,
+        include_pending=True,
+    ):
+        """
+        Adds up the rollup by period, survey spot and taxon.
+
+        Args:
+            taxon (str): A key of TAXA, the rank to count by.
+            dimension (str): A key of DIMENSIONS, the survey spot to count per.
+            period (str): A key of PERIODS.
+            filters (dict): Values to keep, by key of DIMENSIONS; None or an
+                empty value keeps them all.
+            include_pending (bool): Also count the observations not synced yet.
+
+        Returns:
+            list: (period start, spot, taxon, observations, individuals)
+            tuples, ordered by period.
+        """
+        where, params = [], []
+        for name, value in (filters or {}).items():
+            if value:
+                where.append(f"{DIMENSIONS[name]} = ?")
+                params.append(value)
+        if not include_pending:
+            where.append("synced = 1")
+        spot, rank = DIMENSIONS[dimension], TAXA[taxon]
+        table, start = PERIODS[period]
+        query = (
+            f"SELECT {start} AS period, {spot}, {rank},"
+            f" SUM(observations), SUM(individuals) FROM {table}"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + f" GROUP BY period, {spot}, {rank} ORDER BY period, {spot}, {rank}"
+        )
+        with self._lock:
+            return self._db.execute(query, params).fetchall()
+
+    def close(self):
+        self._db.close()
+
+    def _key(self, fields):
+        name = str(fields.get("Common Name") or "")
+        record = self.catalog.lookup(name) if self.catalog is not None else None
+        return (
+            str(fields.get("Date observed") or "")[:10],
+            *(str(fields.get(field) or "") for field in DIMENSIONS),
+            record.common_name if record else name,
+            record.order if record else str(fields.get("Order") or ""),
+            record.family if record else str(fields.get("Family") or ""),
+        )
+
+    def _apply(self, changes, replace=False):
+        # (observations, synced, sign) changes, applied in one transaction
+        totals = {}
+        for observations, synced, sign in changes:
+            for fields in observations:
+                key = self._key(fields) + (int(synced),)
+                count, individuals = totals.get(key, (0, 0))
+                totals[key] = (
+                    count + sign,
+                    individuals + sign * int(fields.get("Count") or 0),
+                )
+        rows = [key + delta for key, delta in totals.items() if delta != (0, 0)]
+        if not rows and not replace:
+            return
+        with self._lock:
+            for table, start in ROLLUPS.items():
+                if replace:
+                    self._db.execute(f"DELETE FROM {table}")
+                keyed = [(start(row[0]),) + row[1:] for row in rows]
+                self._db.executemany(
+                    f"INSERT INTO {table} (day, location, plot, survey_point, side,"
+                    " common_name, order_name, family, synced, observations,"
+                    " individuals) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT DO UPDATE SET"
+                    " observations = observations + excluded.observations,"
+                    " individuals = individuals + excluded.individuals",
+                    keyed,
+                )
+                # drop the rows whose last observation was removed, by their key
+                self._db.executemany(
+                    f"DELETE FROM {table} WHERE day = ? AND location = ? AND plot = ?"
+                    " AND survey_point = ? AND side = ? AND common_name = ?"
+                    " AND synced = ? AND observations <= 0",
+                    [row[:6] + row[8:9] for row in keyed if row[9] < 0],
+                )
+            self._db.execute("UPDATE revision SET value = value + 1 WHERE id = 0")
+            self._db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rebuild the survey summary rollup from Airtable and the queue."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild = commands.add_parser(
+        "rebuild", help="recount the mirrored Airtable table and the local queue"
+    )
+    rebuild.add_argument("--rollup", default="survey_rollup.sqlite3")
+    rebuild.add_argument("--mirror", default="airtable_mirror.sqlite3")
+    rebuild.add_argument("--queue", default="observations.sqlite3")
+    rebuild.add_argument("--data", default="data.csv", help="path of data.csv")
+    args = parser.parse_args()
+
+    from app_files.airtable_mirror import AirtableMirror
+    from app_files.airtable_utils import get_airtable_data
+    from app_files.catalog import TaxonomyCatalog
+    from app_files.observation_queue import ObservationQueue
+
+    mirror = AirtableMirror(args.mirror)
+    synced = [
+        fields
+        for _, fields in mirror.records(get_airtable_data()["observation_table_name"])
+    ]
+    mirror.close()
+    queue = ObservationQueue(args.queue)
+    pending = [fields for _, fields in queue.iter_pending()]
+    queue.close()
+    rollup = SurveyRollup(args.rollup, TaxonomyCatalog.from_csv(args.data))
+    rollup.rebuild(synced, pending)
+    rollup.close()
+    print(f"Counted {len(synced)} synced and {len(pending)} pending observations")
+
+
+if __name__ == "__main__":
+    main()
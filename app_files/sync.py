@@ -0,0 +1,199 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple
+
+from app_files.http_client import http_client
+from app_files.telemetry import telemetry
+
+# Airtable accepts up to 10 records per create request
+AIRTABLE_BATCH_SIZE = 10
+# and allows 5 requests per second per base
+AIRTABLE_REQUESTS_PER_SECOND = 5
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that limits how often requests may start.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (int): Maximum number of tokens that can be saved up, which is
+            also the largest burst allowed. Defaults to one second of tokens.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one token, waiting until one is available.
+        """
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+class SyncResult(NamedTuple):
+    """
+    Outcome of a sync: the keys of the records the server confirmed, the keys
+    of the records that could not be pushed, and one message per failed batch.
+    """
+
+    synced: List
+    failed: List
+    errors: List[str]
+
+
+def chunk(items, size):
+    """
+    Splits a list into consecutive lists of at most size items.
+    """
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def backoff_delay(attempt, base=0.5, cap=16.0):
+    """
+    Returns a randomized exponential backoff delay ("full jitter") for the
+    given retry attempt, starting at 0.
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def post_with_retries(
+    url, endpoint, bucket, check, max_retries=5, timeout=30, **kwargs
+):
+    """
+    Sends a POST request, retrying on rate limiting, server errors and
+    connection errors.
+
+    Args:
+        url (str): The URL to post to.
+        endpoint (str): The endpoint name recorded by the HTTP client.
+        bucket (TokenBucket): Limits the rate of requests, including retries,
+            or None for no limit.
+        check (callable): Called with a successful (2xx) response. It returns
+            None when the request did what was asked, or an error message.
+        max_retries (int): How many times to retry before giving up.
+        timeout (float): Seconds to wait for each response.
+        **kwargs: Passed on to the HTTP client, e.g. json or headers.
+
+    Returns:
+        str: None on success, otherwise an error message.
+    """
+    import requests
+
+    for attempt in range(max_retries + 1):
+        if bucket is not None:
+            bucket.acquire()
+        retry_after = 0
+        try:
+            response = http_client.post(
+                url, endpoint=endpoint, timeout=timeout, **kwargs
+            )
+        except requests.RequestException as e:
+            error = str(e)
+        else:
+            if 200 <= response.status_code < 300:
+                return check(response)
+            error = f"{response.status_code}: {response.text}"
+            if response.status_code not in RETRY_STATUS_CODES:
+                return error
+            header = response.headers.get("Retry-After", "")
+            retry_after = int(header) if header.isdigit() else 0
+        if attempt < max_retries:
+            time.sleep(max(backoff_delay(attempt), retry_after))
+    return error
+
+
+def post_batch(url, headers, fields, bucket, max_retries=5, timeout=30):
+    """
+    Creates one batch of records, retrying on rate limiting and server errors.
+
+    Args:
+        url (str): The table URL.
+        headers (dict): The request headers.
+        fields (list): The fields of each record in the batch.
+        bucket (TokenBucket): Limits the rate of requests, including retries.
+        max_retries (int): How many times to retry before giving up.
+        timeout (float): Seconds to wait for each response.
+
+    Returns:
+        str: None when every record was created, otherwise an error message.
+    """
+
+    def check(response):
+        created = response.json().get("records", [])
+        if len(created) == len(fields):
+            return None
+        return f"Expected {len(fields)} records, created {len(created)}"
+
+    return post_with_retries(
+        url,
+        "airtable create records",
+        bucket,
+        check,
+        max_retries,
+        timeout,
+        json={"records": [{"fields": record} for record in fields]},
+        headers=headers,
+    )
+
+
+@telemetry.timed("sync_records")
+def sync_records(records, sink):
+    """
+    Pushes records to a sink, in batches of the largest size it accepts and
+    with as many batches in flight as it allows.
+
+    Args:
+        records (list): (key, fields) pairs. The keys identify the records in
+            the result and are not sent.
+        sink (ObservationSink): Where the records go, e.g. an AirtableSink.
+
+    Returns:
+        SyncResult: Which records were confirmed and which failed.
+    """
+    batches = chunk(list(records), sink.batch_size)
+
+    def push(batch):
+        return sink.send_batch([fields for _, fields in batch])
+
+    synced, failed, errors = [], [], []
+    with ThreadPoolExecutor(max_workers=sink.max_workers) as executor:
+        for batch, error in zip(batches, executor.map(push, batches)):
+            keys = [key for key, _ in batch]
+            if error is None:
+                synced.extend(keys)
+            else:
+                failed.extend(keys)
+                errors.append(error)
+    telemetry.increment(
+        "observations_synced_total",
+        len(synced),
+        "Observations pushed to the sync target.",
+    )
+    telemetry.increment(
+        "observations_sync_failed_total",
+        len(failed),
+        "Observations the sync target did not confirm.",
+    )
+    return SyncResult(synced, failed, errors)
@@ -0,0 +1,224 @@
+"""
+Timing and counting hooks for the hot paths of the app, exported in the
+Prometheus text format.
+
+Telemetry is off unless ARTHROPOD_TELEMETRY=1 is set. When it is off,
+timed() hands back the decorated function itself and the other hooks return
+before doing anything, so the hooks cost next to nothing.
+"""
+import asyncio
+import bisect
+import functools
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Tuple
+
+# upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# prefix of every exported metric name
+NAMESPACE = "arthropod"
+
+
+class LatencyHistogram:
+    """
+    Counts observed latencies in fixed buckets, Prometheus style.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # one count per bucket, plus one for latencies above the last bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def snapshot(self):
+        return {
+            "buckets": dict(zip(self.buckets + (float("inf"),), self.counts)),
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+
+class Metric(NamedTuple):
+    """
+    One metric family to export: its name (without the namespace), its
+    Prometheus type ("counter", "gauge" or "histogram"), its help text, and
+    (labels, value) samples. The value of a histogram sample is a
+    LatencyHistogram snapshot.
+    """
+
+    name: str
+    kind: str
+    help: str
+    samples: List[Tuple[Dict[str, str], object]]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = (f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+    return "{" + ",".join(pairs) + "}"
+
+
+def render_prometheus(metrics: Iterable[Metric]) -> str:
+    """
+    Formats metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in metrics:
+        name = f"{NAMESPACE}_{metric.name}"
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for labels, value in metric.samples:
+            if metric.kind != "histogram":
+                lines.append(f"{name}{_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in value["buckets"].items():
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(
+                    f"{name}_bucket{_labels({**labels, 'le': le})} {cumulative}"
+                )
+            lines.append(f"{name}_sum{_labels(labels)} {value['sum']}")
+            lines.append(f"{name}_count{_labels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class Telemetry:
+    """
+    Registry of the app's timings, counters and gauges.
+
+    Args:
+        enabled (bool): Whether the hooks record anything.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._durations: Dict[str, LatencyHistogram] = {}
+        self._counters: Dict[str, float] = {}
+        self._help: Dict[str, str] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._collectors: List[Callable[[], Iterable[Metric]]] = []
+
+    def timed(self, operation):
+        """
+        Decorator recording how long each call of a function or coroutine
+        function takes, under the given operation name. With telemetry off,
+        the function is returned as is.
+        """
+
+        def decorate(fn):
+            if not self.enabled:
+                return fn
+            if asyncio.iscoroutinefunction(fn):
+
+                @functools.wraps(fn)
+                async def timed_coroutine(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return await fn(*args, **kwargs)
+                    finally:
+                        self.observe(operation, time.perf_counter() - start)
+
+                return timed_coroutine
+
+            @functools.wraps(fn)
+            def timed_function(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(operation, time.perf_counter() - start)
+
+            return timed_function
+
+        return decorate
+
+    def observe(self, operation, seconds):
+        """
+        Records the duration of one run of an operation.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._durations.get(operation)
+            if histogram is None:
+                histogram = self._durations[operation] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, amount=1, help=""):
+        """
+        Adds to a counter, such as the number of bytes uploaded.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+            self._help.setdefault(name, help)
+
+    def gauge(self, name, read, help=""):
+        """
+        Registers a gauge whose value is read when the metrics are exported,
+        such as the depth of the sync queue.
+        """
+        self._gauges[name] = read
+        self._help[name] = help
+
+    def add_collector(self, collect):
+        """
+        Registers a callable returning extra Metrics to export, such as the
+        outbound HTTP metrics.
+        """
+        self._collectors.append(collect)
+
+    def metrics(self) -> List[Metric]:
+        """
+        Returns every metric recorded so far.
+        """
+        with self._lock:
+            durations = [
+                ({"operation": operation}, histogram.snapshot())
+                for operation, histogram in sorted(self._durations.items())
+            ]
+            counters = sorted(self._counters.items())
+        metrics = [
+            Metric(
+                "operation_duration_seconds",
+                "histogram",
+                "Time spent in instrumented operations.",
+                durations,
+            )
+        ]
+        metrics += [
+            Metric(name, "counter", self._help[name], [({}, value)])
+            for name, value in counters
+        ]
+        metrics += [
+            Metric(name, "gauge", self._help[name], [({}, read())])
+            for name, read in sorted(self._gauges.items())
+        ]
+        for collect in self._collectors:
+            metrics.extend(collect())
+        return metrics
+
+    def prometheus(self) -> str:
+        """
+        Returns every metric in the Prometheus text format.
+        """
+        return render_prometheus(self.metrics())
+
+
+# the registry shared by the whole app; set ARTHROPOD_TELEMETRY=1 to turn it on
+telemetry = Telemetry(enabled=os.environ.get("ARTHROPOD_TELEMETRY") == "1")
@@ -0,0 +1,268 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from app_files.image_preprocess import PreprocessResult, preprocess_image
+from app_files.image_store import file_digest
+from app_files.image_upload import upload_image_to_imgur
+from app_files.telemetry import telemetry
+
+# seconds after which a spooled photo is taken for left over by a worker that
+# died, and deleted
+SPOOL_MAX_AGE = 24 * 60 * 60
+
+
+class UploadError(Exception):
+    """
+    Raised when an image could not be uploaded after every attempt.
+    """
+
+
+class UploadResult(NamedTuple):
+    """
+    The URL of an uploaded image, and how preprocessing changed its size.
+    reused is true when the same photo had already been uploaded, and nothing
+    was sent. digest is the SHA-256 of the photo, and thumbnail the path of
+    its thumbnail, or None when there is no image store or no thumbnail.
+    """
+
+    url: str
+    original_bytes: int
+    uploaded_bytes: int
+    preprocess_seconds: float
+    reused: bool = False
+    digest: str = None
+    thumbnail: str = None
+
+
+class UploadPipeline:
+    """
+    Uploads images in the background so recording an observation never waits
+    on the network.
+
+    With an image store, each photo is first hashed. A photo that was
+    uploaded before is not uploaded again, and the store's URL is returned;
+    one that is being uploaded for another observation waits for that upload.
+    A thumbnail of every photo is kept in the store.
+
+    Uploads run on a small thread pool shared by all sessions of the worker,
+    which bounds how many of them are in flight at once. Each image is first
+    downscaled and recompressed, then uploaded. A failed upload is retried
+    with exponential backoff before UploadError is raised.
+
+    With a spool directory, photos are moved there by spool() before being
+    uploaded, so that they outlive the session they were picked in, and
+    deleted once their upload is over.
+
+    Args:
+        upload (callable): Called as upload(path) in a worker thread. It
+            returns the URL of the uploaded image, or None when the upload was
+            rejected.
+        preprocess (callable): Called as preprocess(path) in a worker thread
+            before uploading. It returns a PreprocessResult for the file to
+            upload instead, or None to upload the original file.
+        store (ImageStore): Remembers the uploaded photos and their
+            thumbnails, or None to upload every photo.
+        max_workers (int): Maximum number of uploads in flight at once.
+        max_attempts (int): How many times to try each upload.
+        backoff (float): Seconds to wait before the first retry; doubled for
+            each retry after that.
+        spool_dir (str): Directory the photos to upload are moved to, or None
+            to upload them where they are.
+    """
+
+    def __init__(
+        self,
+        upload=upload_image_to_imgur,
+        preprocess=preprocess_image,
+        store=None,
+        max_workers=2,
+        max_attempts=3,
+        backoff=2.0,
+        spool_dir=None,
+    ):
+        self._upload = upload
+        self._preprocess = preprocess
+        self.store = store
+        # uploads in flight, by SHA-256 of the photo
+        self._in_flight = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="image-upload"
+        )
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.spool_dir = None
+        if spool_dir is not None:
+            self.spool_dir = os.path.abspath(spool_dir)
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self._sweep_spool()
+
+    def spool(self, path):
+        """
+        Moves a photo picked for upload into the spool directory. Shiny
+        deletes the files uploaded in a session when it ends, while the
+        upload of its photos goes on.
+
+        Args:
+            path (str): Path of the photo.
+
+        Returns:
+            str: Its path in the spool directory, or path without one.
+        """
+        if self.spool_dir is None:
+            return path
+        handle, spooled = tempfile.mkstemp(
+            suffix=os.path.splitext(path)[1], dir=self.spool_dir
+        )
+        os.close(handle)
+        shutil.move(path, spooled)
+        return spooled
+
+    async def upload(self, path):
+        """
+        Uploads an image without blocking the event loop.
+
+        Args:
+            path (str): Path of the image file.
+
+        Returns:
+            UploadResult: The URL of the uploaded image and its sizes.
+
+        Raises:
+            UploadError: If every attempt failed.
+        """
+        if self.store is None:
+            return await self._send(path)
+        # a spooled photo is deleted by _send once sent, or here otherwise
+        sent = False
+        try:
+            loop = asyncio.get_running_loop()
+            digest, thumbnail = await loop.run_in_executor(
+                self._executor, self._identify, path
+            )
+            url = self.store.url(digest)
+            if url is not None:
+                telemetry.increment(
+                    "image_uploads_reused_total",
+                    1,
+                    "Photos not uploaded because the same file was uploaded before.",
+                )
+                size = os.path.getsize(path)
+                return UploadResult(url, size, 0, 0.0, True, digest, thumbnail)
+            task = self._in_flight.get(digest)
+            reused = task is not None
+            if task is None:
+                task = asyncio.ensure_future(self._send(path, digest))
+                sent = True
+                self._in_flight[digest] = task
+                task.add_done_callback(lambda _: self._in_flight.pop(digest, None))
+            # a session that goes away does not cancel an upload others wait for
+            result = await asyncio.shield(task)
+            return result._replace(reused=reused, thumbnail=thumbnail)
+        finally:
+            if not sent:
+                self._unspool(path)
+
+    async def _send(self, path, digest=None):
+        loop = asyncio.get_running_loop()
+        try:
+            prepared = await loop.run_in_executor(self._executor, self._prepare, path)
+            try:
+                return await self._send_prepared(prepared, digest)
+            finally:
+                self._unspool(prepared.path)
+        finally:
+            self._unspool(path)
+
+    async def _send_prepared(self, prepared, digest):
+        import requests
+
+        loop = asyncio.get_running_loop()
+        error = "upload rejected"
+        for attempt in range(self.max_attempts):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                url = await loop.run_in_executor(
+                    self._executor, self._upload, prepared.path
+                )
+            except (OSError, requests.RequestException) as e:
+                error = str(e) or type(e).__name__
+                continue
+            if url:
+                telemetry.increment(
+                    "image_original_bytes_total",
+                    prepared.original_bytes,
+                    "Size of the photos picked for upload, before preprocessing.",
+                )
+                telemetry.increment(
+                    "image_uploaded_bytes_total",
+                    prepared.compressed_bytes,
+                    "Bytes of images uploaded to Imgur.",
+                )
+                if digest is not None:
+                    self.store.remember(digest, url, prepared.compressed_bytes)
+                return UploadResult(
+                    url,
+                    prepared.original_bytes,
+                    prepared.compressed_bytes,
+                    prepared.seconds,
+                    digest=digest,
+                )
+            error = "upload rejected"
+        telemetry.increment("image_upload_failures_total", 1, "Images never uploaded.")
+        raise UploadError(f"{error} (after {self.max_attempts} attempts)")
+
+    def _identify(self, path):
+        # the SHA-256 of a photo, and its thumbnail if it can be made
+        from PIL import Image
+
+        digest = file_digest(path)
+        try:
+            thumbnail = self.store.thumbnail(path, digest)
+        except (OSError, Image.DecompressionBombError) as e:
+            print(f"No thumbnail for {path}: {e}")
+            thumbnail = None
+        return digest, thumbnail
+
+    def _prepare(self, path):
+        from PIL import Image
+
+        size = os.path.getsize(path)
+        if self._preprocess is not None:
+            try:
+                prepared = self._preprocess(path)
+            except (OSError, Image.DecompressionBombError) as e:
+                print(f"Uploading {path} as is, could not preprocess it: {e}")
+            else:
+                if prepared is not None:
+                    return prepared
+        return PreprocessResult(path, size, size, 0.0)
+
+    def _unspool(self, path):
+        # deletes a file of the spool directory; files elsewhere are left alone
+        if self.spool_dir is None:
+            return
+        if os.path.dirname(os.path.abspath(path)) != self.spool_dir:
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _sweep_spool(self):
+        # workers share the directory, so only files too old to be uploading go
+        cutoff = time.time() - SPOOL_MAX_AGE
+        for entry in os.scandir(self.spool_dir):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
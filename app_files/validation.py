@@ -0,0 +1,219 @@
+"""
+Validation and enrichment of whole batches of observations.
+
+A batch, such as the observations of one sync or one chunk of an imported
+datasheet, is checked as a DataFrame: each distinct species of the batch is
+looked up once in the species catalog, such as the worker's memory-mapped
+one, and the survey fields are matched to the choices in survey.json with
+one join. Valid rows get their Class, Order,
+Family, Genus and Species from the catalog, and their names in the catalog's
+and survey.json's spelling. Rejected rows are reported with the reasons.
+"""
+import json
+
+from app_files.catalog import CSV_COLUMNS, TaxonomyCatalog
+
+# fields every observation must have
+REQUIRED_COLUMNS = [
+    "Date observed",
+    "Location",
+    "Plot",
+    "Survey Point",
+    "Side",
+    "Common Name",
+    "Count",
+]
+# taxonomy fields filled in from data.csv
+TAXONOMY_COLUMNS = list(CSV_COLUMNS[1:6])
+# observation field checked against each list of choices in survey.json
+SURVEY_COLUMNS = {
+    "Location": "location",
+    "Plot": "plots",
+    "Survey Point": "survey_points",
+    "Side": "survey_side",
+}
+
+
+def find_species(catalog, name):
+    """
+    Looks up a species by Common Name, ignoring case and the spaces that some
+    Common Names of data.csv end with.
+
+    Args:
+        catalog (TaxonomyCatalog): The catalog, or a MappedCatalog.
+        name (str): The Common Name, without surrounding spaces.
+
+    Returns:
+        SpeciesRecord: The species, or None if there is none by that name.
+    """
+    record = catalog.lookup(name)
+    if record is None:
+        # a Common Name ending in spaces sorts first among those it starts
+        for candidate in catalog.prefix(name, limit=1):
+            if candidate.common_name.strip().casefold() == name.casefold():
+                return candidate
+    return record
+
+
+def load_survey_choices(path="survey.json"):
+    """
+    Reads the allowed values of each survey field from survey.json.
+
+    Returns:
+        dict: For each field in SURVEY_COLUMNS, the allowed values keyed by
+        their case-folded spelling.
+    """
+    with open(path) as file:
+        survey = json.load(file)
+    return {
+        column: {str(value).casefold(): value for value in survey[key]}
+        for column, key in SURVEY_COLUMNS.items()
+    }
+
+
+def validate_frame(frame, catalog, choices):
+    """
+    Checks a batch of observations and fills in their taxonomy.
+
+    Rows with a missing required value, an unknown species, a location,
+    plot, survey point or side that is not in survey.json, an unreadable
+    date or a count that is not a positive whole number are rejected.
+
+    Args:
+        frame (DataFrame): The observations, one per row.
+        catalog (TaxonomyCatalog): The species catalog, or a MappedCatalog.
+        choices (dict): The result of load_survey_choices().
+
+    Returns:
+        tuple: (valid, rejected) DataFrames with the index of frame. Valid
+        rows have the columns of frame plus the taxonomy columns, with the
+        checked values in their canonical form; rejected rows keep their
+        values and gain an "Error" column.
+    """
+    import pandas as pd
+
+    missing = [column for column in REQUIRED_COLUMNS if column not in frame.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    text = frame[REQUIRED_COLUMNS].fillna("").astype(str)
+    text = text.apply(lambda column: column.str.strip())
+    folded = text.apply(lambda column: column.str.casefold())
+    empty = text == ""
+
+    species = {
+        name: find_species(catalog, name)
+        for name in text["Common Name"].unique()
+        if name
+    }
+    species = {name: record for name, record in species.items() if record}
+    # the catalog's fields of each row's species, NaN for unknown species
+    matched = pd.DataFrame(
+        {
+            column: text["Common Name"].map(
+                {name: record[i] for name, record in species.items()}
+            )
+            for i, column in enumerate(CSV_COLUMNS[:6])
+        },
+        index=frame.index,
+    )
+    canonical = {
+        column: folded[column].map(allowed) for column, allowed in choices.items()
+    }
+    dates = pd.to_datetime(text["Date observed"], errors="coerce", format="mixed")
+    counts = pd.to_numeric(text["Count"], errors="coerce")
+
+    bad_count = counts.isna() | (counts < 1) | (counts % 1 != 0)
+    # (failed, field, message); an empty field is only reported as missing
+    checks = [(matched["Common Name"].isna(), "Common Name", "unknown species")]
+    checks += [
+        (values.isna(), column, f"{column} is not in survey.json")
+        for column, values in canonical.items()
+    ]
+    checks += [
+        (dates.isna(), "Date observed", "unreadable date"),
+        (bad_count, "Count", "count must be a positive whole number"),
+    ]
+    problems = [(empty[column], f"missing {column}") for column in REQUIRED_COLUMNS]
+    problems += [
+        (failed & ~empty[column], message) for failed, column, message in checks
+    ]
+    errors = pd.Series("", index=frame.index)
+    for mask, message in problems:
+        errors = errors.where(~mask, errors + message + "; ")
+
+    ok = errors == ""
+    valid = frame[ok].copy()
+    for column in ["Common Name"] + TAXONOMY_COLUMNS:
+        valid[column] = matched.loc[ok, column]
+    for column, values in canonical.items():
+        valid[column] = values[ok]
+    valid["Date observed"] = dates[ok].dt.strftime("%Y-%m-%d")
+    valid["Count"] = counts[ok].astype(int)
+    rejected = frame[~ok].assign(Error=errors[~ok].str.rstrip("; "))
+    return valid, rejected
+
+
+class ObservationValidator:
+    """
+    Validates batches of observations against the species catalog and
+    survey.json.
+
+    Files are read on first use, so that creating a validator does not
+    import pandas.
+
+    Args:
+        taxonomy_path (str): Path of data.csv, read when no catalog is given.
+        survey_path (str): Path of survey.json.
+        catalog (TaxonomyCatalog): The species catalog, such as the
+            MappedCatalog the rest of the worker uses, or None.
+    """
+
+    def __init__(
+        self, taxonomy_path="data.csv", survey_path="survey.json", catalog=None
+    ):
+        self.taxonomy_path = taxonomy_path
+        self.survey_path = survey_path
+        self._catalog = catalog
+        self._choices = None
+
+    def validate_frame(self, frame):
+        """
+        Checks a DataFrame of observations; see validate_frame().
+        """
+        if self._catalog is None:
+            self._catalog = TaxonomyCatalog.from_csv(self.taxonomy_path)
+        if self._choices is None:
+            self._choices = load_survey_choices(self.survey_path)
+        return validate_frame(frame, self._catalog, self._choices)
+
+    def validate_records(self, records):
+        """
+        Checks a batch of observations, such as the ones about to be synced.
+
+        Args:
+            records (list): (id, fields) pairs.
+
+        Returns:
+            tuple: A list of (id, fields) pairs of the valid observations,
+            with their taxonomy filled in, and a dict of the problems of
+            each rejected observation, by id.
+        """
+        if not records:
+            return [], {}
+        import pandas as pd
+
+        ids = [obs_id for obs_id, _ in records]
+        frame = pd.DataFrame([fields for _, fields in records], index=ids)
+        valid, rejected = self.validate_frame(frame)
+        valid_records = [
+            (obs_id, {key: _plain(value) for key, value in fields.items()})
+            for obs_id, fields in zip(valid.index.tolist(), valid.to_dict("records"))
+        ]
+        return valid_records, dict(zip(rejected.index.tolist(), rejected["Error"]))
+
+
+def _plain(value):
+    # numpy scalars do not serialize to JSON, and pandas fills absent fields with NaN
+    if hasattr(value, "item"):
+        value = value.item()
+    return None if isinstance(value, float) and value != value else value
@@ -0,0 +1,79 @@
+"""
+Compares the per-submit cost of looking up a species' taxonomy with the old
+DataFrame boolean-mask scans against the TaxonomyCatalog hash index.
+
+Run from the repository root:
+
+    python benchmarks/bench_catalog.py
+"""
+import os
+import random
+import sys
+import timeit
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app_files.catalog import CSV_COLUMNS, SpeciesRecord, TaxonomyCatalog  # noqa: E402
+
+SIZES = (200, 20_000, 200_000)
+LOOKUPS = 200
+
+
+def make_rows(size):
+    return [
+        (
+            f"Species {i:06d}",
+            "Insecta (Insects)",
+            f"Order {i % 30}",
+            f"Family {i % 400}",
+            f"Genus{i % 5000}",
+            f"species{i}",
+            "Some identification notes for this species.",
+        )
+        for i in range(size)
+    ]
+
+
+def submit_with_dataframe(df, name):
+    # the five lookups _submit used to run per observation
+    return (
+        df.loc[df["Common Name"] == name, "Order"].values[0],
+        df.loc[df["Common Name"] == name, "Order"].values[0],
+        df.loc[df["Common Name"] == name, "Family"].values[0],
+        df.loc[df["Common Name"] == name, "Genus"].values[0],
+        df.loc[df["Common Name"] == name, "Species"].values[0],
+    )
+
+
+def submit_with_catalog(catalog, name):
+    record = catalog[name]
+    return (record.order, record.order, record.family, record.genus, record.species)
+
+
+def main():
+    print(f"{'species':>10} {'dataframe (us)':>16} {'catalog (us)':>14} {'speedup':>9}")
+    for size in SIZES:
+        rows = make_rows(size)
+        df = pd.DataFrame(rows, columns=list(CSV_COLUMNS))
+        catalog = TaxonomyCatalog(SpeciesRecord(*row) for row in rows)
+        names = random.Random(size).choices([row[0] for row in rows], k=LOOKUPS)
+
+        old = timeit.timeit(
+            lambda: [submit_with_dataframe(df, name) for name in names], number=1
+        )
+        new = min(
+            timeit.repeat(
+                lambda: [submit_with_catalog(catalog, name) for name in names],
+                number=1,
+                repeat=5,
+            )
+        )
+        old_us = old / LOOKUPS * 1e6
+        new_us = new / LOOKUPS * 1e6
+        print(f"{size:>10} {old_us:>16.1f} {new_us:>14.2f} {old_us / new_us:>8.0f}x")
+
+
+if __name__ == "__main__":
+    main()
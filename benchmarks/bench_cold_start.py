@@ -0,0 +1,92 @@
+"""
+Measures the cold start of the app in fresh Python processes, as a worker
+that was scaled to zero sees it: the time to import app.py, and the time from
+launching uvicorn to the first successful response of the UI page. Both are
+measured with a fresh catalog artifact and without one, when it has to be
+rebuilt from data.csv.
+
+Run from the repository root:
+
+    python benchmarks/bench_cold_start.py
+"""
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+ARTIFACT = os.path.join(ROOT, "data.catalog")
+RUNS = 5
+IMPORT_SCRIPT = (
+    "import time; start = time.perf_counter(); import app; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def import_time():
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def first_response_time(timeout=60):
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port)],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/") as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        raise RuntimeError("the app did not answer in time")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def measure(fn, fresh_artifact):
+    times = []
+    for _ in range(RUNS):
+        if fresh_artifact:
+            if not os.path.exists(ARTIFACT):
+                import_time()
+        elif os.path.exists(ARTIFACT):
+            os.remove(ARTIFACT)
+        times.append(fn())
+    return statistics.median(times)
+
+
+def main():
+    print(f"Median of {RUNS} cold starts")
+    print(f"{'catalog artifact':>18} {'import (s)':>11} {'first UI response (s)':>22}")
+    for name, fresh in (("fresh", True), ("missing", False)):
+        imported = measure(import_time, fresh)
+        responded = measure(first_response_time, fresh)
+        print(f"{name:>18} {imported:>11.3f} {responded:>22.3f}")
+
+
+if __name__ == "__main__":
+    main()
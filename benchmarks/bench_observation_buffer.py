@@ -0,0 +1,111 @@
+"""
+Records 5,000 observations in one simulated session and reports the time and
+peak memory of appending them to a DataFrame one at a time (the old _submit
+path) against the ObservationBuffer.
+
+Run from the repository root:
+
+    python benchmarks/bench_observation_buffer.py
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app_files.observation_buffer import ObservationBuffer  # noqa: E402
+
+OBSERVATIONS = 5_000
+COLUMNS = [
+    "Date observed",
+    "Location",
+    "Plot",
+    "Surveyors",
+    "Survey Point",
+    "Side",
+    "Class",
+    "Order",
+    "Family",
+    "Common Name",
+    "Genus",
+    "Species",
+    "Count",
+    "Notes",
+    "Url",
+    "Image attachment",
+]
+GRID_COLUMNS = [
+    "Date observed",
+    "Plot",
+    "Survey Point",
+    "Side",
+    "Common Name",
+    "Count",
+    "Notes",
+]
+
+
+def make_observation(i):
+    return {
+        "Date observed": "2024-05-01",
+        "Location": "Eden Landing",
+        "Plot": f"P{i % 4 + 1}",
+        "Surveyors": "Cole, Eric",
+        "Survey Point": f"PTF{i % 4 + 1}",
+        "Side": "Pond side",
+        "Class": "Insecta (Insects)",
+        "Order": "Coleoptera (Beetles)",
+        "Family": "Coccinellidae (Lady Beetles)",
+        "Common Name": f"Species {i % 200}",
+        "Genus": "Hippodamia",
+        "Species": "convergens",
+        "Count": i % 10 + 1,
+        "Notes": "",
+        "Url": "",
+        "Image attachment": [{"url": ""}],
+    }
+
+
+def record_with_dataframe(observations):
+    df = pd.DataFrame([], columns=COLUMNS)
+    for i, fields in enumerate(observations):
+        # DataFrame._append is private and gone in pandas 3; concat copies the same way
+        df = pd.concat([df, pd.DataFrame([fields], index=[i])])
+    return df[GRID_COLUMNS]
+
+
+def record_with_buffer(observations):
+    buffer = ObservationBuffer(COLUMNS)
+    for i, fields in enumerate(observations):
+        buffer.append(i, fields)
+    return buffer.to_frame(GRID_COLUMNS)
+
+
+def measure(fn, observations):
+    tracemalloc.start()
+    start = time.perf_counter()
+    frame = fn(observations)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(frame) == len(observations)
+    return elapsed, peak
+
+
+def main():
+    observations = [make_observation(i) for i in range(OBSERVATIONS)]
+    print(f"Recording {OBSERVATIONS} observations")
+    print(f"{'path':>12} {'time (s)':>10} {'peak memory (MB)':>18}")
+    for name, fn in (
+        ("dataframe", record_with_dataframe),
+        ("buffer", record_with_buffer),
+    ):
+        elapsed, peak = measure(fn, observations)
+        print(f"{name:>12} {elapsed:>10.3f} {peak / 2**20:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,543 @@
+"""
+End-to-end benchmark of the app against local stand-ins for iNaturalist,
+Imgur, Airtable and a bulk ingestion endpoint.
+
+Every scenario starts the app with uvicorn in a fresh process and state
+directory, points it at the mock services through the ARTHROPOD_*_URL
+environment variables, and drives it with headless Shiny sessions:
+
+    browse      select species one after the other, then in a burst
+    submit      record observations, some with a photo
+    sync        sync a backlog of queued observations to the --sink: Airtable,
+                a local SQLite or DuckDB database, or the ingestion endpoint
+    concurrent  several sessions browsing and submitting at the same time
+    trace       browse, scroll through species and submit once, counting the
+                effects each action runs and the requests it makes
+
+The results are printed as JSON (or written to --output), with the commit
+they were measured on, so throughput and latency can be compared from one
+commit to the next.
+
+Run from the repository root:
+
+    python benchmarks/bench_scenarios.py --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from app_files.catalog import TaxonomyCatalog  # noqa: E402
+from app_files.navbar_utils import DEVICE_COOKIE  # noqa: E402
+from app_files.observation_queue import ObservationQueue  # noqa: E402
+from headless_client import ShinyClient, output_html  # noqa: E402
+from mock_services import (  # noqa: E402
+    Behavior,
+    MockAirtable,
+    MockImgur,
+    MockINaturalist,
+    MockIngest,
+)
+
+INITIAL_INPUTS = {
+    "survey_date:shiny.date": "2024-05-01",
+    "location": "Eden Landing",
+    "surveyors": ["Cole"],
+    "plot": "P1",
+    "survey_point": "PTF1",
+    "survey_side": "Pond side",
+    "specimen": "",
+    "count": 1,
+    "notes": "",
+    "file1": None,
+    "submit:shiny.action": 0,
+    "reset:shiny.action": 0,
+    "sync:shiny.action": 0,
+    ".clientdata_url_search": "",
+    ".clientdata_output_notes_hidden": False,
+}
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(seconds):
+    """
+    Summarizes latencies in milliseconds.
+    """
+    if not seconds:
+        return {"count": 0}
+    return {
+        "count": len(seconds),
+        "mean_ms": round(1000 * sum(seconds) / len(seconds), 2),
+        "p50_ms": round(1000 * percentile(seconds, 0.50), 2),
+        "p95_ms": round(1000 * percentile(seconds, 0.95), 2),
+        "p99_ms": round(1000 * percentile(seconds, 0.99), 2),
+        "max_ms": round(1000 * max(seconds), 2),
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class AppServer:
+    """
+    Runs the app with uvicorn in a subprocess, wired to the mock services.
+    """
+
+    def __init__(
+        self, state_dir, inaturalist, imgur, airtable, sink="airtable", trace=False
+    ):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = {
+            **os.environ,
+            "ARTHROPOD_STATE_DIR": state_dir,
+            "ARTHROPOD_INATURALIST_URL": inaturalist.url,
+            "ARTHROPOD_IMGUR_URL": imgur.url,
+            "ARTHROPOD_IMGUR_CLIENT_ID": "benchmark",
+            "ARTHROPOD_AIRTABLE_URL": airtable.url,
+            "ARTHROPOD_AIRTABLE_API_KEY": "benchmark",
+            "ARTHROPOD_AIRTABLE_BASE_ID": "base",
+            "ARTHROPOD_AIRTABLE_OBSERVATION_TABLE": "observations",
+            "ARTHROPOD_SINK": sink,
+            "ARTHROPOD_TRACE_REACTIVE": "1" if trace else "0",
+        }
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--port", str(self.port)],
+            cwd=ROOT,
+            env=self.env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            try:
+                with urllib.request.urlopen(self.url):
+                    return self
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.05)
+        self.__exit__()
+        raise RuntimeError("the app did not start")
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.wait()
+
+
+def is_full_card(message):
+    return "<img" in (output_html(message, "notes") or "")
+
+
+def is_recorded(message):
+    notification = message.get("notification", {})
+    return "recorded" in notification.get("message", {}).get("html", "")
+
+
+def browse(app, species, count):
+    """
+    Selects species one at a time, waiting for each card, then selects a
+    burst of species without waiting and times until the last card shows.
+    """
+    client = ShinyClient(app.url, INITIAL_INPUTS)
+    latencies = []
+    for name in species[:count]:
+        client.drain()
+        start = time.perf_counter()
+        client.update({"specimen": name})
+        client.wait_for(is_full_card)
+        latencies.append(time.perf_counter() - start)
+
+    burst = species[count : 2 * count]
+    client.drain()
+    start = time.perf_counter()
+    for name in burst:
+        client.update({"specimen": name})
+    last_card = f"{burst[-1]} ID notes"
+    client.wait_for(
+        lambda m: is_full_card(m) and last_card in output_html(m, "notes")
+    )
+    burst_seconds = time.perf_counter() - start
+    client.close()
+    return {
+        "selections": len(latencies),
+        "card_latency": summarize(latencies),
+        "burst_selections": len(burst),
+        "burst_seconds": round(burst_seconds, 3),
+    }
+
+
+def submit(app, imgur, species, count, photo=None, photo_every=0):
+    """
+    Records observations one after the other, attaching a photo to every
+    photo_every-th one, then waits for the photos to reach Imgur. Each photo
+    is a distinct file, so none is skipped as already uploaded.
+    """
+    client = ShinyClient(app.url, INITIAL_INPUTS)
+    latencies = []
+    start_all = time.perf_counter()
+    for i in range(count):
+        if photo and photo_every and i % photo_every == 0:
+            client.upload("file1", distinct_copy(photo, i))
+        client.update({"specimen": species[i % len(species)], "count": i % 10 + 1})
+        client.drain()
+        start = time.perf_counter()
+        client.click("submit")
+        client.wait_for(is_recorded)
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - start_all
+    photos = len(range(0, count, photo_every)) if photo and photo_every else 0
+    deadline = time.monotonic() + 300
+    while imgur.uploads < photos and time.monotonic() < deadline:
+        time.sleep(0.05)
+    uploaded = time.perf_counter() - start_all
+    client.close()
+    tenth = max(1, count // 10)
+    return {
+        "submissions": count,
+        "seconds": round(elapsed, 3),
+        "per_second": round(count / elapsed, 2),
+        "photos": photos,
+        "photos_uploaded": imgur.uploads,
+        "seconds_until_uploaded": round(uploaded, 3),
+        "latency": summarize(latencies),
+        "first_tenth_latency": summarize(latencies[:tenth]),
+        "last_tenth_latency": summarize(latencies[-tenth:]),
+    }
+
+
+def sync(app, count):
+    """
+    Syncs a backlog of queued observations, which the session replays on
+    start, to the app's sink. The backlog belongs to no device, so the
+    session sends a device cookie, like a browser, to take it over.
+    """
+    client = ShinyClient(app.url, INITIAL_INPUTS, {DEVICE_COOKIE: "benchmark-device"})
+    client.drain()
+    start = time.perf_counter()
+    client.click("sync")
+    client.wait_for(lambda m: "modal" in m, timeout=600)
+    elapsed = time.perf_counter() - start
+    client.close()
+    return {
+        "records": count,
+        "seconds": round(elapsed, 3),
+        "records_per_second": round(count / elapsed, 2),
+    }
+
+
+def concurrent(app, species, sessions, browse_count, submit_count):
+    """
+    Runs several sessions at once, each browsing and then submitting.
+    """
+    card_latencies, submit_latencies, errors = [], [], []
+    lock = threading.Lock()
+    barrier = threading.Barrier(sessions)
+
+    def run(offset):
+        try:
+            client = ShinyClient(app.url, INITIAL_INPUTS)
+            barrier.wait()
+            cards, submits = [], []
+            for i in range(browse_count):
+                client.drain()
+                start = time.perf_counter()
+                client.update({"specimen": species[(offset + i) % len(species)]})
+                client.wait_for(is_full_card)
+                cards.append(time.perf_counter() - start)
+            for i in range(submit_count):
+                client.drain()
+                start = time.perf_counter()
+                client.click("submit")
+                client.wait_for(is_recorded)
+                submits.append(time.perf_counter() - start)
+            client.close()
+            with lock:
+                card_latencies.extend(cards)
+                submit_latencies.extend(submits)
+        except Exception as e:  # reported in the results instead of aborting the run
+            with lock:
+                errors.append(repr(e))
+
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(target=run, args=(i * browse_count,)) for i in range(sessions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        "sessions": sessions,
+        "seconds": round(time.perf_counter() - start, 3),
+        "card_latency": summarize(card_latencies),
+        "submit_latency": summarize(submit_latencies),
+        "errors": errors,
+    }
+
+
+def is_trace(message):
+    return "reactive_trace" in message.get("custom", {})
+
+
+def collect_trace(client, quiet=1.5):
+    """
+    Adds up the reactive_trace messages of an action, until none has come for
+    `quiet` seconds, which covers the debounced card lookups it starts.
+    """
+    runs, http = {}, {}
+    while True:
+        try:
+            message = client.wait_for(is_trace, timeout=quiet)
+        except TimeoutError:
+            return {"runs": runs, "http": http}
+        trace = message["custom"]["reactive_trace"]
+        for totals, counts in ((runs, trace["runs"]), (http, trace["http"])):
+            for name, count in counts.items():
+                totals[name] = totals.get(name, 0) + count
+
+
+def trace(app, species, burst=5):
+    """
+    Runs one browse-and-submit cycle and reports, for each action, the
+    effects, outputs and background tasks it ran and the HTTP requests it
+    made. The app runs with ARTHROPOD_TRACE_REACTIVE=1.
+    """
+    client = ShinyClient(app.url, INITIAL_INPUTS)
+    actions = {"open": collect_trace(client)}
+    client.update({"specimen": species[0]})
+    actions["select"] = collect_trace(client)
+    # scrolling through the picker, a selection every 50 ms
+    for name in species[1 : burst + 1]:
+        client.update({"specimen": name})
+        time.sleep(0.05)
+    actions["scroll"] = collect_trace(client)
+    client.update({"specimen": species[0]})
+    actions["select_again"] = collect_trace(client)
+    client.click("submit")
+    # the browser reports the picker the server cleared
+    client.update({"specimen": ""})
+    actions["submit"] = collect_trace(client)
+    client.close()
+    return {"burst_selections": burst, "actions": actions}
+
+
+def make_photo(path):
+    from PIL import Image
+
+    Image.effect_noise((3000, 2000), 64).convert("RGB").save(path, quality=95)
+    return path
+
+
+def sink_spec(sink, state_dir, ingest):
+    """
+    Returns the ARTHROPOD_SINK of a --sink choice.
+    """
+    return {
+        "airtable": "airtable",
+        "sqlite": f"sqlite:{os.path.join(state_dir, 'synced.sqlite3')}",
+        "duckdb": f"duckdb:{os.path.join(state_dir, 'synced.duckdb')}",
+        "jsonl": f"jsonl:{ingest.url}",
+    }[sink]
+
+
+def stored_records(sink, state_dir, services):
+    """
+    Counts the records the sink of a --sink choice received.
+    """
+    from app_files.sinks import open_sink
+
+    if sink in ("airtable", "jsonl"):
+        return len(services["airtable" if sink == "airtable" else "ingest"].records)
+    target = open_sink(sink_spec(sink, state_dir, services["ingest"]))
+    count = target.count()
+    target.close()
+    return count
+
+
+def distinct_copy(path, number):
+    """
+    Copies a photo with bytes appended after the end of the JPEG data, which
+    decoders ignore, so that each copy has its own SHA-256.
+    """
+    root, extension = os.path.splitext(path)
+    copy = f"{root}-{number}{extension}"
+    with open(path, "rb") as source, open(copy, "wb") as target:
+        shutil.copyfileobj(source, target)
+        target.write(str(number).encode())
+    return copy
+
+
+def seed_queue(state_dir, species, count):
+    queue = ObservationQueue(os.path.join(state_dir, "observations.sqlite3"))
+    for i in range(count):
+        queue.append(
+            {
+                "Date observed": "2024-05-01",
+                "Location": "Eden Landing",
+                "Plot": f"P{i % 4 + 1}",
+                "Survey Point": f"PTF{i % 4 + 1}",
+                "Side": "Pond side",
+                "Common Name": species[i % len(species)],
+                "Count": i % 10 + 1,
+                "Notes": "",
+                "Surveyors": "Cole",
+                "Url": "",
+                "Image attachment": [{"url": ""}],
+                "Image status": "",
+            }
+        )
+    queue.close()
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scenarios",
+        default="browse,submit,sync,concurrent",
+        help="comma-separated scenarios to run",
+    )
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--browse", type=int, default=30, help="species to browse")
+    parser.add_argument("--submissions", type=int, default=500)
+    parser.add_argument("--photo-every", type=int, default=50)
+    parser.add_argument("--sync-records", type=int, default=1000)
+    parser.add_argument(
+        "--sink",
+        default="airtable",
+        choices=["airtable", "sqlite", "duckdb", "jsonl"],
+        help="where the sync scenario sends the observations",
+    )
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--inaturalist-latency", type=float, default=0.1)
+    parser.add_argument("--imgur-latency", type=float, default=0.5)
+    parser.add_argument("--airtable-latency", type=float, default=0.1)
+    parser.add_argument("--airtable-rate-limit", type=float, default=5)
+    parser.add_argument("--ingest-latency", type=float, default=0.1)
+    parser.add_argument("--failure-rate", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    species = TaxonomyCatalog.from_csv(os.path.join(ROOT, "data.csv")).common_names()
+    behaviors = {
+        "inaturalist": Behavior(
+            args.inaturalist_latency, args.inaturalist_latency / 2, None, args.failure_rate
+        ),
+        "imgur": Behavior(
+            args.imgur_latency, args.imgur_latency / 2, None, args.failure_rate
+        ),
+        "airtable": Behavior(
+            args.airtable_latency,
+            args.airtable_latency / 2,
+            args.airtable_rate_limit,
+            args.failure_rate,
+        ),
+        "ingest": Behavior(
+            args.ingest_latency, args.ingest_latency / 2, None, args.failure_rate
+        ),
+    }
+    results = {
+        "commit": commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "scenarios": {},
+    }
+
+    for name in args.scenarios.split(","):
+        services = {
+            "inaturalist": MockINaturalist(behaviors["inaturalist"], args.seed).start(),
+            "imgur": MockImgur(behaviors["imgur"], args.seed).start(),
+            "airtable": MockAirtable(behaviors["airtable"], args.seed).start(),
+            "ingest": MockIngest(behaviors["ingest"], args.seed).start(),
+        }
+        with tempfile.TemporaryDirectory() as state_dir:
+            if name == "sync":
+                seed_queue(state_dir, species, args.sync_records)
+            print(f"Running {name}...", file=sys.stderr)
+            sink = sink_spec(args.sink, state_dir, services["ingest"])
+            with AppServer(
+                state_dir,
+                services["inaturalist"],
+                services["imgur"],
+                services["airtable"],
+                sink,
+                trace=name == "trace",
+            ) as app:
+                if name == "browse":
+                    result = browse(app, species, args.browse)
+                elif name == "submit":
+                    photo = make_photo(os.path.join(state_dir, "photo.jpg"))
+                    result = submit(
+                        app,
+                        services["imgur"],
+                        species,
+                        args.submissions,
+                        photo,
+                        args.photo_every,
+                    )
+                elif name == "sync":
+                    result = sync(app, args.sync_records)
+                    result["sink"] = args.sink
+                elif name == "concurrent":
+                    result = concurrent(app, species, args.sessions, 5, 10)
+                elif name == "trace":
+                    result = trace(app, species)
+                else:
+                    parser.error(f"unknown scenario {name!r}")
+            if name == "sync":
+                # once the app has stopped, as DuckDB locks its file while open
+                result["records_stored"] = stored_records(
+                    args.sink, state_dir, services
+                )
+        result["services"] = {
+            service_name: service.stats() for service_name, service in services.items()
+        }
+        for service in services.values():
+            service.stop()
+        results["scenarios"][name] = result
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
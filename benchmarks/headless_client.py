@@ -0,0 +1,149 @@
+"""
+Minimal headless Shiny client for the benchmark scenarios.
+
+It speaks the Shiny websocket protocol to a running app the way a browser
+does: it sends the initial inputs, input updates and file uploads, and
+collects the messages the server sends back, so a scenario can time how long
+each user action takes to produce its output.
+"""
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+
+from websockets.sync.client import connect
+
+
+class ShinyClient:
+    """
+    One browser session of a Shiny app.
+
+    Args:
+        base_url (str): The app's URL, e.g. http://127.0.0.1:8000.
+        inputs (dict): The initial input values. Names may carry a type
+            suffix, as in "submit:shiny.action".
+        cookies (dict): Cookies the browser would send, such as its device ID.
+    """
+
+    def __init__(self, base_url, inputs, cookies=None):
+        self.base_url = base_url.rstrip("/")
+        ws_url = "ws" + self.base_url[len("http") :] + "/websocket/"
+        headers = {}
+        if cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in cookies.items())
+        self._ws = connect(ws_url, max_size=None, additional_headers=headers)
+        self._messages = queue.Queue()
+        self._tag = 0
+        self._actions = {}
+        self.session_id = None
+        threading.Thread(target=self._read, daemon=True).start()
+        self._send({"method": "init", "data": inputs})
+        self.wait_for(lambda message: "config" in message)
+
+    def update(self, inputs):
+        """
+        Sends new input values.
+        """
+        self._send({"method": "update", "data": inputs})
+
+    def click(self, button):
+        """
+        Clicks an action button.
+        """
+        self._actions[button] = self._actions.get(button, 0) + 1
+        self.update({f"{button}:shiny.action": self._actions[button]})
+
+    def wait_for(self, predicate, timeout=60):
+        """
+        Waits for a server message matching a predicate.
+
+        Returns:
+            dict: The matching message.
+
+        Raises:
+            TimeoutError: If no message matched in time.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("no matching message from the app")
+            try:
+                message = self._messages.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if "closed" in message:
+                raise ConnectionError(message["closed"])
+            if "config" in message:
+                self.session_id = message["config"]["sessionId"]
+            if predicate(message):
+                return message
+
+    def drain(self):
+        """
+        Drops the messages received so far.
+        """
+        while not self._messages.empty():
+            self._messages.get_nowait()
+
+    def upload(self, input_id, path, content_type="image/jpeg"):
+        """
+        Uploads a file into a file input, like picking it in the browser.
+        """
+        size = os.path.getsize(path)
+        tag = self._request(
+            "uploadInit",
+            [[{"name": os.path.basename(path), "size": size, "type": content_type}]],
+        )
+        response = self.wait_for(
+            lambda m: m.get("response", {}).get("tag") == tag
+        )["response"]["value"]
+        with open(path, "rb") as file:
+            request = urllib.request.Request(
+                f"{self.base_url}/{response['uploadUrl']}",
+                data=file.read(),
+                method="POST",
+            )
+        with urllib.request.urlopen(request) as reply:
+            reply.read()
+        tag = self._request("uploadEnd", [response["jobId"], input_id])
+        self.wait_for(lambda m: m.get("response", {}).get("tag") == tag)
+
+    def get(self, path):
+        """
+        Fetches a path of the app, e.g. a session's dynamic route, as JSON.
+        """
+        with urllib.request.urlopen(f"{self.base_url}/{path.lstrip('/')}") as reply:
+            return json.loads(reply.read())
+
+    def close(self):
+        self._ws.close()
+
+    def _request(self, method, args):
+        self._tag += 1
+        self._send({"method": method, "args": args, "tag": self._tag})
+        return self._tag
+
+    def _send(self, message):
+        self._ws.send(json.dumps(message))
+
+    def _read(self):
+        try:
+            for text in self._ws:
+                self._messages.put(json.loads(text))
+        except Exception as e:  # the connection is gone; tell the waiting thread
+            self._messages.put({"closed": str(e)})
+        else:
+            self._messages.put({"closed": "connection closed"})
+
+
+def output_html(message, output_id):
+    """
+    Returns the HTML a message sets an output to, or None.
+    """
+    value = message.get("values", {}).get(output_id)
+    if isinstance(value, dict):
+        return value.get("html")
+    return None
@@ -0,0 +1,264 @@
+"""
+Local stand-ins for the iNaturalist, Imgur and Airtable APIs and for a bulk
+ingestion endpoint, used by the benchmark scenarios.
+
+Each service runs a threaded HTTP server on a free local port. Its latency,
+rate limit and failure rate are configurable, and it counts the requests it
+served by status code, so a benchmark can report how many calls the app made
+and how many were throttled or failed.
+"""
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qs, urlsplit
+
+
+class Behavior(NamedTuple):
+    """
+    How a mock service responds.
+
+    latency: seconds added to every response.
+    jitter: up to this many more seconds, drawn at random.
+    rate_limit: requests per second served before answering 429, or None.
+    failure_rate: share of requests answered with a 503.
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    rate_limit: Optional[float] = None
+    failure_rate: float = 0.0
+
+
+class MockService:
+    """
+    Base class of the mock APIs. Subclasses implement handle().
+
+    Args:
+        behavior (Behavior): Latency, rate limit and failures to inject.
+        seed (int): Seed of the random failures and jitter, so runs repeat.
+    """
+
+    # path prefix of the API, appended to the server address in url
+    prefix = ""
+
+    def __init__(self, behavior=Behavior(), seed=0):
+        self.behavior = behavior
+        self.statuses = Counter()
+        self.bytes_received = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}{self.prefix}"
+
+    @property
+    def requests(self):
+        return sum(self.statuses.values())
+
+    def start(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                service._respond(self, None)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                service._respond(self, self.rfile.read(length))
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        # the app hanging up mid-response is expected when it is stopped
+        self._server.handle_error = lambda request, client_address: None
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "statuses": {str(code): count for code, count in self.statuses.items()},
+            "bytes_received": self.bytes_received,
+        }
+
+    def handle(self, method, path, query, body):
+        """
+        Answers one request that was not throttled or failed on purpose.
+
+        Returns:
+            tuple: (status code, JSON-serializable body).
+        """
+        raise NotImplementedError
+
+    def _respond(self, handler, body):
+        behavior = self.behavior
+        with self._lock:
+            self.bytes_received += len(body or b"")
+            delay = behavior.latency + self._random.random() * behavior.jitter
+            failed = self._random.random() < behavior.failure_rate
+            throttled = False
+            if behavior.rate_limit:
+                now = time.monotonic()
+                while self._recent and now - self._recent[0] >= 1.0:
+                    self._recent.popleft()
+                throttled = len(self._recent) >= behavior.rate_limit
+                if not throttled:
+                    self._recent.append(now)
+        time.sleep(delay)
+
+        headers = {}
+        if throttled:
+            status, payload = 429, {"error": "RATE_LIMIT_REACHED"}
+            headers["Retry-After"] = "1"
+        elif failed:
+            status, payload = 503, {"error": "SERVICE_UNAVAILABLE"}
+        else:
+            parts = urlsplit(handler.path)
+            status, payload = self.handle(
+                handler.command, parts.path, parse_qs(parts.query), body
+            )
+        with self._lock:
+            self.statuses[status] += 1
+
+        data = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+class MockINaturalist(MockService):
+    """
+    Answers taxa/autocomplete and taxa/{id} with a stable taxon ID and three
+    photo URLs per species.
+    """
+
+    prefix = "/v1"
+
+    def handle(self, method, path, query, body):
+        if path.endswith("/taxa/autocomplete"):
+            name = query.get("q", [""])[0]
+            taxon_id = sum(map(ord, name)) * 7919 % 1_000_000 + 1
+            return 200, {"results": [{"id": taxon_id}]}
+        taxon_id = path.rsplit("/", 1)[-1]
+        photos = [
+            {"photo": {"large_url": f"https://photos.example/{taxon_id}/{i}.jpg"}}
+            for i in range(3)
+        ]
+        return 200, {"results": [{"taxon_photos": photos}]}
+
+
+class MockImgur(MockService):
+    """
+    Accepts image uploads and returns a link for each.
+    """
+
+    prefix = "/3/upload"
+
+    def __init__(self, behavior=Behavior(), seed=0):
+        super().__init__(behavior, seed)
+        self.uploads = 0
+
+    def handle(self, method, path, query, body):
+        with self._lock:
+            self.uploads += 1
+            number = self.uploads
+        return 200, {"data": {"link": f"https://i.example/{number}.jpg"}}
+
+
+class MockAirtable(MockService):
+    """
+    Accepts create-records requests of up to 10 records, like Airtable, and
+    keeps the fields of every record it created. Lists them back in pages of
+    up to 100 with an offset cursor, optionally only those modified after
+    the time in an IS_AFTER(LAST_MODIFIED_TIME(), '...') formula.
+    """
+
+    prefix = "/v0"
+
+    def __init__(self, behavior=Behavior(rate_limit=5), seed=0):
+        super().__init__(behavior, seed)
+        self.records = []
+        self._modified = []
+
+    def handle(self, method, path, query, body):
+        if method == "GET":
+            return self._list(query)
+        records = json.loads(body)["records"]
+        if len(records) > 10:
+            return 422, {"error": "INVALID_RECORDS"}
+        with self._lock:
+            start = len(self.records)
+            self.records.extend(record["fields"] for record in records)
+            self._modified.extend([time.time()] * len(records))
+        return 200, {
+            "records": [
+                {"id": f"rec{start + i}", "fields": record["fields"]}
+                for i, record in enumerate(records)
+            ]
+        }
+
+    def _list(self, query):
+        since = None
+        formula = query.get("filterByFormula", [""])[0]
+        if formula.startswith("IS_AFTER(LAST_MODIFIED_TIME(), '"):
+            stamp = formula.split("'")[1]
+            since = datetime.strptime(stamp, "%Y-%m-%dT%H:%M:%S.000Z")
+            since = since.replace(tzinfo=timezone.utc).timestamp()
+        page_size = min(100, int(query.get("pageSize", ["100"])[0]))
+        offset = int(query.get("offset", ["0"])[0])
+        with self._lock:
+            matching = [
+                (i, fields)
+                for i, fields in enumerate(self.records)
+                if since is None or self._modified[i] > since
+            ]
+        page = matching[offset : offset + page_size]
+        payload = {"records": [{"id": f"rec{i}", "fields": f} for i, f in page]}
+        if offset + page_size < len(matching):
+            payload["offset"] = str(offset + page_size)
+        return 200, payload
+
+
+class MockIngest(MockService):
+    """
+    Accepts batches of records as JSON Lines, like a bulk ingestion endpoint
+    behind the jsonl sink, and keeps every record.
+    """
+
+    prefix = "/ingest"
+
+    def __init__(self, behavior=Behavior(), seed=0):
+        super().__init__(behavior, seed)
+        self.records = []
+
+    def handle(self, method, path, query, body):
+        if method != "POST":
+            return 405, {"error": "METHOD_NOT_ALLOWED"}
+        try:
+            records = [json.loads(line) for line in body.decode().splitlines() if line]
+        except ValueError:
+            return 400, {"error": "INVALID_JSON_LINES"}
+        with self._lock:
+            self.records.extend(records)
+        return 200, {"accepted": len(records)}
@@ -0,0 +1,28 @@
+"""
+Shared fixtures of the tests. The mock services of the benchmarks stand in for
+iNaturalist, Imgur, Airtable and the ingestion endpoint.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from mock_services import Behavior, MockAirtable, MockIngest  # noqa: E402
+
+
+@pytest.fixture
+def airtable():
+    service = MockAirtable(Behavior()).start()
+    yield service
+    service.stop()
+
+
+@pytest.fixture
+def ingest():
+    service = MockIngest(Behavior()).start()
+    yield service
+    service.stop()
@@ -0,0 +1,16 @@
+import httpx
+
+from app_files.http_client import HttpClient
+
+
+def test_http2_without_h2_falls_back_to_http1(airtable, monkeypatch):
+    def client_without_h2(*args, **kwargs):
+        raise ImportError("Using http2=True, but the 'h2' package is not installed.")
+
+    monkeypatch.setattr(httpx, "Client", client_without_h2)
+    client = HttpClient(http2=True)
+    response = client.get(f"{airtable.url}/base/observations", endpoint="list")
+    assert response.status_code == 200
+    assert client._httpx is None
+    assert client.stats()["list"]["errors"] == 0
+    client.close()
@@ -0,0 +1,97 @@
+import pytest
+
+from app_files import image_cache
+from app_files.airtable_utils import SpeciesPhotos
+from app_files.image_cache import SpeciesImageCache
+
+
+class Clock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Fetcher:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, genus, species):
+        self.calls.append((genus, species))
+        return SpeciesPhotos(len(self.calls), [f"https://photos.example/{species}.jpg"])
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(image_cache.time, "time", clock)
+    return clock
+
+
+def test_entries_are_fetched_again_once_expired(tmp_path, clock):
+    fetcher = Fetcher()
+    cache = SpeciesImageCache(str(tmp_path / "cache.sqlite3"), ttl=60, fetcher=fetcher)
+    first = cache.get("Apis", "mellifera")
+    clock.now += 59
+    assert cache.get("Apis", "mellifera") == first
+    clock.now += 2
+    assert cache.get("Apis", "mellifera") != first
+    assert len(fetcher.calls) == 2
+    assert cache.stats()["misses"] == 2
+    cache.close()
+
+
+def test_workers_share_the_disk_store(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite3")
+    fetcher = Fetcher()
+    one = SpeciesImageCache(path, fetcher=fetcher)
+    other = SpeciesImageCache(path, fetcher=fetcher)
+    photos = one.get("Apis", "mellifera")
+    assert other.get("apis", "Mellifera") == photos
+    assert len(fetcher.calls) == 1
+    assert other.stats()["disk_hits"] == 1
+    one.close()
+    other.close()
+
+
+def test_least_recently_used_species_are_evicted(tmp_path, clock):
+    fetcher = Fetcher()
+    cache = SpeciesImageCache(
+        str(tmp_path / "cache.sqlite3"),
+        max_entries=2,
+        memory_entries=1,
+        fetcher=fetcher,
+    )
+    for species in ("a", "b"):
+        clock.now += 1
+        cache.get("Genus", species)
+    clock.now += 1
+    # from disk, as the in-process LRU only holds "b"
+    cache.get("Genus", "a")
+    clock.now += 1
+    cache.get("Genus", "c")
+    assert cache.stats()["disk_entries"] == 2
+    assert cache.stats()["memory_entries"] == 1
+    assert cache.cached("Genus", "a") is not None
+    assert cache.cached("Genus", "b") is None
+    cache.close()
+
+
+def test_preload_keeps_fresh_entries_and_replaces_expired_ones(tmp_path, clock):
+    cache = SpeciesImageCache(str(tmp_path / "cache.sqlite3"), ttl=60, fetcher=None)
+    cache.put("Genus", "fresh", SpeciesPhotos(1, ["fresh.jpg"]))
+    cache.put("Genus", "stale", SpeciesPhotos(2, ["stale.jpg"]), clock.now - 120)
+    cache.preload(
+        {
+            ("Genus", "fresh"): SpeciesPhotos(3, ["prefetched.jpg"]),
+            ("Genus", "stale"): SpeciesPhotos(4, ["prefetched.jpg"]),
+        }
+    )
+    cache._memory.clear()
+    assert cache.cached("Genus", "fresh").taxon_id == 1
+    assert cache.cached("Genus", "stale").taxon_id == 4
+    # preloaded entries count as fetched when they are loaded
+    clock.now += 59
+    assert cache.cached("Genus", "stale") is not None
+    cache.close()
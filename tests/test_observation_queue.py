@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+
+from app_files.observation_queue import ObservationQueue
+
+
+@pytest.fixture
+def queues(tmp_path):
+    """
+    Two queues on one file, like two worker processes.
+    """
+    path = str(tmp_path / "observations.sqlite3")
+    one, other = ObservationQueue(path), ObservationQueue(path)
+    yield one, other
+    one.close()
+    other.close()
+
+
+def record(queue, count, device=None, uploading=False):
+    return [
+        queue.append({"Count": i + 1}, device, uploading=uploading)
+        for i in range(count)
+    ]
+
+
+def test_a_claim_keeps_other_workers_off_until_released(queues):
+    one, other = queues
+    ids = record(one, 3)
+    assert one.claim(ids) == ids
+    assert other.claim(ids) == []
+    # the holder may claim its own observations again
+    assert one.claim(ids[:1]) == ids[:1]
+    one.release(ids[1:])
+    assert other.claim(ids) == ids[1:]
+
+
+def test_expired_claims_are_taken_over(queues):
+    one, other = queues
+    ids = record(one, 2)
+    assert one.claim(ids, lease=-1) == ids
+    assert other.claim(ids) == ids
+
+
+def test_concurrent_claims_never_overlap(queues):
+    ids = record(queues[0], 200)
+    claimed = {}
+
+    def claim(queue):
+        claimed[queue.owner] = set(queue.claim(ids))
+
+    threads = [threading.Thread(target=claim, args=(queue,)) for queue in queues]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    first, second = claimed.values()
+    assert not first & second
+    assert first | second == set(ids)
+
+
+def test_acknowledged_observations_are_neither_pending_nor_claimable(queues):
+    one, other = queues
+    ids = record(one, 3)
+    one.claim(ids)
+    one.acknowledge(ids[:2])
+    assert [obs_id for obs_id, _ in other.pending()] == ids[2:]
+    assert other.pending_ids(ids) == set(ids[2:])
+    one.release(ids[2:])
+    assert other.claim(ids) == ids[2:]
+
+
+def test_devices_only_see_and_claim_their_own(queues):
+    one, other = queues
+    mine = record(one, 2, device="device-a")
+    theirs = record(one, 1, device="device-b")
+    assert [obs_id for obs_id, _ in other.pending("device-a")] == mine
+    assert other.claim(mine + theirs, device="device-a") == mine
+    assert other.discard(theirs, device="device-a") == []
+
+
+def test_only_adopting_devices_take_over_unowned_observations(queues):
+    one, other = queues
+    unowned = record(one, 2)
+    assert other.pending("session-1", adopt=False) == []
+    assert [obs_id for obs_id, _ in other.unowned()] == unowned
+    assert [obs_id for obs_id, _ in other.pending("device-a")] == unowned
+    assert other.unowned() == []
+    one.disown("device-a")
+    assert [obs_id for obs_id, _ in other.unowned()] == unowned
+
+
+def test_upload_lease_is_live_until_it_runs_out(queues):
+    one, other = queues
+    (uploading,) = record(one, 1, uploading=True)
+    (done,) = record(one, 1)
+    assert other.live_uploads([uploading, done]) == {uploading}
+    one.renew_upload(uploading, lease=-1)
+    assert other.live_uploads([uploading]) == set()
+    one.renew_upload(uploading)
+    assert other.live_uploads([uploading]) == {uploading}
+
+
+def test_pending_fields_follow_updates_from_another_worker(queues):
+    one, other = queues
+    (obs_id,) = record(one, 1, uploading=True)
+    one.update(obs_id, {"Count": 1, "Image status": "uploaded"})
+    assert other.pending_fields([obs_id]) == {
+        obs_id: {"Count": 1, "Image status": "uploaded"}
+    }
+    one.acknowledge([obs_id])
+    assert other.pending_fields([obs_id]) == {}
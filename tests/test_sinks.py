@@ -0,0 +1,85 @@
+import pytest
+from mock_services import Behavior, MockIngest
+
+from app_files import sync
+from app_files.sinks import JsonlSink, SQLiteSink, open_sink
+from app_files.sync import sync_records
+
+
+def observations(count, start=1):
+    return [
+        (i, {"Common Name": "Argentine Ant", "Count": i, "Notes": "é"})
+        for i in range(start, start + count)
+    ]
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(sync, "backoff_delay", lambda attempt: 0)
+
+
+def test_sqlite_sink_stores_every_batch(tmp_path):
+    sink = SQLiteSink(str(tmp_path / "synced.sqlite3"), batch_size=3)
+    result = sync_records(observations(7), sink)
+    assert result.synced == list(range(1, 8))
+    assert result.failed == []
+    assert sink.count() == 7
+    stored = sink._db.execute(
+        "SELECT json_extract(fields, '$.Count'), json_extract(fields, '$.Notes')"
+        " FROM observations ORDER BY id"
+    ).fetchall()
+    assert stored == [(i, "é") for i in range(1, 8)]
+    sink.close()
+
+
+def test_sqlite_sink_stores_all_of_a_batch_or_none(tmp_path):
+    sink = SQLiteSink(str(tmp_path / "synced.sqlite3"), batch_size=2)
+    # the third observation is refused, after the second was inserted
+    sink._db.execute(
+        "CREATE TRIGGER refuse BEFORE INSERT ON observations"
+        " WHEN json_extract(NEW.fields, '$.Count') = 3"
+        " BEGIN SELECT RAISE(ABORT, 'refused'); END"
+    )
+    error = sink.send_batch([fields for _, fields in observations(3, start=2)])
+    assert error == "refused"
+    assert sink.count() == 0
+    result = sync_records(observations(5), sink)
+    assert result.synced == [1, 2, 5]
+    assert result.failed == [3, 4]
+    assert result.errors == ["refused"]
+    assert sink.count() == 3
+    sink.close()
+
+
+def test_jsonl_sink_posts_batches_of_json_lines(ingest):
+    sink = JsonlSink(ingest.url, batch_size=1000)
+    records = observations(2500)
+    result = sync_records(records, sink)
+    assert sorted(result.synced) == [key for key, _ in records]
+    assert ingest.requests == 3
+    assert sorted(ingest.records, key=lambda r: r["Count"]) == [
+        fields for _, fields in records
+    ]
+
+
+def test_jsonl_sink_reports_batches_it_could_not_send(no_backoff):
+    ingest = MockIngest(Behavior(failure_rate=1.0)).start()
+    try:
+        sink = JsonlSink(ingest.url, batch_size=2, max_retries=1)
+        result = sync_records(observations(3), sink)
+    finally:
+        ingest.stop()
+    assert result.synced == []
+    assert result.failed == [1, 2, 3]
+    assert len(result.errors) == 2
+    assert all(error.startswith("503") for error in result.errors)
+    assert ingest.records == []
+    # each batch was tried twice
+    assert ingest.requests == 4
+
+
+def test_open_sink_rejects_unknown_descriptions():
+    with pytest.raises(ValueError):
+        open_sink("sqlite")
+    with pytest.raises(ValueError):
+        open_sink("postgres:observations")
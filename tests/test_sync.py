@@ -0,0 +1,125 @@
+import time
+
+import pytest
+from mock_services import Behavior, MockAirtable, MockService
+
+from app_files import sync
+from app_files.sync import TokenBucket, post_batch, post_with_retries
+
+
+class ScriptedService(MockService):
+    """
+    Answers with the given status codes in turn, then with 200.
+    """
+
+    def __init__(self, statuses):
+        super().__init__(Behavior())
+        self.script = list(statuses)
+
+    def handle(self, method, path, query, body):
+        status = self.script.pop(0) if self.script else 200
+        return status, {"status": status}
+
+
+@pytest.fixture
+def scripted():
+    services = []
+
+    def start(*statuses):
+        services.append(ScriptedService(statuses).start())
+        return services[-1]
+
+    yield start
+    for service in services:
+        service.stop()
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(sync, "backoff_delay", lambda attempt: 0)
+
+
+def ok(response):
+    return None
+
+
+def test_server_errors_are_retried(scripted, no_backoff):
+    service = scripted(503, 502)
+    assert post_with_retries(service.url, "test", None, ok, json={}) is None
+    assert service.statuses == {503: 1, 502: 1, 200: 1}
+
+
+def test_client_errors_are_not_retried(scripted, no_backoff):
+    service = scripted(422)
+    error = post_with_retries(service.url, "test", None, ok, json={})
+    assert error.startswith("422")
+    assert service.requests == 1
+
+
+def test_retries_give_up_after_max_retries(scripted, no_backoff):
+    service = scripted(*[503] * 10)
+    error = post_with_retries(service.url, "test", None, ok, max_retries=2, json={})
+    assert error.startswith("503")
+    assert service.requests == 3
+
+
+def test_check_decides_the_outcome_of_a_success(scripted):
+    service = scripted()
+    error = post_with_retries(service.url, "test", None, lambda r: "bad", json={})
+    assert error == "bad"
+
+
+def test_rate_limited_requests_wait_for_retry_after(no_backoff):
+    airtable = MockAirtable(Behavior(rate_limit=1)).start()
+    url = f"{airtable.url}/base/observations"
+    try:
+        assert post_batch(url, {}, [{"Count": 1}], None) is None
+        start = time.monotonic()
+        assert post_batch(url, {}, [{"Count": 2}], None) is None
+        assert time.monotonic() - start >= 1
+    finally:
+        airtable.stop()
+    assert airtable.statuses == {200: 2, 429: 1}
+    assert airtable.records == [{"Count": 1}, {"Count": 2}]
+
+
+class FakeTime:
+    """
+    A clock that only moves when the bucket sleeps.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    fake = FakeTime()
+    # 4 tokens a second, so that the waits are exact in binary
+    bucket = TokenBucket(4, clock=fake.clock, sleep=fake.sleep)
+    for _ in range(4):
+        bucket.acquire()
+    assert fake.sleeps == []
+    for _ in range(8):
+        bucket.acquire()
+    assert fake.now == pytest.approx(2.0)
+
+
+def test_token_bucket_saves_up_to_its_capacity():
+    fake = FakeTime()
+    bucket = TokenBucket(2, capacity=4, clock=fake.clock, sleep=fake.sleep)
+    for _ in range(4):
+        bucket.acquire()
+    fake.now += 10
+    for _ in range(4):
+        bucket.acquire()
+    assert fake.sleeps == []
+    bucket.acquire()
+    assert fake.sleeps == [pytest.approx(0.5)]
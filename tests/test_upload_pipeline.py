@@ -0,0 +1,58 @@
+import asyncio
+import os
+
+import pytest
+
+from app_files.upload_pipeline import UploadError, UploadPipeline
+
+
+def picked_photo(tmp_path):
+    # where Shiny keeps a session's uploads
+    session_dir = tmp_path / "session"
+    session_dir.mkdir()
+    path = session_dir / "0.jpg"
+    path.write_bytes(b"photo")
+    return str(path)
+
+
+def test_spooled_photos_outlive_their_session_and_go_once_uploaded(tmp_path):
+    uploaded = []
+
+    def upload(path):
+        uploaded.append(open(path, "rb").read())
+        return "https://i.example/1.jpg"
+
+    spool_dir = tmp_path / "spool"
+    pipeline = UploadPipeline(upload, preprocess=None, spool_dir=str(spool_dir))
+    path = pipeline.spool(picked_photo(tmp_path))
+    # the session ends, and Shiny deletes its uploads
+    os.rmdir(tmp_path / "session")
+    result = asyncio.run(pipeline.upload(path))
+    assert result.url == "https://i.example/1.jpg"
+    assert uploaded == [b"photo"]
+    assert os.listdir(spool_dir) == []
+    pipeline.shutdown()
+
+
+def test_spooled_photos_go_when_the_upload_fails(tmp_path):
+    spool_dir = tmp_path / "spool"
+    pipeline = UploadPipeline(
+        lambda path: None,
+        preprocess=None,
+        max_attempts=1,
+        spool_dir=str(spool_dir),
+    )
+    path = pipeline.spool(picked_photo(tmp_path))
+    with pytest.raises(UploadError):
+        asyncio.run(pipeline.upload(path))
+    assert os.listdir(spool_dir) == []
+    pipeline.shutdown()
+
+
+def test_photos_are_uploaded_in_place_without_a_spool(tmp_path):
+    pipeline = UploadPipeline(lambda path: "https://i.example/1.jpg", preprocess=None)
+    path = picked_photo(tmp_path)
+    assert pipeline.spool(path) == path
+    asyncio.run(pipeline.upload(path))
+    assert os.path.exists(path)
+    pipeline.shutdown()